@@ -5,12 +5,14 @@ import numpy as np
 import itertools
 import os
 import shutil
+from bpy.props import BoolProperty
 from bpy_extras.io_utils import ExportHelper
 from bpy_extras.image_utils import load_image
 from bpy_extras.object_utils import object_data_add
 from mathutils import Vector
 from ..CollatedData.ToReadWrites import generate_files_from_intermediate_format
 from ..CollatedData.IntermediateFormat import IntermediateFormat
+from ..Utilities.VertexArrays import VertexArrays
 from ..FileReaders.GeomReader.ShaderUniforms import shader_uniforms_from_names, shader_textures, shader_uniforms_vp_fp_from_names
 
 
@@ -19,6 +21,15 @@ class ExportDSCSBase:
     bl_options = {'REGISTER'}
     filename_ext = ".name"
 
+    use_triangle_strips: BoolProperty(
+        name="Use Triangle Strips",
+        description="Enable/disable to write meshes as triangle strips wherever this gives fewer indices than a triangle list.",
+        default=False)
+    optimise_vertex_cache: BoolProperty(
+        name="Optimise Vertex Cache",
+        description="Enable/disable to reorder triangles and vertices for better GPU vertex cache reuse.",
+        default=False)
+
     def export_file(self, context, filepath, platform, copy_shaders=True):
         # Grab the parent object
         parent_obj = self.get_model_to_export()
@@ -45,7 +56,8 @@ class ExportDSCSBase:
         model_data.unknown_data['unknown_cam_data_1'] = parent_obj.get('unknown_cam_data_1', [])
         model_data.unknown_data['unknown_cam_data_2'] = parent_obj.get('unknown_cam_data_2', [])
         model_data.unknown_data['unknown_footer_data'] = parent_obj.get('unknown_footer_data', b'')
-        generate_files_from_intermediate_format(filepath, model_data, platform)
+        generate_files_from_intermediate_format(filepath, model_data, platform,
+                                                self.use_triangle_strips, self.optimise_vertex_cache)
 
     def get_model_to_export(self):
         try:
@@ -64,6 +76,7 @@ class ExportDSCSBase:
     def export_skeleton(self, parent_obj, model_data):
         model_armature = parent_obj.children[0]
         bone_name_list = [bone.name for bone in model_armature.data.bones]
+        bone_matrices = []
         for i, bone in enumerate(model_armature.data.bones):
             name = bone.name
             parent_bone = bone.parent
@@ -71,7 +84,8 @@ class ExportDSCSBase:
 
             model_data.skeleton.bone_names.append(name)
             model_data.skeleton.bone_relations.append([i, parent_id])
-            model_data.skeleton.inverse_bind_pose_matrices.append(np.linalg.inv(np.array(bone.matrix_local)))
+            bone_matrices.append(np.array(bone.matrix_local))
+        model_data.skeleton.inverse_bind_pose_matrices = list(np.linalg.inv(np.reshape(bone_matrices, (-1, 4, 4))))
 
         # Get the unknown data
         model_data.skeleton.unknown_data['unknown_0x0C'] = model_armature.get('unknown_0x0C', 0)
@@ -86,19 +100,19 @@ class ExportDSCSBase:
             md = model_data.new_mesh()
             mesh = mesh_obj.data
 
-            link_loops = self.generate_link_loops(mesh)
-            face_link_loops = self.generate_face_link_loops(mesh)
-            export_verts, export_faces, vgroup_verts, vgroup_wgts = self.split_verts_by_uv(mesh_obj, link_loops, face_link_loops, model_data)
-
-            md.vertices = export_verts
-            for j, face in enumerate(export_faces):
-                assert len(face) == 3, f"Polygon {j} is not a triangle."
+            md.vertices, export_faces = self.split_verts_by_uv(mesh_obj)
+            for face in export_faces:
                 md.add_polygon(face)
 
-            for group in get_all_nonempty_vertex_groups(mesh_obj):
+            # The skinning matrices hold indices into the list of non-empty vertex groups
+            vertex_idxs, slots = np.nonzero(md.vertices.bone_weights)
+            vertex_group_idxs = md.vertices.bone_indices[vertex_idxs, slots]
+            for vertex_group_idx, group in enumerate(get_all_nonempty_vertex_groups(mesh_obj)):
                 bone_name = group.name
                 bone_id = model_data.skeleton.bone_names.index(bone_name)
-                md.add_vertex_group(bone_id, vgroup_verts.get(bone_id, []), vgroup_wgts.get(bone_id, []))
+                is_in_group = vertex_group_idxs == vertex_group_idx
+                md.add_vertex_group(bone_id, vertex_idxs[is_in_group],
+                                    md.vertices.bone_weights[vertex_idxs[is_in_group], slots[is_in_group]])
 
             matname = mesh.materials[0].name
             if matname not in mat_names:
@@ -112,31 +126,19 @@ class ExportDSCSBase:
             md.unknown_data['unknown_0x36'] = mesh_obj.get('unknown_0x36', 0)
             md.unknown_data['unknown_0x4C'] = mesh_obj.get('unknown_0x4C', 0)
 
-    def generate_link_loops(self, mesh):
-        link_loops = {}
-        for loop in mesh.loops:
-            if loop.vertex_index not in link_loops:
-                link_loops[loop.vertex_index] = []
-            link_loops[loop.vertex_index].append(loop.index)
-        return link_loops
-
-    def generate_face_link_loops(self, mesh):
-        face_link_loops = {}
-        for face in mesh.polygons:
-            for loop_idx in face.loop_indices:
-                face_link_loops[loop_idx] = face.index
-        return face_link_loops
-
-    def split_verts_by_uv(self, mesh_obj, link_loops, face_link_loops, model_data):
+    def split_verts_by_uv(self, mesh_obj):
+        """
+        Splits the Blender vertices so that there is one exported vertex per unique combination of vertex, UVs and
+        vertex colour among the loops that use it. Exported vertices are ordered by the first loop that uses them.
+
+        Returns
+        ------
+        The exported vertices as VertexArrays, and an (M, 3) array of triangles indexing into them.
+        """
         mesh = mesh_obj.data
         has_uvs = len(mesh.uv_layers) > 0
         if has_uvs:
             mesh.calc_tangents()
-        exported_vertices = []
-        vgroup_verts = {}
-        vgroup_wgts = {}
-        faces = [{l: mesh.loops[l].vertex_index for l in f.loop_indices} for f in mesh.polygons]
-        group_map = {g.index: i for i, g in enumerate(get_all_nonempty_vertex_groups(mesh_obj))}
 
         if 'UV3Map' in mesh.uv_layers:
             map_ids = ['UVMap', 'UV2Map', 'UV3Map']
@@ -149,69 +151,73 @@ class ExportDSCSBase:
         colour_map = []
         if 'Map' in mesh.vertex_colors:
             colour_map = ['Map']
-        n_uvs = len(map_ids)
-        n_colours = len(colour_map)
-
-        def generating_function(lidx):
-            uvs = [tuple(mesh.uv_layers[map_id].data.values()[lidx].uv) for map_id in map_ids]
-            colour = [tuple((mesh.vertex_colors[map_id].data.values()[lidx].color)) for map_id in colour_map]
-
-            return tuple([*uvs, *colour])
-
-        for vert_idx, linked_loops in link_loops.items():
-            vertex = mesh.vertices[vert_idx]
-            loop_datas = [generating_function(ll) for ll in linked_loops]
-            unique_values = list(set(loop_datas))
-            for unique_value in unique_values:
-                loops_with_this_value = [linked_loops[i] for i, x in enumerate(loop_datas) if x == unique_value]
-                loop_objs_with_this_value = [mesh.loops[lidx] for lidx in loops_with_this_value]
-                group_bone_ids = [get_bone_id(mesh_obj, model_data.skeleton.bone_names, grp) for grp in vertex.groups]
-                group_bone_ids = None if len(group_bone_ids) == 0 else group_bone_ids
-                group_weights = [grp.weight for grp in vertex.groups]
-                group_weights = None if len(group_weights) == 0 else group_weights
-
-                if has_uvs:
-                    tangents = [l.tangent for l in loop_objs_with_this_value]
-                    normals = [l.normal for l in loop_objs_with_this_value]
-                    signs = [l.bitangent_sign  for l in loop_objs_with_this_value]
-                    if not all([sign == signs[0] for sign in signs]):
-                        print("!!!! WARNING !!!!")
-                        print("Not all bitangents of loops attached to an exported vertex have the same sign!!!")
-                    avg_tangent = np.mean(tangents, axis=0)
-                    avg_normal = np.mean(normals, axis=0)
-                    bitangent = signs[0]*np.cross(avg_normal, avg_tangent)
-                    tangent_data = {'Tangent': (*avg_tangent, signs[0]),
-                                    'Bitangent': bitangent}
-                else:
-                    tangent_data = {}
-
-
-                vert = {'Position': vertex.co,
-                        'Normal': vertex.normal,
-                        **{key: value for key, value in zip(['UV', 'UV2', 'UV3'], unique_value[:n_uvs])},
-                        **{key: value for key, value in zip(['Colour'], unique_value[n_uvs:])},
-                        **tangent_data,
-                        'WeightedBoneID': [group_map[grp.group] for grp in vertex.groups],
-                        'BoneWeight': group_weights}
 
-                n_verts = len(exported_vertices)
-                exported_vertices.append(vert)
+        loop_vertex_idxs = foreach_get_array(mesh.loops, 'vertex_index', 1, np.int32)
+        loop_uvs = [foreach_get_array(mesh.uv_layers[map_id].data, 'uv', 2) for map_id in map_ids]
+        loop_colours = [foreach_get_array(mesh.vertex_colors[map_id].data, 'color', 4) for map_id in colour_map]
+
+        # Find the unique (vertex, UVs, colour) combinations; adding 0 makes -0. and 0. compare equal
+        loop_keys = np.hstack([loop_vertex_idxs.reshape((-1, 1)),
+                               *[(loop_data + np.float32(0.)).view(np.int32) for loop_data in (*loop_uvs, *loop_colours)]])
+        _, first_loop_idxs, loop_split_vertex_idxs = np.unique(loop_keys, axis=0, return_index=True, return_inverse=True)
+        loop_split_vertex_idxs = loop_split_vertex_idxs.reshape(-1)
+        split_vertex_order = np.argsort(first_loop_idxs, kind='stable')
+        new_split_vertex_idxs = np.empty(len(split_vertex_order), dtype=np.int64)
+        new_split_vertex_idxs[split_vertex_order] = np.arange(len(split_vertex_order))
+        loop_split_vertex_idxs = new_split_vertex_idxs[loop_split_vertex_idxs]
+        first_loop_idxs = first_loop_idxs[split_vertex_order]
+        vertex_idxs = loop_vertex_idxs[first_loop_idxs]
+
+        vertices = VertexArrays(len(first_loop_idxs))
+        vertices.set_attribute('Position', foreach_get_array(mesh.vertices, 'co', 3)[vertex_idxs])
+        vertices.set_attribute('Normal', foreach_get_array(mesh.vertices, 'normal', 3)[vertex_idxs])
+        for key, loop_data in zip(['UV', 'UV2', 'UV3'], loop_uvs):
+            vertices.set_attribute(key, loop_data[first_loop_idxs])
+        for key, loop_data in zip(['Colour'], loop_colours):
+            vertices.set_attribute(key, loop_data[first_loop_idxs])
 
-                for l in loops_with_this_value:
-                    face_idx = face_link_loops[l]
-                    faces[face_idx][l] = n_verts
-
-                if group_bone_ids is not None:
-                    for group_bone_id, weight in zip(group_bone_ids, group_weights):
-                        if group_bone_id not in vgroup_verts:
-                            vgroup_verts[group_bone_id] = []
-                            vgroup_wgts[group_bone_id] = []
-                        vgroup_verts[group_bone_id].append(n_verts)
-                        vgroup_wgts[group_bone_id].append(weight)
-
-        faces = [list(face_verts.values()) for face_verts in faces]
+        if has_uvs:
+            # Average the loop tangents and normals over the loops merged into each exported vertex
+            num_merged_loops = np.bincount(loop_split_vertex_idxs, minlength=len(vertices)).reshape((-1, 1))
+            avg_tangents = np.zeros((len(vertices), 3))
+            avg_normals = np.zeros((len(vertices), 3))
+            np.add.at(avg_tangents, loop_split_vertex_idxs, foreach_get_array(mesh.loops, 'tangent', 3))
+            np.add.at(avg_normals, loop_split_vertex_idxs, foreach_get_array(mesh.loops, 'normal', 3))
+            avg_tangents /= num_merged_loops
+            avg_normals /= num_merged_loops
+
+            loop_bitangent_signs = foreach_get_array(mesh.loops, 'bitangent_sign', 1)
+            bitangent_signs = loop_bitangent_signs[first_loop_idxs]
+            num_mixed_sign_vertices = len(np.unique(loop_split_vertex_idxs[loop_bitangent_signs != bitangent_signs[loop_split_vertex_idxs]]))
+            if num_mixed_sign_vertices:
+                print("!!!! WARNING !!!!")
+                print(f"Not all bitangents of loops attached to an exported vertex have the same sign!!! "
+                      f"({num_mixed_sign_vertices} exported vertices affected)")
+
+            vertices.set_attribute('Tangent', np.hstack([avg_tangents, bitangent_signs.reshape((-1, 1))]))
+            vertices.set_attribute('Bitangent', bitangent_signs.reshape((-1, 1)) * np.cross(avg_normals, avg_tangents))
 
-        return exported_vertices, faces, vgroup_verts, vgroup_wgts
+        group_map = {g.index: i for i, g in enumerate(get_all_nonempty_vertex_groups(mesh_obj))}
+        vertex_groups = [[(group_map[grp.group], grp.weight) for grp in vertex.groups] for vertex in mesh.vertices]
+        max_groups = max([len(groups) for groups in vertex_groups], default=0)
+        bone_indices = np.zeros((len(vertex_groups), max_groups), dtype=np.int64)
+        bone_weights = np.zeros((len(vertex_groups), max_groups), dtype=np.float32)
+        for i, groups in enumerate(vertex_groups):
+            for j, (group_idx, weight) in enumerate(groups):
+                bone_indices[i, j] = group_idx
+                bone_weights[i, j] = weight
+        vertices.set_skinning(bone_indices[vertex_idxs], bone_weights[vertex_idxs])
+
+        loop_starts = foreach_get_array(mesh.polygons, 'loop_start', 1, np.int32)
+        loop_totals = foreach_get_array(mesh.polygons, 'loop_total', 1, np.int32)
+        non_triangles = np.flatnonzero(loop_totals != 3)
+        if len(non_triangles):
+            raise Exception(f"The mesh \"{mesh_obj.name}\" has {len(non_triangles)} polygons that are not triangles, "
+                            f"starting with polygon {non_triangles[0]}.\n"
+                            f"Triangulate the mesh before exporting it.")
+        faces = loop_split_vertex_idxs[loop_starts.reshape((-1, 1)) + np.arange(3)]
+
+        return vertices, faces
 
     def export_materials(self, model_data, used_materials, used_textures, export_shaders_folder):
         tex_names = []
@@ -316,6 +322,17 @@ class ExportDSCSPS4(ExportDSCSBase, bpy.types.Operator, ExportHelper):
         return super().execute_func(context, self.filepath, 'PS4')
 
 
+def foreach_get_array(collection, attribute, num_elements, dtype=np.float32):
+    """
+    Copies an attribute of every element of a Blender collection into a NumPy array in one call.
+    """
+    data = np.empty(len(collection) * num_elements, dtype=dtype)
+    collection.foreach_get(attribute, data)
+    if num_elements == 1:
+        return data
+    return data.reshape((len(collection), num_elements))
+
+
 def get_bone_id(mesh_obj, bone_names, grp):
     group_idx = grp.group
     bone_name = mesh_obj.vertex_groups[group_idx].name
@@ -9,6 +9,8 @@ from bpy_extras.object_utils import object_data_add
 from mathutils import Vector, Matrix
 from ..CollatedData.FromReadWrites import generate_intermediate_format_from_files
 from ..FileReaders.GeomReader.ShaderUniforms import shader_textures
+from ..Utilities.Rotation import xyzw_to_wxyz
+from ..Utilities.Timing import StageTimer
 
 
 def set_new_rest_pose(armature_name, bone_names, rest_pose_delta):
@@ -27,7 +29,7 @@ def set_new_rest_pose(armature_name, bone_names, rest_pose_delta):
 
     # 2) Pose your object in your new rest pose.
     for i, (bone_name, (rest_quat, rest_pos, rest_scl)) in enumerate(zip(bone_names, rest_pose_delta)):
-        model_armature.pose.bones[bone_name].rotation_quaternion = np.roll(rest_quat, 1)
+        model_armature.pose.bones[bone_name].rotation_quaternion = xyzw_to_wxyz(rest_quat)
         model_armature.pose.bones[bone_name].location = rest_pos
         model_armature.pose.bones[bone_name].scale = rest_scl
 
@@ -390,69 +392,59 @@ class ImportDSCSBase:
             bpy.data.objects[armature_name].select_set(False)
 
     def import_meshes(self, parent_obj, filename, model_data, armature_name):
-
+        timer = StageTimer()
         for i, IF_mesh in enumerate(model_data.meshes):
-            # This function should be the best way to remove duplicate vertices (?) but doesn't pick up overlapping polygons with opposite normals
-            # verts, faces, map_of_loops_to_model_vertices, map_of_model_verts_to_verts = self.build_loops_and_verts(IF_mesh.vertices, IF_mesh.polygons)
-            # verts = [Vector(vert) for vert in verts]
-            edges = []
-
             # Init mesh
             meshobj_name = f"{filename}_{i}"
             mesh = bpy.data.meshes.new(name=meshobj_name)
             mesh_object = bpy.data.objects.new(meshobj_name, mesh)
 
-            verts = [Vector(v['Position']) for v in IF_mesh.vertices]
-            faces = [poly.indices for poly in IF_mesh.polygons]
-            mesh_object.data.from_pydata(verts, edges, faces)
-            bpy.context.collection.objects.link(mesh_object)
-
-
-            # Get the loop data
-            # map_of_blenderloops_to_modelloops = {}
-            # for poly_idx, poly in enumerate(mesh.polygons):
-            #     for loop_idx in poly.loop_indices:
-            #         vert_idx = mesh.loops[loop_idx].vertex_index
-            #         model_vertex = map_of_loops_to_model_vertices[(poly_idx, vert_idx)]
-            #         map_of_blenderloops_to_modelloops[loop_idx] = IF_mesh.vertices[model_vertex]
+            # Build the mesh directly from flat buffers: every polygon is a triangle, so the loops are the polygon
+            # indices in order and polygon i starts at loop 3*i
+            with timer.stage("Geometry"):
+                positions = IF_mesh.vertices.attributes['Position'][:, :3]
+                loop_vertex_idxs = np.array([poly.indices for poly in IF_mesh.polygons], dtype=np.int32).reshape(-1)
+                num_polygons = len(loop_vertex_idxs) // 3
+
+                mesh.vertices.add(len(positions))
+                mesh.vertices.foreach_set('co', positions.astype(np.float32).ravel())
+                mesh.loops.add(len(loop_vertex_idxs))
+                mesh.loops.foreach_set('vertex_index', loop_vertex_idxs)
+                mesh.polygons.add(num_polygons)
+                mesh.polygons.foreach_set('loop_start', np.arange(0, len(loop_vertex_idxs), 3, dtype=np.int32))
+                mesh.polygons.foreach_set('loop_total', np.full(num_polygons, 3, dtype=np.int32))
+                mesh.update(calc_edges=True)
+                bpy.context.collection.objects.link(mesh_object)
 
             # Assign normals
-            # if 'Normal' in map_of_blenderloops_to_modelloops[0]:
-            if 'Normal' in IF_mesh.vertices[0]:
-                # loop_normals = [Vector(loop_data['Normal']) for loop_data in map_of_blenderloops_to_modelloops.values()]
-                # loop_normals = [Vector(IF_mesh.vertices[loop.vertex_index]['Normal']) for loop in mesh_object.data.loops]
-                # mesh_object.data.normals_split_custom_set([(0, 0, 0) for _ in mesh_object.data.loops])
-                # mesh_object.data.normals_split_custom_set(loop_normals)
-                mesh_object.data.normals_split_custom_set_from_vertices([Vector(v['Normal']) for v in IF_mesh.vertices])
-
-            mesh.use_auto_smooth = True
+            with timer.stage("Normals"):
+                if 'Normal' in IF_mesh.vertices:
+                    mesh.normals_split_custom_set_from_vertices(IF_mesh.vertices.attributes['Normal'].astype(np.float32))
+                mesh.use_auto_smooth = True
 
             # Assign materials
             material_name = model_data.materials[IF_mesh.material_id].name
             active_material = bpy.data.materials[material_name]
             bpy.data.objects[meshobj_name].active_material = active_material
 
-            # Assign UVs
-            for uv_type in ['UV', 'UV2', 'UV3']:
-                # if uv_type in map_of_blenderloops_to_modelloops[0]:
-                if uv_type in IF_mesh.vertices[0]:
-                    uv_layer = mesh.uv_layers.new(name=f"{uv_type}Map", do_init=True)
-                    for loop_idx, loop in enumerate(mesh.loops):
-                        # uv_layer.data[loop_idx].uv = map_of_blenderloops_to_modelloops[loop_idx][uv_type]
-                        uv_layer.data[loop_idx].uv = IF_mesh.vertices[loop.vertex_index][uv_type]
-
-            # Assign vertex colours
-            if 'Colour' in IF_mesh.vertices[0]:
-                colour_map = mesh.vertex_colors.new(name=f"Map", do_init=True)
-                for loop_idx, loop in enumerate(mesh.loops):
-                    colour_map.data[loop_idx].color = IF_mesh.vertices[loop.vertex_index]['Colour']
+            # Assign UVs and vertex colours by gathering the per-vertex values onto the loops
+            with timer.stage("UVs and vertex colours"):
+                for uv_type in ['UV', 'UV2', 'UV3']:
+                    if uv_type in IF_mesh.vertices:
+                        uv_layer = mesh.uv_layers.new(name=f"{uv_type}Map", do_init=True)
+                        loop_uvs = IF_mesh.vertices.attributes[uv_type][loop_vertex_idxs]
+                        uv_layer.data.foreach_set('uv', loop_uvs.astype(np.float32).ravel())
+
+                if 'Colour' in IF_mesh.vertices:
+                    colour_map = mesh.vertex_colors.new(name=f"Map", do_init=True)
+                    loop_colours = IF_mesh.vertices.attributes['Colour'][loop_vertex_idxs]
+                    colour_map.data.foreach_set('color', loop_colours.astype(np.float32).ravel())
 
             # Rig the vertices
-            for IF_vertex_group in IF_mesh.vertex_groups:
-                vertex_group = mesh_object.vertex_groups.new(name=model_data.skeleton.bone_names[IF_vertex_group.bone_idx])
-                for vert_idx, vert_weight in zip(IF_vertex_group.vertex_indices, IF_vertex_group.weights):
-                    #vertex_group.add([map_of_model_verts_to_verts[vert_idx]], vert_weight, 'REPLACE')
-                    vertex_group.add([vert_idx], vert_weight, 'REPLACE')
+            with timer.stage("Vertex groups"):
+                for IF_vertex_group in IF_mesh.vertex_groups:
+                    vertex_group = mesh_object.vertex_groups.new(name=model_data.skeleton.bone_names[IF_vertex_group.bone_idx])
+                    add_vertex_group_weights(vertex_group, IF_vertex_group.vertex_indices, IF_vertex_group.weights)
 
             # Add unknown data
             mesh_object['unknown_0x31'] = IF_mesh.unknown_data['unknown_0x31']
@@ -460,18 +452,21 @@ class ImportDSCSBase:
             mesh_object['unknown_0x36'] = IF_mesh.unknown_data['unknown_0x36']
             mesh_object['unknown_0x4C'] = IF_mesh.unknown_data['unknown_0x4C']
 
-            bpy.data.objects[meshobj_name].select_set(True)
-            bpy.data.objects[armature_name].select_set(True)
-            # I would prefer to do this by directly calling object methods if possible
-            # mesh_object.parent_set()...
-            bpy.context.view_layer.objects.active = bpy.data.objects[armature_name]
-            bpy.ops.object.parent_set(type='ARMATURE')
+            with timer.stage("Parenting and validation"):
+                bpy.data.objects[meshobj_name].select_set(True)
+                bpy.data.objects[armature_name].select_set(True)
+                # I would prefer to do this by directly calling object methods if possible
+                # mesh_object.parent_set()...
+                bpy.context.view_layer.objects.active = bpy.data.objects[armature_name]
+                bpy.ops.object.parent_set(type='ARMATURE')
 
-            mesh.validate(verbose=True)
-            mesh.update()
+                mesh.validate(verbose=True)
+                mesh.update()
 
-            bpy.data.objects[meshobj_name].select_set(False)
-            bpy.data.objects[armature_name].select_set(False)
+                bpy.data.objects[meshobj_name].select_set(False)
+                bpy.data.objects[armature_name].select_set(False)
+
+        timer.report(f"Imported {len(model_data.meshes)} meshes")
 
         # Top-level unknown data
         parent_obj['unknown_cam_data_1'] = model_data.unknown_data['unknown_cam_data_1']
@@ -495,22 +490,19 @@ class ImportDSCSBase:
                     for i in range(4):
                         fc = action.fcurves.new(f'pose.bones["{bone_name}"].rotation_quaternion', index=i)
                         fc.keyframe_points.add(count=len(rotation_data.frames))
-                        fc.keyframe_points.foreach_set("co", [x for co in zip([float(elem) for elem in rotation_data.frames],
-                                                                              [elem[i] for elem in rotation_data.values]) for x in co])
+                        fc.keyframe_points.foreach_set("co", keyframe_coordinates(rotation_data, i))
                         fc.update()
                 if len(location_data.frames) != 0:
                     for i in range(3):
                         fc = action.fcurves.new(f'pose.bones["{bone_name}"].location', index=i)
                         fc.keyframe_points.add(count=len(location_data.frames))
-                        fc.keyframe_points.foreach_set("co", [x for co in zip([float(elem) for elem in location_data.frames],
-                                                                              [elem[i] for elem in location_data.values]) for x in co])
+                        fc.keyframe_points.foreach_set("co", keyframe_coordinates(location_data, i))
                         fc.update()
                 if len(scale_data.frames) != 0:
                     for i in range(3):
                         fc = action.fcurves.new(f'pose.bones["{bone_name}"].scale', index=i)
                         fc.keyframe_points.add(count=len(scale_data.frames))
-                        fc.keyframe_points.foreach_set("co", [x for co in zip([float(elem) for elem in scale_data.frames],
-                                                                              [elem[i] for elem in scale_data.values]) for x in co])
+                        fc.keyframe_points.foreach_set("co", keyframe_coordinates(scale_data, i))
                         fc.update()
 
             model_armature.animation_data.action = action
@@ -530,6 +522,38 @@ class ImportDSCSBase:
         return {'FINISHED'}
 
 
+def add_vertex_group_weights(vertex_group, vertex_indices, weights):
+    """
+    Assigns the weights of a vertex group with one call to VertexGroup.add per distinct weight value rather than one
+    call per vertex. If a vertex is listed more than once, its last weight is used, as with per-vertex 'REPLACE' calls.
+    """
+    vertex_indices = np.asarray(vertex_indices, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float32)
+
+    _, last_occurrences = np.unique(vertex_indices[::-1], return_index=True)
+    last_occurrences = len(vertex_indices) - 1 - last_occurrences
+    vertex_indices = vertex_indices[last_occurrences]
+    weights = weights[last_occurrences]
+
+    unique_weights, weight_idxs = np.unique(weights, return_inverse=True)
+    weight_order = np.argsort(weight_idxs, kind='stable')
+    weight_bounds = np.cumsum(np.bincount(weight_idxs, minlength=len(unique_weights)))[:-1]
+    for weight, weight_vertex_indices in zip(unique_weights.tolist(),
+                                             np.split(vertex_indices[weight_order], weight_bounds)):
+        vertex_group.add(weight_vertex_indices.tolist(), weight, 'REPLACE')
+
+
+def keyframe_coordinates(fcurve, component_idx):
+    """
+    Interleaves the frames of an IntermediateFormat FCurve with one component of its values, as a flat array of
+    keyframe point coordinates for foreach_set.
+    """
+    coordinates = np.empty((len(fcurve.frames), 2), dtype=np.float32)
+    coordinates[:, 0] = fcurve.frames
+    coordinates[:, 1] = fcurve.values[:, component_idx]
+    return coordinates.ravel()
+
+
 def set_texture_node_image(node, texture_idx, IF_texture, import_memory):
     tex_filename = os.path.split(IF_texture.filepath)[-1]
     tempdir = bpy.app.tempdir
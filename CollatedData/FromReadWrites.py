@@ -2,10 +2,11 @@ from ..FileInterfaces.NameInterface import NameInterface
 from ..FileInterfaces.SkelInterface import SkelInterface
 from ..FileInterfaces.GeomInterface import GeomInterface
 from ..FileReaders.AnimReader import AnimReader
+from ..FileReaders.BaseRW import map_file
 from .IntermediateFormat import IntermediateFormat
-from ..Utilities.Rotation import bone_matrix_from_rotation_location, quat_to_matrix, rotation_matrix_to_quat
+from ..Utilities.BoneHierarchy import BoneHierarchy
+from ..Utilities.Rotation import bone_matrix_from_rotation_location, rotation_matrix_to_quat
 
-import itertools
 import os
 import numpy as np
 
@@ -33,7 +34,7 @@ def generate_intermediate_format_from_files(filepath, platform, import_anims=Tru
             if afile[-4:] == 'anim' and afile[:len(filename)] == filename:
                 afile_name, afile_ext = os.path.splitext(afile)
                 print(afile)
-                with open(afilepath, 'rb') as F:
+                with map_file(afilepath) as F:
                     iar = AnimReader(F, imported_skeldata)
                     iar.read()
                 imported_animdata[afile_name] = iar
@@ -53,21 +54,27 @@ def add_meshes(model_data, imported_geomdata):
     for mesh in imported_geomdata.meshes:
         model_data.new_mesh()
         current_IF_mesh = model_data.meshes[-1]
-        for bone_id in mesh.vertex_group_bone_idxs:
-            current_IF_mesh.add_vertex_group(bone_id, [], [])
-
-        if 'WeightedBoneID' in mesh.vertices[0]:
-            for i, vertex in enumerate(mesh.vertices):
-                for vertex_group_idx, weight in zip(vertex['WeightedBoneID'], vertex['BoneWeight']):
-                    current_IF_mesh.vertex_groups[vertex_group_idx].vertex_indices.append(i)
-                    current_IF_mesh.vertex_groups[vertex_group_idx].weights.append(weight)
+        vertices = mesh.vertices.copy()
+        if 'WeightedBoneID' in vertices:
+            # Walk the skinning matrices in vertex order, then group the entries by vertex group; the stable sort
+            # keeps the vertex indices of each group in ascending order
+            vertex_indices, slots = np.nonzero(vertices.bone_weights)
+            vertex_group_indices = vertices.bone_indices[vertex_indices, slots]
+            weights = vertices.bone_weights[vertex_indices, slots]
+            group_order = np.argsort(vertex_group_indices, kind='stable')
+            group_bounds = np.searchsorted(vertex_group_indices[group_order],
+                                           np.arange(len(mesh.vertex_group_bone_idxs) + 1))
+            for vertex_group_idx, bone_id in enumerate(mesh.vertex_group_bone_idxs):
+                group_members = group_order[group_bounds[vertex_group_idx]:group_bounds[vertex_group_idx + 1]]
+                current_IF_mesh.add_vertex_group(bone_id, vertex_indices[group_members], weights[group_members])
+        else:
+            for bone_id in mesh.vertex_group_bone_idxs:
+                current_IF_mesh.add_vertex_group(bone_id, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
         for uv_type in ['UV', 'UV2', 'UV3']:
-            if uv_type in mesh.vertices[0]:
-                for vertex in mesh.vertices:
-                    u, v = vertex[uv_type]
-                    vertex[uv_type] = (u, 1. - v)
+            if uv_type in vertices:
+                vertices.set_attribute(uv_type, flip_uvs(vertices.attributes[uv_type]))
 
-        current_IF_mesh.vertices = mesh.vertices
+        current_IF_mesh.vertices = vertices
 
         for tri in mesh.polygons:
             current_IF_mesh.add_polygon(tri)
@@ -89,6 +96,16 @@ def add_meshes(model_data, imported_geomdata):
     model_data.unknown_data['unknown_footer_data'] = imported_geomdata.unknown_footer_data
 
 
+def flip_uvs(uvs):
+    """
+    Converts between the top-left UV origin used by the files and the bottom-left origin used by Blender. The flip is
+    carried out in double precision, which represents 1 - v exactly for any half-precision v.
+    """
+    uvs = uvs.astype(np.float64)
+    uvs[:, 1] = 1. - uvs[:, 1]
+    return uvs
+
+
 def add_materials(model_data, imported_namedata, imported_geomdata, filename):
     #assert len(imported_namedata.material_names) == len(imported_geomdata.material_data), \
     #    f"Mismatch between material names and unique material data. {len(imported_namedata.material_names)} {len(imported_geomdata.material_data)}"
@@ -127,58 +144,40 @@ def add_skeleton(model_data, imported_namedata, imported_skeldata, imported_geom
     model_data.skeleton.unknown_data['unknown_data_2'] = imported_skeldata.unknown_data_2
     model_data.skeleton.unknown_data['unknown_data_3'] = imported_skeldata.unknown_data_3
     model_data.skeleton.unknown_data['unknown_data_4'] = imported_skeldata.unknown_data_4
-    parent_bones = {p: c for p, c in imported_skeldata.parent_bones}
-    model_data.skeleton.rest_pose = [get_total_transform_matrix(i, parent_bones, imported_skeldata.rest_pose) for i in range(len(imported_skeldata.rest_pose))]
-    for i, (inverse_matrix, (quat, loc, scl)) in enumerate(zip(imported_geomdata.inverse_bind_pose_matrices, imported_skeldata.rest_pose)):
-        bone_matrix = np.zeros((4, 4))
-        bone_matrix[:3, :3] = quat_to_matrix(quat)
-        bone_matrix[:3, 3] = loc[:3]
-        bone_matrix[3, 3] = 1
-
-        bm = calculate_bone_matrix_relative_to_parent(i, parent_bones, model_data.skeleton.inverse_bind_pose_matrices)
-        diff = np.dot(np.linalg.inv(bm), bone_matrix)
-        diff_quat = rotation_matrix_to_quat(diff[:3, :3])
-        diff_pos = diff[:3, 3]
-        model_data.skeleton.rest_pose_delta.append([diff_quat, diff_pos, scl[:3]])
-
-
-        # bone_matrix = np.zeros((4, 4))
-        # bone_matrix[:3, :3] = quat_to_matrix(quat)
-        # bone_matrix[:3, 3] = loc[:3]
-        # bone_matrix[3, 3] = 1
-        #
-        # bm = get_total_transform(parent_bones[i], parent_bones, imported_skeldata.rest_pose)
-        # diff = np.dot(bm, bone_matrix)
-        # diff_quat = rotation_matrix_to_quat(diff[:3, :3])
-        # diff_pos = diff[:3, 3]
-        # model_data.skeleton.rest_pose_delta.append([diff_quat, diff_pos, scl[:3]])
-
-        # rot_matrix, pos = get_total_transform(i, parent_bones, imported_skeldata.rest_pose)
-        # bone_matrix = np.zeros((4, 4))
-        # bone_matrix[:3, :3] = rot_matrix
-        # bone_matrix[:3, 3] = pos
-        # bone_matrix[3, 3] = 1
-        # bone_matrix = np.dot(inverse_matrix, bone_matrix)
-        # quat = rotation_matrix_to_quat(bone_matrix[:3, :3])
-        # pos = bone_matrix[:3, 3]
-        # model_data.skeleton.rest_pose_delta.append([quat, pos, scl[:3]])
-
-
-def calculate_bone_matrix_relative_to_parent(idx, parent_bones, inv_bind_pose_matrices):
-    par = parent_bones[idx]
-    if par == -1:
-        pbm = np.eye(4)
-    else:
-        pbm = inv_bind_pose_matrices[par]
-    bm = inv_bind_pose_matrices[idx]
-
-    # Remember that bm is the inverse of the bone matrix, and pbm is the inverse of the parent's bone matrix,
-    # so what we're really doing here is multiplying the inverse parent matrix by the ordinary child matrix.
-    # This leaves us with just the transform of the child relative to the parent, since all the parent's contribution
-    # to the child's transform has been taken off
-    diff = np.dot(pbm, np.linalg.inv(bm))
-
-    return diff
+    hierarchy = BoneHierarchy.from_bone_relations(imported_skeldata.parent_bones)
+    rest_pose_local_matrices = calculate_rest_pose_local_matrices(imported_skeldata.rest_pose)
+    model_data.skeleton.rest_pose = list(hierarchy.local_to_global(rest_pose_local_matrices))
+
+    # Geoms without inverse bind pose matrices get no deltas
+    inverse_bind_pose_matrices = imported_geomdata.inverse_bind_pose_matrices[:hierarchy.num_bones]
+    if len(inverse_bind_pose_matrices):
+        assert len(inverse_bind_pose_matrices) == hierarchy.num_bones, \
+            f"Geom has {len(inverse_bind_pose_matrices)} inverse bind pose matrices for {hierarchy.num_bones} bones."
+        deltas = calculate_rest_pose_deltas(hierarchy, inverse_bind_pose_matrices, rest_pose_local_matrices)
+        delta_quats = rotation_matrix_to_quat(deltas[:, :3, :3])
+        model_data.skeleton.rest_pose_delta = [[diff_quat, diff[:3, 3], scl[:3]] for diff_quat, diff, (_, _, scl)
+                                               in zip(delta_quats, deltas, imported_skeldata.rest_pose)]
+
+
+def calculate_rest_pose_local_matrices(bone_data):
+    """
+    Returns the rest pose matrix of every bone relative to its parent, as a (num_bones, 4, 4) array, from the rotations
+    and locations stored in the skel file.
+    """
+    return bone_matrix_from_rotation_location(np.reshape([quat for quat, _, _ in bone_data], (-1, 4)),
+                                              np.reshape([loc[:3] for _, loc, _ in bone_data], (-1, 3)))
+
+
+def calculate_rest_pose_deltas(hierarchy, inverse_bind_pose_matrices, rest_pose_local_matrices):
+    """
+    Returns the transforms that take each bone from its bind pose to its rest pose, both relative to the parent bone.
+
+    The inverse of the bind pose of a bone relative to its parent is the inverse bind pose matrix of the bone
+    multiplied by the bind pose matrix of the parent, so only the inverse bind pose matrices need to be inverted.
+    """
+    inverse_bind_pose_matrices = np.reshape(inverse_bind_pose_matrices, (hierarchy.num_bones, 4, 4))
+    bind_pose_matrices = np.linalg.inv(inverse_bind_pose_matrices)
+    return inverse_bind_pose_matrices @ hierarchy.parent_matrices(bind_pose_matrices) @ rest_pose_local_matrices
 
 
 def add_anims(model_data, imported_animdata):
@@ -187,125 +186,70 @@ def add_anims(model_data, imported_animdata):
 
         ad.playback_rate = ar.playback_rate
 
-        # Set up some data holders
-        rotation_fcurves_frames = {bone_idx: [] for bone_idx in range(ar.num_bones)}
-        rotation_fcurves_values = {bone_idx: [] for bone_idx in range(ar.num_bones)}
-        location_fcurves_frames = {bone_idx: [] for bone_idx in range(ar.num_bones)}
-        location_fcurves_values = {bone_idx: [] for bone_idx in range(ar.num_bones)}
-        scale_fcurves_frames = {bone_idx: [] for bone_idx in range(ar.num_bones)}
-        scale_fcurves_values = {bone_idx: [] for bone_idx in range(ar.num_bones)}
-
-        # First add in the rotations, locations, and scales that are constant throughout the animation
-        for bone_idx, value in zip(ar.static_pose_rotations_bone_idxs, ar.static_pose_bone_rotations):
-            rotation_fcurves_frames[bone_idx].append(0)
-            rotation_fcurves_values[bone_idx].append(value)
-        for bone_idx, value in zip(ar.static_pose_locations_bone_idxs, ar.static_pose_bone_locations):
-            location_fcurves_frames[bone_idx].append(0)
-            location_fcurves_values[bone_idx].append(value)
-        for bone_idx, value in zip(ar.static_pose_scales_bone_idxs, ar.static_pose_bone_scales):
-            scale_fcurves_frames[bone_idx].append(0)
-            scale_fcurves_values[bone_idx].append(value)
-
-        # Now add in the rotations, locations, and scales that change throughout the animation
-        for (cumulative_frames, nframes), substructure in zip(ar.keyframe_counts, ar.keyframe_chunks):
-            for bone_idx, value in zip(ar.animated_rotations_bone_idxs, substructure.frame_0_rotations):
-                rotation_fcurves_frames[bone_idx].append(cumulative_frames)
-                rotation_fcurves_values[bone_idx].append(value)
-            for bone_idx, value in zip(ar.animated_locations_bone_idxs, substructure.frame_0_locations):
-                location_fcurves_frames[bone_idx].append(cumulative_frames)
-                location_fcurves_values[bone_idx].append(value)
-            for bone_idx, value in zip(ar.animated_scales_bone_idxs, substructure.frame_0_scales):
-                scale_fcurves_frames[bone_idx].append(cumulative_frames)
-                scale_fcurves_values[bone_idx].append(value)
-
-            # The keyframe rotations, locations, etc. for all bones are all concatenated together into one big list
-            # per transform type.
-            # The keyframes that use each transform are stored in a bit-vector with an equal length to the number of
-            # frames. These bit-vectors are all concatenated together in one huge bit-vector, in the order
-            # rotations->locations->scales->unknown_4
-            # Therefore, it's pretty reasonable to turn these lists of keyframe rotations, locations, etc.
-            # into generators using the built-in 'iter' function or the 'chunks' function defined at the bottom of the
-            # file.
-            if nframes != 0:
-                masks = chunks(substructure.keyframes_in_use, nframes)
-            else:
-                masks = []
-            rotations = iter(substructure.keyframed_rotations)
-            locations = iter(substructure.keyframed_locations)
-            scales = iter(substructure.keyframed_scales)
-
-            # The benefit of doing this is that generators behave like a Queue. We can pop the next element off these
-            # generators and never have to worry about keeping track of the state of each generator.
-            # In the code, the bit-vector is chunked and labelled 'masks'.
-            # Schematically, the bit-vector might look like this: (annotated)
-            #
-            # <------------------ Rotations -------------------><------------- Locations --------------><-Scales->
-            # <-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames->
-            # 0001101011000011010010101011111000010100101010001010111001010010101000000001101011100100101011111101
-            #
-            # In this case, the animation is 11 frames long (the number of 1s and 0s under each bit annotated as
-            # '<-Frames->')
-            # Starting from the beginning, we see that there are 5 1s in the first section of 11 frames. This means
-            # that we need to record the indices of these 1s (modulo 11, the number of frames) and then take the first
-            # 5 elements from the big list of keyframe rotations. We then record these frame indices and rotation
-            # values as the keyframe data (points on the 'f-curve') for whichever bone this first set of 11 frames
-            # corresponds to. We continue iterating through this bit-vector by grabbing the next mask from 'masks',
-            # and we should consume the entire generator of rotation data after 5 masks. The next mask we grab should
-            # then correspond to location data, so we move onto the next for-loop below, and so on for the scale data.
-            for bone_idx, mask in zip(ar.animated_rotations_bone_idxs, masks):
-                frames = [j+cumulative_frames+1 for j, elem in enumerate(mask) if elem == '1']
-                values = itertools.islice(rotations, len(frames))  # Pop the next num_frames rotations
-                rotation_fcurves_frames[bone_idx].extend(frames)
-                rotation_fcurves_values[bone_idx].extend(values)
-            for bone_idx, mask in zip(ar.animated_locations_bone_idxs, masks):
-                frames = [j+cumulative_frames+1 for j, elem in enumerate(mask) if elem == '1']
-                values = itertools.islice(locations, len(frames))  # Pop the next num_frames locations
-                location_fcurves_frames[bone_idx].extend(frames)
-                location_fcurves_values[bone_idx].extend(values)
-            for bone_idx, mask in zip(ar.animated_scales_bone_idxs, masks):
-                frames = [j+cumulative_frames+1 for j, elem in enumerate(mask) if elem == '1']
-                values = itertools.islice(scales, len(frames))  # Pop the next num_frames scales
-                scale_fcurves_frames[bone_idx].extend(frames)
-                scale_fcurves_values[bone_idx].extend(values)
-
-        # Having iterated through the data, we can now add the keyframe data to the intermediate format object.
-        for bone_idx in range(ar.num_bones):
-            ad.add_rotation_fcurve(bone_idx, rotation_fcurves_frames[bone_idx], rotation_fcurves_values[bone_idx])
-            ad.add_location_fcurve(bone_idx, location_fcurves_frames[bone_idx], location_fcurves_values[bone_idx])
-            ad.add_scale_fcurve(bone_idx, scale_fcurves_frames[bone_idx], scale_fcurves_values[bone_idx])
-
-
-def chunks(lst, n):
-    """Yield successive n-sized chunks from lst."""
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
-
-
-def get_total_transform(idx, parent_bones, bone_data):
-    if idx == -1:
-        rot = np.eye(3)
-        loc = np.zeros(3)
-        return rot, loc
-    else:
-        parent_idx = parent_bones[idx]
-        parent_rot, parent_loc = get_total_transform(parent_idx, parent_bones, bone_data)
-
-        rot = np.dot(parent_rot.T, quat_to_matrix(bone_data[idx][0]))
-        loc = np.dot(parent_rot, np.array(bone_data[idx][1][:3])) + parent_loc
-
-        return rot, loc
-
-
-def get_total_transform_matrix(idx, parent_bones, bone_data):
-    if idx == -1:
-        bone_matrix = np.eye(4)
-        return bone_matrix
-    else:
-        parent_idx = parent_bones[idx]
-        parent_bone_matrix = get_total_transform_matrix(parent_idx, parent_bones, bone_data)
-
-        diff_bone_matrix = np.zeros((4, 4))
-        diff_bone_matrix[:3, :3] = quat_to_matrix(bone_data[idx][0])
-        diff_bone_matrix[:, 3] = np.array(bone_data[idx][1])
-
-        return np.dot(parent_bone_matrix, diff_bone_matrix)
\ No newline at end of file
+        # The keyframe rotations, locations, etc. for all bones are all concatenated together into one big list
+        # per transform type.
+        # The keyframes that use each transform are stored in a bit-vector with an equal length to the number of
+        # frames. These bit-vectors are all concatenated together in one huge bit-vector, in the order
+        # rotations->locations->scales->unknown_4, which the KeyframeChunk has unpacked into a boolean matrix with
+        # one row per bone and one column per frame.
+        # Schematically, the bit-vector might look like this: (annotated)
+        #
+        # <------------------ Rotations -------------------><------------- Locations --------------><-Scales->
+        # <-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames-><-Frames->
+        # 0001101011000011010010101011111000010100101010001010111001010010101000000001101011100100101011111101
+        #
+        # In this case, the animation is 11 frames long (the number of 1s and 0s under each bit annotated as
+        # '<-Frames->')
+        # Starting from the beginning, we see that there are 5 1s in the first section of 11 frames. This means
+        # that we need to record the indices of these 1s (modulo 11, the number of frames) and then take the first
+        # 5 elements from the big list of keyframe rotations. We then record these frame indices and rotation
+        # values as the keyframe data (points on the 'f-curve') for whichever bone this first set of 11 frames
+        # corresponds to. Since the big list of values is in the same order as the 1s in the boolean matrix, the
+        # row and column indices of the 1s give the bone and frame of each value directly.
+        rotations_end = len(ar.animated_rotations_bone_idxs)
+        locations_end = rotations_end + len(ar.animated_locations_bone_idxs)
+        scales_end = locations_end + len(ar.animated_scales_bone_idxs)
+        channels = [(ad.add_rotation_fcurve, 4, ar.static_pose_rotations_bone_idxs, ar.static_pose_bone_rotations,
+                     ar.animated_rotations_bone_idxs, 'frame_0_rotations', 'keyframed_rotations', 0, rotations_end),
+                    (ad.add_location_fcurve, 3, ar.static_pose_locations_bone_idxs, ar.static_pose_bone_locations,
+                     ar.animated_locations_bone_idxs, 'frame_0_locations', 'keyframed_locations', rotations_end, locations_end),
+                    (ad.add_scale_fcurve, 3, ar.static_pose_scales_bone_idxs, ar.static_pose_bone_scales,
+                     ar.animated_scales_bone_idxs, 'frame_0_scales', 'keyframed_scales', locations_end, scales_end)]
+
+        for add_fcurve, num_components, static_bone_idxs, static_values, animated_bone_idxs, \
+                frame_0_attr, keyframed_attr, masks_start, masks_end in channels:
+            animated_bone_idxs = np.asarray(animated_bone_idxs, dtype=np.int64)
+
+            # First add in the values that are constant throughout the animation
+            bone_idxs = [np.asarray(static_bone_idxs, dtype=np.int64)]
+            frames = [np.zeros(len(static_bone_idxs), dtype=np.int64)]
+            values = [np.reshape(static_values, (-1, num_components))]
+
+            # Now add in the values that change throughout the animation
+            for (cumulative_frames, nframes), substructure in zip(ar.keyframe_counts, ar.keyframe_chunks):
+                bone_idxs.append(animated_bone_idxs)
+                frames.append(np.full(len(animated_bone_idxs), cumulative_frames, dtype=np.int64))
+                values.append(np.reshape(getattr(substructure, frame_0_attr), (-1, num_components)))
+
+                track_idxs, frame_idxs = np.nonzero(substructure.keyframes_in_use[masks_start:masks_end])
+                bone_idxs.append(animated_bone_idxs[track_idxs])
+                frames.append(frame_idxs + cumulative_frames + 1)
+                values.append(np.reshape(getattr(substructure, keyframed_attr), (-1, num_components)))
+
+            # Having collected the data, we can now add the keyframe data to the intermediate format object.
+            for bone_idx, (bone_frames, bone_values) in enumerate(group_by_bone(ar.num_bones, np.concatenate(bone_idxs),
+                                                                                np.concatenate(frames),
+                                                                                np.concatenate(values))):
+                add_fcurve(bone_idx, bone_frames, bone_values)
+
+
+def group_by_bone(num_bones, bone_idxs, frames, values):
+    """
+    Splits columns of keyframes into one (frames, values) pair per bone, keeping the keyframes of each bone in the
+    order they appear in the columns.
+    """
+    assert len(bone_idxs) == len(frames) == len(values), \
+        f"Got {len(bone_idxs)} bone indices, {len(frames)} frames, and {len(values)} values for the keyframes."
+    bone_order = np.argsort(bone_idxs, kind='stable')
+    split_points = np.cumsum(np.bincount(bone_idxs, minlength=num_bones))[:-1]
+    return zip(np.split(frames[bone_order], split_points), np.split(values[bone_order], split_points))
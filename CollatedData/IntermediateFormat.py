@@ -1,3 +1,7 @@
+from ..Utilities.VertexArrays import VertexArrays
+import numpy as np
+
+
 class IntermediateFormat:
     _version = 0.2
     f"""
@@ -40,16 +44,13 @@ class IntermediateFormat:
         
 class MeshData:
     def __init__(self):
-        self.vertices = []
+        self.vertices = VertexArrays()
         self.vertex_groups = []
         self.polygons = []
         self.material_id = None
 
         self.unknown_data = {}
         
-    def add_vertex(self, position=None, normal=None, UV=None, vertex_groups=None, weights=None):
-        self.vertices.append(Vertex(position, normal, UV, vertex_groups, weights))
-
     def add_vertex_group(self, bone_idx, vertex_indices=None, weights=None):
         self.vertex_groups.append(VertexGroup(bone_idx, vertex_indices, weights))
     
@@ -57,17 +58,6 @@ class MeshData:
         self.polygons.append(Polygon(indices))
 
 
-class Vertex:
-    def __init__(self, position, normal, UV, vertex_groups, weights):
-        self.position = position
-        self.normal = normal
-        self.UV = UV
-        self.vertex_groups = vertex_groups
-        self.vertex_group_weights = weights
-
-        self.unknown_data = {}
-
-
 class VertexGroup:
     def __init__(self, bone_idx, vertex_indices, weights):
         self.bone_idx = bone_idx
@@ -128,20 +118,19 @@ class Animation:
 
     @property
     def num_frames(self):
-        rot_frames = [e.frames for e in self.rotations.values()]
-        rot_frames = [subitem for item in rot_frames for subitem in item]
-        loc_frames = [e.frames for e in self.locations.values()]
-        loc_frames = [subitem for item in loc_frames for subitem in item]
-        scl_frames = [e.frames for e in self.scales.values()]
-        scl_frames = [subitem for item in scl_frames for subitem in item]
-        res = (*rot_frames, *loc_frames, *scl_frames)
-        if len(res):
-            return max(res)
+        final_frames = [np.max(e.frames) for fcurves in (self.rotations, self.locations, self.scales)
+                        for e in fcurves.values() if len(e.frames)]
+        if len(final_frames):
+            return int(max(final_frames))
         else:
             return 0
 
 
 class FCurve:
+    """
+    Holds the keyframes of one bone transform as an (N,) array of frame indices and an (N, num_components) array of
+    values.
+    """
     def __init__(self, frames, values):
-        self.frames = frames
-        self.values = values
+        self.frames = np.asarray(frames)
+        self.values = np.asarray(values)
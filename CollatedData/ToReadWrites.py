@@ -6,22 +6,26 @@ from ..FileReaders.AnimReader import AnimReader
 from ..FileInterfaces.NameInterface import NameInterface
 from ..FileInterfaces.SkelInterface import SkelInterface
 from ..FileInterfaces.GeomInterface import GeomInterface
-# from ..FileInterfaces.AnimInterface import AnimInterface
+from ..FileInterfaces.AnimInterface import AnimInterface
 
 from ..FileReaders.GeomReader.ShaderUniforms import shader_uniforms_from_names
+from ..Utilities.BoneHierarchy import BoneHierarchy
 from ..Utilities.Rotation import rotation_matrix_to_quat
+from ..Utilities.MeshOptimisation import average_cache_miss_ratio, tipsify, order_vertices_by_first_use
+from .FromReadWrites import flip_uvs
 
 import os
 import numpy as np
 
 
-def generate_files_from_intermediate_format(filepath, model_data, platform='PC'):
+def generate_files_from_intermediate_format(filepath, model_data, platform='PC', use_triangle_strips=False,
+                                            optimise_vertex_cache=False, keyframe_tolerance=None):
     file_folder = os.path.join(*os.path.split(filepath)[:-1])
     make_nameinterface(filepath, model_data)
     sk = make_skelinterface(filepath, model_data)
-    make_geominterface(filepath, model_data, platform)
-    #for animation_name in model_data.animations:
-    #    make_animreader(file_folder, model_data, animation_name, sk)
+    make_geominterface(filepath, model_data, platform, use_triangle_strips, optimise_vertex_cache)
+    for animation_name in model_data.animations:
+        make_animinterface(file_folder, model_data, animation_name, sk, keyframe_tolerance)
 
 
 def make_nameinterface(filepath, model_data):
@@ -37,9 +41,11 @@ def make_skelinterface(filepath, model_data):
     skelInterface.unknown_0x0C = model_data.skeleton.unknown_data['unknown_0x0C']
     skelInterface.parent_bones = model_data.skeleton.bone_relations
     # Add support for deltas and handle scale on import later
-    parent_bones = {c: p for c, p in model_data.skeleton.bone_relations}
-    skelInterface.rest_pose = [calculate_bone_relative_to_parent(i, parent_bones, model_data.skeleton.inverse_bind_pose_matrices)
-                               for i in range(len(parent_bones))]
+    hierarchy = BoneHierarchy.from_bone_relations(model_data.skeleton.bone_relations)
+    rest_pose_matrices = hierarchy.inverse_bind_pose_to_local(np.reshape(model_data.skeleton.inverse_bind_pose_matrices,
+                                                                         (hierarchy.num_bones, 4, 4)))
+    rest_pose_quats = rotation_matrix_to_quat(rest_pose_matrices[:, :3, :3])
+    skelInterface.rest_pose = [(quat, matrix[:, 3], np.ones(4)) for quat, matrix in zip(rest_pose_quats, rest_pose_matrices)]
 
     skelInterface.unknown_data_1 = model_data.skeleton.unknown_data['unknown_data_1']
     skelInterface.unknown_data_2 = model_data.skeleton.unknown_data['unknown_data_2']
@@ -51,47 +57,28 @@ def make_skelinterface(filepath, model_data):
     return skelInterface
 
 
-def calculate_bone_relative_to_parent(idx, parent_bones, inv_bind_pose_matrices):
-    par = parent_bones[idx]
-    if par == -1:
-        pbm = np.eye(4)
-    else:
-        pbm = inv_bind_pose_matrices[par]
-    bm = inv_bind_pose_matrices[idx]
-
-    # Remember that bm is the inverse of the bone matrix, and pbm is the inverse of the parent's bone matrix,
-    # so what we're really doing here is multiplying the inverse parent matrix by the ordinary child matrix.
-    # This leaves us with just the transform of the child relative to the parent, since all the parent's contribution
-    # to the child's transform has been taken off
-    diff = np.dot(pbm, np.linalg.inv(bm))
-
-    pos = diff[:, 3]
-    rot = rotation_matrix_to_quat(diff[:3, :3])
-
-    return rot, pos, np.ones(4)
-
-
-def make_geominterface(filepath, model_data, platform):
+def make_geominterface(filepath, model_data, platform, use_triangle_strips=False, optimise_vertex_cache=False):
     geomInterface = GeomInterface()
 
     geomInterface.meshes = []
-    for mesh in model_data.meshes:
+    for i, mesh in enumerate(model_data.meshes):
         gi_mesh = geomInterface.add_mesh()
         gi_mesh.unknown_0x31 = mesh.unknown_data['unknown_0x31']
         gi_mesh.unknown_0x34 = mesh.unknown_data['unknown_0x34']
         gi_mesh.unknown_0x36 = mesh.unknown_data['unknown_0x36']
         gi_mesh.unknown_0x4C = mesh.unknown_data['unknown_0x4C']
 
+        vertices = mesh.vertices.copy()
         for uv_type in ['UV', 'UV2', 'UV3']:
-            if uv_type in mesh.vertices[0]:
-                for vertex in mesh.vertices:
-                    u, v = vertex[uv_type]
-                    vertex[uv_type] = (u, 1. - v)
+            if uv_type in vertices:
+                vertices.set_attribute(uv_type, flip_uvs(vertices.attributes[uv_type]))
 
         gi_mesh.vertex_group_bone_idxs = [vg.bone_idx for vg in mesh.vertex_groups]
-        gi_mesh.vertices = mesh.vertices
+        gi_mesh.vertices = vertices
         gi_mesh.polygons = [p.indices for p in mesh.polygons]
         gi_mesh.material_id = mesh.material_id
+        if optimise_vertex_cache:
+            optimise_mesh_vertex_cache(gi_mesh, i)
 
     geomInterface.material_data = []
     for mat in model_data.materials:
@@ -110,148 +97,35 @@ def make_geominterface(filepath, model_data, platform):
     geomInterface.inverse_bind_pose_matrices = model_data.skeleton.inverse_bind_pose_matrices
     geomInterface.unknown_footer_data = model_data.unknown_data['unknown_footer_data']
 
-    geomInterface.to_file(filepath + '.geom', platform)
+    geomInterface.to_file(filepath + '.geom', platform, use_triangle_strips)
+
+
+def optimise_mesh_vertex_cache(gi_mesh, mesh_idx):
+    """
+    Reorders the triangles of a mesh for post-transform vertex cache reuse, and then the vertices into the order the
+    triangles first use them.
+    """
+    triangles = np.asarray(gi_mesh.polygons, dtype=np.int64).reshape((-1, 3))
+    acmr_before = average_cache_miss_ratio(triangles)
+    triangles = triangles[tipsify(triangles, len(gi_mesh.vertices))]
+    vertex_order, triangles = order_vertices_by_first_use(triangles, len(gi_mesh.vertices))
+    gi_mesh.vertices = gi_mesh.vertices.take(vertex_order)
+    gi_mesh.polygons = triangles
+    print(f"Mesh {mesh_idx}: ACMR {acmr_before:.3f} -> {average_cache_miss_ratio(triangles):.3f}.")
+
+
+def make_animinterface(file_folder, model_data, animation_name, sk, keyframe_tolerance=None):
+    animation = model_data.animations[animation_name]
+    animInterface = AnimInterface()
+    animInterface.playback_rate = animation.playback_rate
+    animInterface.num_frames = animation.num_frames
+    animInterface.rotations = {bone_idx: (fcurve.frames, fcurve.values) for bone_idx, fcurve in animation.rotations.items()}
+    animInterface.locations = {bone_idx: (fcurve.frames, fcurve.values) for bone_idx, fcurve in animation.locations.items()}
+    animInterface.scales = {bone_idx: (fcurve.frames, fcurve.values) for bone_idx, fcurve in animation.scales.items()}
+
+    animInterface.to_file(os.path.join(file_folder, animation_name + '.anim'), sk, keyframe_tolerance)
+
 
-# def make_animreader(file_folder, model_data, animation_name, sk):
-#     animation = model_data.animations[animation_name]
-#     with open(file_folder + animation_name + '.anim', 'wb') as F:
-#         animReader = AnimReader(F, sk)
-#         animReader.filetype = '40AE'
-#         animReader.animation_duration = animation.num_frames/animation.playback_rate
-#         animReader.playback_rate = animation.playback_rate
-#
-#         animReader.num_bones = sk.num_bones
-#         animReader.total_frames = animation.num_frames + 1
-#         animReader.always_16384 = 16384
-#
-#         static_rots, nonstatic_rots = get_static_animation_elements(animation.rotations)
-#         static_locs, nonstatic_locs = get_static_animation_elements(animation.locations)
-#         static_scls, nonstatic_scls = get_static_animation_elements(animation.scales)
-#
-#         animReader.initial_pose_bone_rotations_count = len(static_rots)
-#         animReader.initial_pose_bone_locations_count = len(static_locs)
-#         animReader.initial_pose_bone_scales_count = len(static_scls)
-#         animReader.unknown_0x1C = 0  # Hardcoded for now...
-#         animReader.keyframe_bone_rotations_count = len(nonstatic_rots)
-#         animReader.keyframe_bone_locations_count = len(nonstatic_locs)
-#         animReader.keyframe_bone_scales_count = len(nonstatic_scls)
-#         animReader.unknown_0x24 = 0  # Hardcoded for now...
-#
-#         animReader.padding_0x26 = 0
-#         animReader.bone_mask_bytes = 0  # Hardcoded for now...
-#         animReader.abs_ptr_bone_mask = 0  # Hardcoded for now...
-#
-#         ###### TODO #########
-#         animReader.unknown_0x30 = 0x30 + 0
-#         animReader.unknown_0x34 = 0x34 + 0
-#         animReader.rel_ptr_initial_pose_bone_rotations = 0x38 + 0
-#         animReader.rel_ptr_initial_pose_bone_locations = 0x3C + 0
-#         animReader.rel_ptr_initial_pose_bone_scales = 0x40 + 0
-#         animReader.unknown_0x44 = 0x44 + 0
-#
-#         animReader.padding_0x48 = 0
-#         animReader.padding_0x4C = 0
-#         animReader.padding_0x50 = 0
-#         animReader.padding_0x54 = 0
-#         animReader.padding_0x58 = 0
-#         animReader.padding_0x5C = 0
-#
-#         #
-#
-#         animReader.initial_pose_rotations_bone_idxs = static_rots
-#         animReader.initial_pose_locations_bone_idxs = static_locs
-#         animReader.initial_pose_scales_bone_idxs = static_scls
-#         animReader.unknown_bone_idxs_4 = []
-#         animReader.keyframe_rotations_bone_idxs = nonstatic_rots
-#         animReader.keyframe_locations_bone_idxs = nonstatic_locs
-#         animReader.keyframe_scales_bone_idxs = nonstatic_scls
-#         animReader.unknown_bone_idxs_8 = []
-#
-#         #
-#
-#         animReader.initial_pose_bone_rotations = [animation.rotations[bidx] for bidx in static_rots]
-#         animReader.initial_pose_bone_locations = [animation.locations[bidx] for bidx in static_locs]
-#         animReader.initial_pose_bone_scales = [animation.scales[bidx] for bidx in static_scls]
-#         animReader.unknown_data_4 = []
-#
-#         #
-#
-#         keyframe_chunks, frame_splits = chunk_keyframes({bidx: animation.rotations[bidx] for bidx in nonstatic_rots}, nonstatic_rots,
-#                                                         {bidx: animation.locations[bidx] for bidx in nonstatic_locs}, nonstatic_locs,
-#                                                         {bidx: animation.scales[bidx] for bidx in nonstatic_scls}, nonstatic_scls,
-#                                                         animation.num_frames)
-#         animReader.num_keyframe_chunks = len(keyframe_chunks)
-#         print(len(keyframe_chunks), frame_splits)
-#         animReader.keyframe_chunks_ptrs = None  # TODO
-#         animReader.keyframe_counts = [(frame_splits[i], frame_splits[i+1]-frame_splits[i])
-#                                       for i in range(len(frame_splits)-1)]
-#         animReader.bone_masks = None
-#         animReader.unknown_data_masks = []  # TODO
-#
-#         #
-#         print(animation_name, animReader.keyframe_counts)
-#
-#         animReader.prepare_read_op()
-#         for keyframe_chunks in animReader.keyframe_chunks:
-#             pass  # TODO
-#
-#
-# def get_static_animation_elements(elem_dict):
-#     statics = []
-#     nonstatics = []
-#     for bone_idx, elem in elem_dict.items():
-#         (statics if elem.frames == [0] else nonstatics).append(bone_idx)
-#     return statics, nonstatics
-#
-#
-# def chunk_keyframes(kf_rots, kf_rots_idxs, kf_locs, kf_locs_idxs, kf_scls, kf_scls_idxs, nframes):
-#     kf_chunks = [gen_kf_chunks_structure(kf_rots_idxs, kf_locs_idxs, kf_scls_idxs)]
-#     frame_splits = [0]
-#     rotbytes = 0
-#     locbytes = 0
-#     sclbytes = 0
-#     for i in range(nframes):
-#         rots = {bidx: (i, kf_rots[bidx].values[kf_rots[bidx].frames.index(i)]) for bidx in kf_rots_idxs if i in kf_rots[bidx].frames}
-#         locs = {bidx: (i, kf_locs[bidx].values[kf_locs[bidx].frames.index(i)]) for bidx in kf_locs_idxs if i in kf_locs[bidx].frames}
-#         scls = {bidx: (i, kf_scls[bidx].values[kf_scls[bidx].frames.index(i)]) for bidx in kf_scls_idxs if i in kf_scls[bidx].frames}
-#
-#         rotbytes += len(rots)*6
-#         locbytes += len(locs)*12
-#         sclbytes += len(scls)*12
-#
-#         if rotbytes > 0xFFFF or locbytes > 0xFFFF or sclbytes > 0xFFFF or (i == nframes-1):
-#             kf_chunks.append(gen_kf_chunks_structure(kf_rots_idxs, kf_locs_idxs, kf_scls_idxs))
-#             frame_splits.append(i - 1)
-#
-#             rotbytes = 0
-#             locbytes = 0
-#             sclbytes = 0
-#
-#             print(rots)
-#             print(locs)
-#             print(scls)
-#
-#         for bidx in rots:
-#             kf_chunks[-1][0][bidx].append(rots[bidx])
-#         for bidx in locs:
-#             kf_chunks[-1][1][bidx].append(locs[bidx])
-#         for bidx in scls:
-#             kf_chunks[-1][2][bidx].append(scls[bidx])
-#
-#     if nframes == 0:
-#         frame_splits.append(nframes)
-#     else:
-#         frame_splits.append(nframes-1)
-#
-#     return kf_chunks, frame_splits
-#
-#
-# def gen_kf_chunks_structure(kf_rots_idxs, kf_locs_idx, kf_scls_idxs):
-#     return [{bidx: [] for bidx in kf_rots_idxs},
-#             {bidx: [] for bidx in kf_locs_idx},
-#             {bidx: [] for bidx in kf_scls_idxs}]
-#
-#
 # def gen_bone_hierarchy(parent_bones):
 #     to_return = []
 #     parsed_bones = []
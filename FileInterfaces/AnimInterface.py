@@ -0,0 +1,397 @@
+from ..FileReaders.BaseRW import buffer_file_write
+from ..FileReaders.AnimReader import AnimReader, KeyframeChunk
+from ..Utilities.Interpolation import interpolate_keyframes
+from ..Utilities.KeyframeReduction import remove_redundant_keyframes
+import numpy as np
+import os
+
+
+class AnimInterface:
+    def __init__(self):
+        self.playback_rate = None
+        self.num_frames = None  # Index of the final frame
+
+        # Each of these maps a bone index to a (frames, values) pair. Rotations are quaternions in the WXYZ ordering.
+        self.rotations = {}
+        self.locations = {}
+        self.scales = {}
+
+    def to_file(self, path, skelInterface, keyframe_tolerance=None, atomic=False):
+        num_frames = int(self.num_frames)
+        assert num_frames < 0xFFFF, f"Animation has {num_frames + 1} frames; at most {0xFFFF} can be written."
+
+        # Tracks with a single keyframe go in the static pose, the rest are keyframed
+        all_tracks = (AnimTracks(self.rotations, 4, is_quaternion=True),
+                      AnimTracks(self.locations, 3),
+                      AnimTracks(self.scales, 3))
+        if keyframe_tolerance is not None:
+            unreduced_size = calculate_file_size(all_tracks, num_frames)
+            unreduced_keyframes = sum([tracks.num_keyframes for tracks in all_tracks])
+            unreduced_static = sum([tracks.num_static for tracks in all_tracks])
+            all_tracks, max_error, chunk_boundaries = reduce_keyframes(all_tracks, num_frames, keyframe_tolerance)
+            reduced_size = calculate_file_size(all_tracks, num_frames, chunk_boundaries)
+            print(f"{os.path.split(path)[-1]}: "
+                  f"{unreduced_keyframes} -> {sum([tracks.num_keyframes for tracks in all_tracks])} keyframes, "
+                  f"{unreduced_static} -> {sum([tracks.num_static for tracks in all_tracks])} static tracks, "
+                  f"{unreduced_size} -> {reduced_size} bytes ({unreduced_size - reduced_size} saved), "
+                  f"max reconstruction error {max_error:.2e}.")
+        else:
+            chunk_boundaries = None
+        rotation_tracks, location_tracks, scale_tracks = all_tracks
+        chunk_starts, chunk_ends = calculate_keyframe_chunk_bounds(all_tracks, num_frames,
+                                                                   chunk_boundaries=chunk_boundaries)
+
+        with buffer_file_write(path, atomic) as F:
+            animReader = AnimReader(F, skelInterface)
+
+            animReader.filetype = '40AE'
+            animReader.animation_duration = num_frames / self.playback_rate
+            animReader.playback_rate = self.playback_rate
+
+            animReader.num_bones = len(skelInterface.rest_pose)
+            animReader.total_frames = num_frames + 1
+            animReader.num_keyframe_chunks = len(chunk_starts)
+            animReader.always_16384 = 16384
+
+            animReader.static_pose_bone_rotations_count = rotation_tracks.num_static
+            animReader.static_pose_bone_locations_count = location_tracks.num_static
+            animReader.static_pose_bone_scales_count = scale_tracks.num_static
+            animReader.unknown_0x1C = 0  # Hardcoded for now...
+            animReader.animated_bone_rotations_count = rotation_tracks.num_animated
+            animReader.animated_bone_locations_count = location_tracks.num_animated
+            animReader.animated_bone_scales_count = scale_tracks.num_animated
+            animReader.unknown_0x24 = 0  # Hardcoded for now...
+            animReader.padding_0x26 = 0
+            animReader.bone_mask_bytes = 0  # Hardcoded for now...
+            animReader.abs_ptr_bone_mask = 0  # Hardcoded for now...
+
+            animReader.padding_0x48 = 0
+            animReader.padding_0x4C = 0
+            animReader.padding_0x50 = 0
+            animReader.padding_0x54 = 0
+            animReader.padding_0x58 = 0
+            animReader.padding_0x5C = 0
+
+            animReader.static_pose_rotations_bone_idxs = rotation_tracks.static_bone_idxs
+            animReader.static_pose_locations_bone_idxs = location_tracks.static_bone_idxs
+            animReader.static_pose_scales_bone_idxs = scale_tracks.static_bone_idxs
+            animReader.unknown_bone_idxs_4 = []
+            animReader.max_val_1 = 0
+            animReader.animated_rotations_bone_idxs = rotation_tracks.animated_bone_idxs
+            animReader.animated_locations_bone_idxs = location_tracks.animated_bone_idxs
+            animReader.animated_scales_bone_idxs = scale_tracks.animated_bone_idxs
+            animReader.unknown_bone_idxs_8 = []
+            animReader.max_val_2 = 0
+
+            animReader.static_pose_bone_rotations = rotation_tracks.static_values
+            animReader.static_pose_bone_locations = location_tracks.static_values
+            animReader.static_pose_bone_scales = scale_tracks.static_values
+            animReader.unknown_data_4 = []
+
+            setup_pointers, virtual_pos = calculate_setup_layout(all_tracks, len(chunk_starts))
+            for pointer_name, pointer in setup_pointers.items():
+                setattr(animReader, pointer_name, pointer)
+            animReader.setup_and_static_data_size = virtual_pos
+
+            # Keyframe chunks
+            frame_0_values = [tracks.sample(chunk_starts) for tracks in all_tracks]
+            animReader.keyframe_chunks = []
+            animReader.keyframe_chunks_ptrs = []
+            animReader.keyframe_counts = []
+            for chunk_idx, (chunk_start, chunk_end) in enumerate(zip(chunk_starts, chunk_ends)):
+                kfchunk = KeyframeChunk(F)
+                chunk_size = make_keyframe_chunk(kfchunk, all_tracks, [values[chunk_idx] for values in frame_0_values],
+                                                 chunk_idx, chunk_start, chunk_end, chunk_idx == len(chunk_starts) - 1)
+                animReader.keyframe_chunks.append(kfchunk)
+                animReader.keyframe_chunks_ptrs.append((0, chunk_size, virtual_pos))
+                animReader.keyframe_counts.append((chunk_start, chunk_end - chunk_start))
+                virtual_pos += chunk_size
+
+            F.allocate(virtual_pos)
+            animReader.write()
+
+
+class AnimTracks:
+    """
+    Splits the tracks of one transform type into static tracks, which have a single keyframe, and animated tracks,
+    whose keyframes are concatenated together in bone order into flat arrays.
+    """
+    def __init__(self, tracks, num_components, is_quaternion=False):
+        self.num_components = num_components
+        self.is_quaternion = is_quaternion
+
+        self.static_bone_idxs = []
+        static_values = []
+        self.animated_bone_idxs = []
+        self.track_frames = []
+        self.track_values = []
+        for bone_idx, (frames, values) in sorted(tracks.items()):
+            frames, values = clean_track(frames, values, num_components)
+            if is_quaternion:
+                values = canonicalise_quaternions(values)
+            if len(frames) == 1:
+                self.static_bone_idxs.append(bone_idx)
+                static_values.append(values[0])
+            elif len(frames) > 1:
+                self.animated_bone_idxs.append(bone_idx)
+                self.track_frames.append(frames)
+                self.track_values.append(values)
+        self.static_values = np.array(static_values).reshape((-1, num_components))
+
+        # Keyframes of all animated tracks, ordered by track and then by frame
+        self.keyframe_tracks = np.repeat(np.arange(self.num_animated), [len(frames) for frames in self.track_frames])
+        self.keyframe_frames = np.concatenate([np.zeros(0, dtype=np.int64), *self.track_frames])
+        self.keyframe_values = np.concatenate([np.zeros((0, num_components)), *self.track_values])
+
+    @property
+    def num_static(self):
+        return len(self.static_bone_idxs)
+
+    @property
+    def num_animated(self):
+        return len(self.animated_bone_idxs)
+
+    @property
+    def num_keyframes(self):
+        return self.num_static + len(self.keyframe_frames)
+
+    def reduce_keyframes(self, tolerance, split_frames=()):
+        """
+        Returns a copy of the tracks with every keyframe removed that interpolation between the remaining keyframes
+        reproduces to within 'tolerance', plus the largest difference this makes to any removed keyframe. Tracks that
+        end up with a single keyframe move to the static pose.
+        """
+        tracks = {bone_idx: ([0], [values]) for bone_idx, values in zip(self.static_bone_idxs, self.static_values)}
+        max_error = 0.
+        for bone_idx, frames, values in zip(self.animated_bone_idxs, self.track_frames, self.track_values):
+            frames, values, error = remove_redundant_keyframes(frames, values, tolerance, self.is_quaternion,
+                                                               split_frames)
+            tracks[bone_idx] = (frames, values)
+            max_error = max(max_error, error)
+        return AnimTracks(tracks, self.num_components, self.is_quaternion), max_error
+
+    def select_keyframes(self, first_frame, final_frame):
+        """
+        Returns a mask over the keyframe columns that picks out the keyframes after first_frame, up to and including
+        final_frame.
+        """
+        return (self.keyframe_frames > first_frame) & (self.keyframe_frames <= final_frame)
+
+    def sample(self, frames):
+        """
+        Returns the values of every animated track at the given frames, as a (num_frames, num_animated, num_components)
+        array.
+        """
+        sampled_values = np.zeros((len(frames), self.num_animated, self.num_components))
+        for i, (track_frames, track_values) in enumerate(zip(self.track_frames, self.track_values)):
+            sampled_values[:, i] = interpolate_keyframes(track_frames, track_values, frames, self.is_quaternion)
+        if self.is_quaternion:
+            sampled_values = canonicalise_quaternions(sampled_values)
+        return sampled_values
+
+
+def clean_track(frames, values, num_components):
+    """
+    Rounds the frames of a track to whole frames, and sorts the keyframes by frame. If several keyframes land on the
+    same frame, the last one is kept.
+    """
+    frames = np.rint(np.asarray(frames, dtype=np.float64)).astype(np.int64)
+    values = np.asarray(values, dtype=np.float64).reshape((len(frames), num_components))
+    frames, last_occurrences = np.unique(frames[::-1], return_index=True)
+    return frames, values[::-1][last_occurrences]
+
+
+def canonicalise_quaternions(quats):
+    """
+    Flips the sign of any quaternion whose largest-magnitude component is negative. The quaternion serialiser drops
+    the largest positive component, so this keeps the three components it stores within range.
+    """
+    quats = np.asarray(quats)
+    largest_components = np.take_along_axis(quats, np.argmax(np.abs(quats), axis=-1)[..., np.newaxis], axis=-1)
+    return np.where(largest_components < 0, -quats, quats)
+
+
+def reduce_keyframes(all_tracks, num_frames, tolerance):
+    """
+    Removes the keyframes that interpolation reproduces to within 'tolerance' from every track, and returns the
+    reduced tracks with the frames that keyframe chunks of the reduced tracks may start on.
+
+    The first frame of each keyframe chunk stores an interpolated value for every animated track, and interpolating
+    quaternions from that value onwards doesn't retrace the original arc. So the chunks are laid out for the unreduced
+    tracks first, with room to spare for a keyframe of every track on the final frame of each chunk, and each track is
+    made to keep a keyframe on every chunk boundary. The reduced tracks then fit in the same chunks, which can be merged
+    wherever they have room without any chunk starting between keyframes.
+    """
+    frame_bytes = sum([bytes_per_value * tracks.num_animated
+                       for tracks, bytes_per_value in zip(all_tracks, (6, 12, 12))])
+    chunk_starts, _ = calculate_keyframe_chunk_bounds(all_tracks, num_frames, 0xFFFF - frame_bytes)
+    reduced = [tracks.reduce_keyframes(tolerance, chunk_starts[1:]) for tracks in all_tracks]
+    return tuple([tracks for tracks, _ in reduced]), max([error for _, error in reduced]), chunk_starts
+
+
+def calculate_setup_layout(all_tracks, num_keyframe_chunks):
+    """
+    Returns the relative pointers stored in the header, which are taken from the position of each pointer, and the
+    size of everything that comes before the keyframe chunks.
+    """
+    rotation_tracks, location_tracks, scale_tracks = all_tracks
+    pointers = {}
+
+    # Header is 96 bytes long
+    virtual_pos = 96
+
+    # Bone index lists are padded with the bone count
+    for num_idxs, chunksize in [(rotation_tracks.num_static, 16),
+                                (location_tracks.num_static, 8),
+                                (scale_tracks.num_static, 8),
+                                (rotation_tracks.num_animated, 8),
+                                (location_tracks.num_animated, 8),
+                                (scale_tracks.num_animated, 8)]:
+        virtual_pos += 2 * num_idxs
+        virtual_pos += (chunksize - ((2 * num_idxs) % chunksize)) % chunksize
+    virtual_pos += (16 - (virtual_pos % 16)) % 16
+
+    # Static pose
+    pointers['rel_ptr_static_pose_bone_rotations'] = virtual_pos - 0x38
+    virtual_pos += 6 * rotation_tracks.num_static
+    virtual_pos += (16 - (virtual_pos % 16)) % 16
+    pointers['rel_ptr_static_pose_bone_locations'] = virtual_pos - 0x3C
+    virtual_pos += 12 * location_tracks.num_static
+    virtual_pos += (16 - (virtual_pos % 16)) % 16
+    pointers['rel_ptr_static_pose_bone_scales'] = virtual_pos - 0x40
+    virtual_pos += 12 * scale_tracks.num_static
+    pointers['rel_ptr_static_unknown_4'] = virtual_pos - 0x44
+    virtual_pos += (16 - (virtual_pos % 16)) % 16
+
+    pointers['rel_ptr_keyframe_chunks_ptrs'] = virtual_pos - 0x30
+    virtual_pos += 8 * num_keyframe_chunks
+    pointers['rel_ptr_keyframe_chunks_counts'] = virtual_pos - 0x34
+    virtual_pos += 4 * num_keyframe_chunks
+    virtual_pos += (16 - (virtual_pos % 16)) % 16
+
+    return pointers, virtual_pos
+
+
+def calculate_file_size(all_tracks, num_frames, chunk_boundaries=None):
+    chunk_starts, chunk_ends = calculate_keyframe_chunk_bounds(all_tracks, num_frames,
+                                                               chunk_boundaries=chunk_boundaries)
+    _, file_size = calculate_setup_layout(all_tracks, len(chunk_starts))
+    num_tracks = sum([tracks.num_animated for tracks in all_tracks])
+    for chunk_idx, (chunk_start, chunk_end) in enumerate(zip(chunk_starts, chunk_ends)):
+        final_keyframe = chunk_end if chunk_idx == len(chunk_starts) - 1 else chunk_end - 1
+        num_keyframed_values = [np.count_nonzero(tracks.select_keyframes(chunk_start, final_keyframe))
+                                for tracks in all_tracks]
+        _, _, chunk_size = calculate_keyframe_chunk_bytecounts([tracks.num_animated for tracks in all_tracks],
+                                                               num_keyframed_values, num_tracks,
+                                                               chunk_end - chunk_start)
+        file_size += chunk_size
+    return file_size
+
+
+def calculate_keyframe_chunk_bounds(all_tracks, num_frames, max_chunk_size=0xFFFF, chunk_boundaries=None):
+    """
+    Greedily splits the frames of the animation into keyframe chunks of at most max_chunk_size bytes, returning the
+    first and final frame of each chunk. If chunk_boundaries is given, chunks only start and end on those frames and
+    the final frame.
+
+    Each chunk stores the value of every animated track on its first frame, followed by a bit-mask and the values of
+    the keyframes on its remaining frames. The final frame of a chunk is the first frame of the next chunk, so its
+    keyframes are stored in the next chunk instead.
+    """
+    # Fixed size of every chunk: header, first-frame values, up to 2 + 2 bytes of alignment after each set of scales,
+    # a partial mask byte, and alignment to the end of the chunk
+    fixed_bytes = 16 + 2 + 2 + 1 + 15
+    num_tracks = sum([tracks.num_animated for tracks in all_tracks])
+    frame_bytes = np.zeros(num_frames + 1)
+    for tracks, bytes_per_value in zip(all_tracks, (6, 12, 12)):
+        fixed_bytes += bytes_per_value * tracks.num_animated
+        frame_bytes += bytes_per_value * np.bincount(tracks.keyframe_frames, minlength=num_frames + 1)
+    frame_bytes += num_tracks / 8
+
+    # Chunk bytes for frames (start, end] are bounded by cumulative_bytes[end] - cumulative_bytes[start] + fixed_bytes
+    cumulative_bytes = np.cumsum(frame_bytes)
+    max_chunk_ends = np.searchsorted(cumulative_bytes, cumulative_bytes + max_chunk_size - fixed_bytes, side='right') - 1
+    if chunk_boundaries is None:
+        allowed_chunk_ends = np.arange(num_frames + 1)
+    else:
+        allowed_chunk_ends = np.union1d(chunk_boundaries, [num_frames])
+
+    chunk_starts = []
+    chunk_ends = []
+    chunk_start = 0
+    while True:
+        chunk_end = min(int(max_chunk_ends[chunk_start]), num_frames)
+        chunk_end = int(allowed_chunk_ends[np.searchsorted(allowed_chunk_ends, chunk_end, side='right') - 1])
+        assert chunk_end > chunk_start or num_frames == 0, \
+            f"Frame {chunk_start + 1} of the animation has too much keyframe data to fit in a keyframe chunk."
+        chunk_starts.append(chunk_start)
+        chunk_ends.append(chunk_end)
+        if chunk_end >= num_frames:
+            break
+        chunk_start = chunk_end
+    return chunk_starts, chunk_ends
+
+
+def make_keyframe_chunk(kfchunk, all_tracks, frame_0_values, chunk_idx, chunk_start, chunk_end, is_final_chunk):
+    """
+    Fills in a KeyframeChunk with the values of every animated track on frame chunk_start, and the keyframes of the
+    frames up to chunk_end. Returns the number of bytes the chunk will take up in the file.
+    """
+    num_tracks = sum([tracks.num_animated for tracks in all_tracks])
+    num_chunk_frames = chunk_end - chunk_start
+    final_keyframe = chunk_end if is_final_chunk else chunk_end - 1
+
+    masks = []
+    keyframed_values = []
+    for tracks in all_tracks:
+        in_chunk = tracks.select_keyframes(chunk_start, final_keyframe)
+        channel_masks = np.zeros((tracks.num_animated, num_chunk_frames), dtype=bool)
+        channel_masks[tracks.keyframe_tracks[in_chunk], tracks.keyframe_frames[in_chunk] - chunk_start - 1] = True
+        masks.append(channel_masks)
+        keyframed_values.append(tracks.keyframe_values[in_chunk])
+
+    kfchunk.frame_0_rotations, kfchunk.frame_0_locations, kfchunk.frame_0_scales = frame_0_values
+    kfchunk.unknown_data_4 = []
+    kfchunk.keyframes_in_use = np.concatenate(masks).reshape((num_tracks, num_chunk_frames))
+    kfchunk.keyframed_rotations, kfchunk.keyframed_locations, kfchunk.keyframed_scales = keyframed_values
+    kfchunk.unknown_data_9 = []
+
+    frame_0_bytecounts, keyframed_bytecounts, chunk_size = \
+        calculate_keyframe_chunk_bytecounts([tracks.num_animated for tracks in all_tracks],
+                                            [len(values) for values in keyframed_values],
+                                            num_tracks, num_chunk_frames)
+    kfchunk.frame_0_rotations_bytecount, kfchunk.frame_0_locations_bytecount, kfchunk.frame_0_scales_bytecount = \
+        frame_0_bytecounts
+    kfchunk.unknown_0x06 = 0
+    kfchunk.keyframed_rotations_bytecount, kfchunk.keyframed_locations_bytecount, \
+        kfchunk.keyframed_scales_bytecount = keyframed_bytecounts
+    kfchunk.unknown_0x0E = 0
+
+    assert chunk_size <= 0xFFFF, f"Keyframe chunk {chunk_idx} is {chunk_size} bytes long; at most {0xFFFF} can be written."
+    return chunk_size
+
+
+def calculate_keyframe_chunk_bytecounts(num_frame_0_values, num_keyframed_values, num_tracks, num_chunk_frames):
+    """
+    Returns the bytecounts of the rotation, location, and scale sections of a keyframe chunk holding the given numbers
+    of first-frame and keyframed values, followed by the size of the whole chunk.
+    """
+    chunk_size = 16
+    all_bytecounts = []
+    for section_idx, value_counts in enumerate([num_frame_0_values, num_keyframed_values]):
+        if section_idx == 1:
+            chunk_size += int(np.ceil(num_tracks * num_chunk_frames / 8))
+        num_rotations, num_locations, num_scales = value_counts
+        rotations_bytecount = 6 * num_rotations
+        locations_bytecount = 12 * num_locations
+        chunk_size += rotations_bytecount + locations_bytecount
+        # Scales are followed by padding to the next multiple of 4 bytes from the start of the chunk
+        scales_bytecount = 12 * num_scales
+        if scales_bytecount != 0:
+            scales_bytecount += (4 - (chunk_size % 4)) % 4
+        chunk_size += scales_bytecount
+        all_bytecounts.append((rotations_bytecount, locations_bytecount, scales_bytecount))
+    chunk_size += (16 - (chunk_size % 16)) % 16
+
+    frame_0_bytecounts, keyframed_bytecounts = all_bytecounts
+    return frame_0_bytecounts, keyframed_bytecounts, chunk_size
@@ -1,26 +1,41 @@
 import numpy as np
 from ...FileReaders.GeomReader.VertexComponents import vertex_components_from_names
+from ...Utilities.VertexArrays import VertexArrays
 
 
 ##################################
 #  Polygon data type converters  #
 ##################################
 def triangle_strips_to_polys(idxs):
-    triangles = []
-    for i, tri in enumerate(zip(idxs, idxs[1:], idxs[2:])):
-        order = i % 2
-        tri = (tri[0 + order], tri[1 - order], tri[2])
-        triangle = set(tri)
-        if not (len(triangle) != 3 or tri in triangles):
-            triangles.append(tri)
-    return triangles
+    """
+    Decodes a triangle strip into an (M, 3) array of triangles. Every other triangle in the strip has its first two
+    indices swapped to keep a consistent winding order, and degenerate or repeated triangles are dropped. The first
+    occurrence of each triangle is kept, in strip order.
+    """
+    idxs = np.asarray(idxs, dtype=np.int64)
+    if len(idxs) < 3:
+        return np.zeros((0, 3), dtype=np.int64)
+
+    # Index gather rather than sliding_window_view, which needs NumPy 1.20 and Blender 2.8x ships older versions
+    triangles = idxs[np.arange(len(idxs) - 2)[:, np.newaxis] + np.arange(3)]
+    odd_triangles = triangles[1::2]
+    odd_triangles[:, [0, 1]] = odd_triangles[:, [1, 0]]
+
+    is_degenerate = (triangles[:, 0] == triangles[:, 1]) | \
+                    (triangles[:, 1] == triangles[:, 2]) | \
+                    (triangles[:, 0] == triangles[:, 2])
+    triangles = triangles[~is_degenerate]
+
+    # Pack each triangle into one integer key so that duplicates can be found with a 1D unique
+    assert np.all(triangles < 2**21), "Triangle strip indices are too large to pack into a triangle key."
+    triangle_keys = (triangles[:, 0] << 42) | (triangles[:, 1] << 21) | triangles[:, 2]
+    _, first_occurrences = np.unique(triangle_keys, return_index=True)
+    return triangles[np.sort(first_occurrences)]
 
 
 def triangles_to_polys(idxs):
-    triangles = []
-    for tri, (idx_a, idx_b, idx_c) in enumerate(zip(idxs[::3], idxs[1::3], idxs[2::3])):
-        triangles.append((idx_a, idx_b, idx_c))
-    return triangles
+    idxs = np.asarray(idxs, dtype=np.int64)
+    return idxs[:3 * (len(idxs) // 3)].reshape((-1, 3))
 
 
 triangle_converters = {'Triangles': triangles_to_polys,
@@ -34,7 +49,7 @@ class MeshInterface:
         self.unknown_0x36 = None
         self.unknown_0x4C = None
 
-        self.vertices = []
+        self.vertices = VertexArrays()
         self.vertex_group_bone_idxs = []
         self.polygons = []
         self.material_id = None
@@ -59,7 +74,7 @@ class MeshInterface:
 
         return interface
 
-    def to_subfile(self, meshReader, virtual_pos):
+    def to_subfile(self, meshReader, virtual_pos, use_triangle_strips=False):
         meshReader.vertex_data_start_ptr = virtual_pos
 
         vgroup_idxs = self.vertex_group_bone_idxs
@@ -68,12 +83,18 @@ class MeshInterface:
 
         meshReader.vertex_data = generate_vertex_data(self.vertices, vertex_generators)
 
-        virtual_pos += meshReader.bytes_per_vertex * len(meshReader.vertex_data)
+        virtual_pos += meshReader.bytes_per_vertex * len(self.vertices)
         meshReader.weighted_bone_data_start_ptr = virtual_pos
         meshReader.weighted_bone_idxs = vgroup_idxs
         virtual_pos += 4 * len(meshReader.weighted_bone_idxs)
         meshReader.polygon_data_start_ptr = virtual_pos
         meshReader.polygon_data = polys_to_triangles(self.polygons)
+        polygon_data_type = 'Triangles'
+        if use_triangle_strips:
+            triangle_strips = polys_to_triangle_strips(self.polygons)
+            if len(triangle_strips) < len(meshReader.polygon_data):
+                meshReader.polygon_data = triangle_strips
+                polygon_data_type = 'TriangleStrips'
         virtual_pos += 2 * len(meshReader.polygon_data)
         virtual_pos += (4 - (virtual_pos % 4)) % 4  # Fix ragged chunk of size 4
         meshReader.padding_0x18 = 0
@@ -84,23 +105,25 @@ class MeshInterface:
         meshReader.num_vertex_components = len(meshReader.vertex_components)
         meshReader.always_5123 = meshReader.header_breaker
 
-        meshReader.max_vertex_groups_per_vertex = max([len(vtx['WeightedBoneID']) if vtx['WeightedBoneID'] is not None else 0 for vtx in self.vertices])
+        meshReader.max_vertex_groups_per_vertex = self.vertices.max_groups_per_vertex
         meshReader.max_vertex_groups_per_vertex = 0 if len(meshReader.weighted_bone_idxs) == 1 else meshReader.max_vertex_groups_per_vertex
         meshReader.unknown_0x31 = self.unknown_0x31
-        meshReader.polygon_numeric_data_type = 4  # Can only write to triangles atm
+        polygon_type_ids = {value: key for key, value in meshReader.get_polygon_type_defs().items()}
+        meshReader.polygon_data_type = polygon_data_type
+        meshReader.polygon_numeric_data_type = polygon_type_ids[polygon_data_type]
         meshReader.unknown_0x34 = self.unknown_0x34
         meshReader.unknown_0x36 = self.unknown_0x36
         meshReader.material_id = self.material_id
-        meshReader.num_vertices = len(meshReader.vertex_data)
+        meshReader.num_vertices = len(self.vertices)
 
         meshReader.num_polygon_idxs = len(meshReader.polygon_data)
         meshReader.padding_0x44 = 0
         meshReader.padding_0x48 = 0
         meshReader.unknown_0x4C = self.unknown_0x4C
 
-        vertices = np.array([v['Position'] for v in self.vertices])
-        minvs = np.min(vertices, axis=0)
-        maxvs = np.max(vertices, axis=0)
+        positions = self.vertices.attributes['Position'][:, :3]
+        minvs = np.min(positions, axis=0).astype(np.float64)
+        maxvs = np.max(positions, axis=0).astype(np.float64)
         assert len(maxvs) == 3
 
         meshReader.mesh_centre = (maxvs + minvs) / 2
@@ -108,29 +131,27 @@ class MeshInterface:
         return virtual_pos
 
 
-def process_posweights(vertices, max_vertex_groups_per_vertex):
-    example_vertex = vertices[0]
-    if 'WeightedBoneID' in example_vertex:
-        for vtx in vertices:
-            res_ids = []
-            res_wghts = []
-            for id, wght in zip(vtx['WeightedBoneID'], vtx['BoneWeight']):
-                if wght != 0.:
-                    res_ids.append(id//3)
-                    res_wghts.append(wght)
-            vtx['WeightedBoneID'] = res_ids
-            vtx['BoneWeight'] = res_wghts
-            if len(vtx['WeightedBoneID']) != len(vtx['BoneWeight']):
-                assert 0, f"{vtx['WeightedBoneID']} {vtx['BoneWeight']}"
+def process_posweights(vertex_data, max_vertex_groups_per_vertex):
+    """
+    Converts the raw vertex component columns read from file into vertex attributes plus skinning matrices.
+    """
+    vertices = VertexArrays(vertex_data.num_vertices)
+    for key, value in vertex_data.attributes.items():
+        if key not in VertexArrays.skinning_keys:
+            vertices.set_attribute(key, value)
+
+    if 'WeightedBoneID' in vertex_data.attributes:
+        bone_indices = vertex_data.attributes['WeightedBoneID'].astype(np.int64) // 3
+        bone_weights = vertex_data.attributes['BoneWeight'].astype(np.float32)
+        vertices.set_skinning(bone_indices, bone_weights)
     elif max_vertex_groups_per_vertex == 0:
-        for vtx in vertices:
-            vtx['WeightedBoneID'] = [0]
-            vtx['BoneWeight'] = [1]
+        vertices.set_skinning(np.zeros((vertices.num_vertices, 1), dtype=np.int64),
+                              np.ones((vertices.num_vertices, 1), dtype=np.float32))
     elif max_vertex_groups_per_vertex == 1:
-        for vtx in vertices:
-            vtx['WeightedBoneID'] = [int(vtx['Position'][3]) // 3]
-            vtx['BoneWeight'] = [1]
-            vtx['Position'] = vtx['Position'][:3]
+        positions = vertices.attributes['Position']
+        vertices.set_skinning(positions[:, 3:].astype(np.int64) // 3,
+                              np.ones((vertices.num_vertices, 1), dtype=np.float32))
+        vertices.set_attribute('Position', positions[:, :3])
     else:
         assert 0, "Something went seriously wrong when processing posweights."
 
@@ -143,37 +164,36 @@ def calculate_vertex_properties(vertices, num_vertex_groups):
     """
     bytes_per_vertex = 0
     vertex_components = []
-    example_vertex = vertices[0]
-    max_vtx_groups = max([len(vtx['WeightedBoneID']) for vtx in vertices])
-    if 'Position' in example_vertex:
+    max_vtx_groups = vertices.max_groups_per_vertex
+    if 'Position' in vertices:
         if max_vtx_groups == 1 and len(num_vertex_groups) > 1:
             vertex_components.append(vertex_components_from_names['PosWeight'](bytes_per_vertex))
             bytes_per_vertex += 16
         else:
             vertex_components.append(vertex_components_from_names['Position'](bytes_per_vertex))
             bytes_per_vertex += 12
-    if 'Normal' in example_vertex:
+    if 'Normal' in vertices:
         vertex_components.append(vertex_components_from_names['Normal'](bytes_per_vertex))
         bytes_per_vertex += 8
-    if 'UV' in example_vertex:
+    if 'UV' in vertices:
         vertex_components.append(vertex_components_from_names['UV'](bytes_per_vertex))
         bytes_per_vertex += 4
-    if 'UV2' in example_vertex:
+    if 'UV2' in vertices:
         vertex_components.append(vertex_components_from_names['UV2'](bytes_per_vertex))
         bytes_per_vertex += 4
-    if 'UV3' in example_vertex:
+    if 'UV3' in vertices:
         vertex_components.append(vertex_components_from_names['UV3'](bytes_per_vertex))
         bytes_per_vertex += 4
-    if 'Colour' in example_vertex:
+    if 'Colour' in vertices:
         vertex_components.append(vertex_components_from_names['Colour'](bytes_per_vertex))
         bytes_per_vertex += 8
-    if 'Tangent' in example_vertex:
+    if 'Tangent' in vertices:
         vertex_components.append(vertex_components_from_names['Tangent'](bytes_per_vertex))
         bytes_per_vertex += 8
-    if 'Binormal' in example_vertex:
+    if 'Binormal' in vertices:
         vertex_components.append(vertex_components_from_names['Binormal'](bytes_per_vertex))
         bytes_per_vertex += 8
-    if 'WeightedBoneID' in example_vertex and max_vtx_groups >= 2:
+    if 'WeightedBoneID' in vertices and max_vtx_groups >= 2:
         num_grps = max_vtx_groups
         vertex_components.append(vertex_components_from_names[f'Indices{num_grps}'](bytes_per_vertex))
         nominal_bytes = num_grps
@@ -187,10 +207,14 @@ def calculate_vertex_properties(vertices, num_vertex_groups):
 
 
 def generate_vertex_data(vertices, generators):
-    retval = []
-    for vertex in vertices:
-        vdata = [generator(vertex) for generator in generators]
-        retval.append({k: v for d in vdata for k, v in d.items()})
+    """
+    Runs the vertex component generators over the vertex columns and collects the results into one column per vertex
+    component.
+    """
+    retval = VertexArrays(len(vertices))
+    for generator in generators:
+        for key, value in generator(vertices).items():
+            retval.set_attribute(key, value)
     return retval
 
 
@@ -198,5 +222,64 @@ def polys_to_triangles(polys):
     return [sublist for lst in polys for sublist in lst]
 
 
+def polys_to_triangle_strips(polys):
+    """
+    Greedily joins the triangles into strips by walking across shared edges, and stitches the strips together into a
+    single index list with degenerate triangles. Every strip is stitched in at an even position so that its triangles
+    keep their winding order when decoded by triangle_strips_to_polys. Degenerate input triangles are dropped.
+    """
+    triangles = [tuple(tri) for tri in polys if len(set(tri)) == 3]
+    directed_edges = {}
+    for tri_idx, (idx_a, idx_b, idx_c) in enumerate(triangles):
+        for edge in ((idx_a, idx_b), (idx_b, idx_c), (idx_c, idx_a)):
+            directed_edges.setdefault(edge, []).append(tri_idx)
+    is_used = [False] * len(triangles)
+
+    def find_unused_triangle(edge):
+        candidates = directed_edges.get(edge, [])
+        while len(candidates) and is_used[candidates[-1]]:
+            candidates.pop()
+        return candidates[-1] if len(candidates) else None
+
+    def opposite_vertex(tri, edge):
+        for rotation in (tri, (*tri[1:], tri[0]), (tri[2], *tri[:2])):
+            if rotation[:2] == edge:
+                return rotation[2]
+
+    strips = []
+    for start_idx, tri in enumerate(triangles):
+        if is_used[start_idx]:
+            continue
+        is_used[start_idx] = True
+        # Start on whichever rotation of the triangle can be continued across its last edge
+        strip = list(tri)
+        for rotation in (tri, (*tri[1:], tri[0]), (tri[2], *tri[:2])):
+            if find_unused_triangle((rotation[2], rotation[1])) is not None:
+                strip = list(rotation)
+                break
+
+        while True:
+            # Odd triangles in a strip are decoded with their first two indices swapped
+            if len(strip) % 2 == 1:
+                edge = (strip[-1], strip[-2])
+            else:
+                edge = (strip[-2], strip[-1])
+            next_tri_idx = find_unused_triangle(edge)
+            if next_tri_idx is None:
+                break
+            is_used[next_tri_idx] = True
+            strip.append(opposite_vertex(triangles[next_tri_idx], edge))
+        strips.append(strip)
+
+    idxs = []
+    for strip in strips:
+        if len(idxs):
+            idxs.extend([idxs[-1], strip[0]])
+            if len(idxs) % 2 == 1:
+                idxs.append(strip[0])
+        idxs.extend(strip)
+    return idxs
+
+
 class MissingWeightsError(TypeError):
     pass
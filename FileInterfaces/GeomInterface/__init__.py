@@ -1,3 +1,4 @@
+from ...FileReaders.BaseRW import buffer_file_write, map_file
 from ...FileReaders.GeomReader import GeomReader
 from .MeshInterface import MeshInterface
 from .MaterialInterface import MaterialInterface
@@ -26,7 +27,7 @@ class GeomInterface:
 
     @classmethod
     def from_file(cls, path, platform):
-        with open(path, 'rb') as F:
+        with map_file(path) as F:
             readwriter = GeomReader.for_platform(F, platform)
             readwriter.read()
 
@@ -41,8 +42,8 @@ class GeomInterface:
 
         return new_interface
 
-    def to_file(self, path, platform):
-        with open(path, 'wb') as F:
+    def to_file(self, path, platform, use_triangle_strips=False, atomic=False):
+        with buffer_file_write(path, atomic) as F:
             geomReader = GeomReader.for_platform(F, platform)
 
             geomReader.filetype = 100
@@ -54,10 +55,11 @@ class GeomInterface:
 
             geomReader.num_bytes_in_texture_names_section = 32 * len(self.texture_data)
 
-            vertices = np.array([v['Position'] for mesh in self.meshes for v in mesh.vertices])
+            vertices = [mesh.vertices.attributes['Position'][:, :3] for mesh in self.meshes if len(mesh.vertices)]
             if len(vertices) > 0:
-                minvs = np.min(vertices, axis=0)
-                maxvs = np.max(vertices, axis=0)
+                vertices = np.concatenate(vertices)
+                minvs = np.min(vertices, axis=0).astype(np.float64)
+                maxvs = np.max(vertices, axis=0).astype(np.float64)
             else:
                 minvs = np.zeros(3)
                 maxvs = np.zeros(3)
@@ -76,8 +78,17 @@ class GeomInterface:
             # Dump meshes
             geomReader.meshes_start_ptr = virtual_pos if len(self.meshes) > 0 else 0
             virtual_pos += 104 * geomReader.num_meshes
-            for mesh, meshReader in zip(self.meshes, geomReader.meshes):
-                virtual_pos = mesh.to_subfile(meshReader, virtual_pos)
+            for i, (mesh, meshReader) in enumerate(zip(self.meshes, geomReader.meshes)):
+                virtual_pos = mesh.to_subfile(meshReader, virtual_pos, use_triangle_strips)
+                if use_triangle_strips:
+                    num_triangle_idxs = 3 * len(mesh.polygons)
+                    if meshReader.polygon_data_type == 'TriangleStrips':
+                        reduction = 100 * (1 - meshReader.num_polygon_idxs / num_triangle_idxs)
+                        print(f"Mesh {i}: {num_triangle_idxs} triangle indices -> "
+                              f"{meshReader.num_polygon_idxs} triangle strip indices ({reduction:.1f}% fewer).")
+                    else:
+                        print(f"Mesh {i}: triangle strips would not be smaller than the "
+                              f"{num_triangle_idxs} triangle indices; writing triangles.")
 
             # Dump materials
             geomReader.materials_start_ptr = virtual_pos if len(self.material_data) > 0 else 0
@@ -114,4 +125,7 @@ class GeomInterface:
             # Dump the footer data
             geomReader.unknown_footer_data = self.unknown_footer_data
             geomReader.footer_data_start_offset = virtual_pos if len(geomReader.unknown_footer_data) else 0
+            virtual_pos += len(geomReader.unknown_footer_data)
+
+            F.allocate(virtual_pos)
             geomReader.write()
@@ -1,3 +1,4 @@
+from ..FileReaders.BaseRW import buffer_file_write, map_file
 from ..FileReaders.NameReader import NameReader
 
 
@@ -8,7 +9,7 @@ class NameInterface:
 
     @classmethod
     def from_file(cls, path):
-        with open(path, 'rb') as F:
+        with map_file(path) as F:
             namereader = NameReader(F)
             namereader.read()
 
@@ -18,8 +19,8 @@ class NameInterface:
 
         return new_name_interface
 
-    def to_file(self, path):
-        with open(path, 'wb') as F:
+    def to_file(self, path, atomic=False):
+        with buffer_file_write(path, atomic) as F:
             readwriter = NameReader(F)
 
             bone_names = self.bone_names
@@ -38,4 +39,5 @@ class NameInterface:
             readwriter.bone_names = bone_names
             readwriter.material_names = material_names
 
+            F.allocate(8 + 4 * num_ptrs + sum([len(name) for name in bone_names + material_names]))
             readwriter.write()
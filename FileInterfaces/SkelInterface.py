@@ -1,4 +1,6 @@
+from ..FileReaders.BaseRW import buffer_file_write, map_file
 from ..FileReaders.SkelReader import SkelReader
+from ..Utilities.BoneHierarchy import BoneHierarchy
 from ..Utilities.Rotation import rotation_matrix_to_quat
 import numpy as np
 
@@ -17,7 +19,7 @@ class SkelInterface:
 
     @classmethod
     def from_file(cls, path):
-        with open(path, 'rb') as F:
+        with map_file(path) as F:
             readwriter = SkelReader(F)
             readwriter.read()
 
@@ -33,8 +35,8 @@ class SkelInterface:
 
         return new_interface
 
-    def to_file(self, path):
-        with open(path, 'wb') as F:
+    def to_file(self, path, atomic=False):
+        with buffer_file_write(path, atomic) as F:
             readwriter = SkelReader(F)
 
             readwriter.filetype = '20SE'
@@ -77,36 +79,28 @@ class SkelInterface:
             readwriter.padding_0x2E = 0
             readwriter.padding_0x32 = 0
 
+            # The file ends after unknown_data_4, padded out from where the remaining bytes were counted
+            end_of_unknown_data_4 = readwriter.unknown_rel_ptr_3 + 40 + readwriter.unknown_0x0C * 4
+            F.allocate(end_of_unknown_data_4 + (16 - (end_of_unknown_data_4 - bytes_after_parent_bones_chunk) % 16) % 16)
             readwriter.write()
 
     def bone_data_from_armature_space(self, bone_matrices):
-        bone_data = []
-        parent_bones = {c: p for c, p in self.parent_bones}
-        for i, bone_matrix in enumerate(bone_matrices):
-            parent_idx = parent_bones[i]
-            if parent_idx != -1:
-                parent_bone_matrix = bone_matrices[parent_idx]
-
-            else:
-                parent_bone_matrix = np.eye(4)
-
-            pr = parent_bone_matrix[:3, :3]
-            cr = bone_matrix[:3, :3]
-            rdiff = np.dot(pr.T, cr)
-            rdiff = rotation_matrix_to_quat(rdiff)
-
-            c_pos = bone_matrix[3, :3]
-            p_pos = parent_bone_matrix[3, :3]
-            diff = np.dot(pr.T, c_pos - p_pos)
-            diff = (*diff, 1.)
-
-            # Not really sure if setting the scale to always be 1 is legit, but...
-            # eh, doesn't look like it's stored in the geom
-            scal = (1., 1., 1., 1.)
-
-            bd = [tuple(rdiff), diff, scal]
-            bone_data.append(bd)
-        return bone_data
+        bone_matrices = np.asarray(bone_matrices, dtype=np.float64)
+        parent_bone_matrices = BoneHierarchy.from_bone_relations(self.parent_bones).parent_matrices(bone_matrices)
+
+        pr = parent_bone_matrices[:, :3, :3]
+        cr = bone_matrices[:, :3, :3]
+        rdiffs = rotation_matrix_to_quat(np.swapaxes(pr, 1, 2) @ cr)
+
+        c_pos = bone_matrices[:, 3, :3]
+        p_pos = parent_bone_matrices[:, 3, :3]
+        diffs = np.einsum('bji,bj->bi', pr, c_pos - p_pos)
+
+        # Not really sure if setting the scale to always be 1 is legit, but...
+        # eh, doesn't look like it's stored in the geom
+        scal = (1., 1., 1., 1.)
+
+        return [[tuple(rdiff), (*diff, 1.), scal] for rdiff, diff in zip(rdiffs, diffs)]
 
 
 def gen_bone_hierarchy(parent_bones):
@@ -1,7 +1,7 @@
 import numpy as np
 import struct
 
-from .BaseRW import BaseRW
+from .BaseRW import BaseRW, StructSchema
 
 
 class AnimReader(BaseRW):
@@ -29,6 +29,44 @@ class AnimReader(BaseRW):
     ------
     1.  The fourth data type - other than rotations, locations, and bones - looks like it might be UV coord shifts
     """
+    header_schema = StructSchema([('filetype', '4s'),
+
+                                  ('animation_duration', 'f'),
+                                  ('playback_rate', 'f'),
+
+                                  ('setup_and_static_data_size', 'H'),
+                                  ('num_bones', 'H'),
+                                  ('total_frames', 'H'),
+                                  ('num_keyframe_chunks', 'H'),
+                                  ('always_16384', 'H', 16384),  # Maybe this is the precision of the quaternions?
+
+                                  ('static_pose_bone_rotations_count', 'H'),
+                                  ('static_pose_bone_locations_count', 'H'),
+                                  ('static_pose_bone_scales_count', 'H'),
+                                  ('unknown_0x1C', 'H'),
+                                  ('animated_bone_rotations_count', 'H'),
+                                  ('animated_bone_locations_count', 'H'),
+                                  ('animated_bone_scales_count', 'H'),
+                                  ('unknown_0x24', 'H'),
+                                  ('padding_0x26', 'H', 0),
+
+                                  ('bone_mask_bytes', 'I'),
+                                  ('abs_ptr_bone_mask', 'I'),
+
+                                  ('rel_ptr_keyframe_chunks_ptrs', 'I'),
+                                  ('rel_ptr_keyframe_chunks_counts', 'I'),
+                                  ('rel_ptr_static_pose_bone_rotations', 'I'),
+                                  ('rel_ptr_static_pose_bone_locations', 'I'),
+                                  ('rel_ptr_static_pose_bone_scales', 'I'),
+                                  ('rel_ptr_static_unknown_4', 'I'),
+
+                                  ('padding_0x48', 'I'),
+                                  ('padding_0x4C', 'I'),
+                                  ('padding_0x50', 'I'),
+                                  ('padding_0x54', 'I'),
+                                  ('padding_0x58', 'I'),
+                                  ('padding_0x5C', 'I')])
+
 
     def __init__(self, bytestream, skelReader):
         super().__init__(bytestream)
@@ -103,82 +141,43 @@ class AnimReader(BaseRW):
         self.max_val_2 = None
 
     def read(self):
-        self.read_write(self.read_buffer, self.read_raw, self.read_ascii, self.maxval_read, "read", self.prepare_read_op, self.cleanup_ragged_chunk_read)
+        self.read_write(self.read_buffer, self.read_raw, self.read_schema, self.read_array, self.maxval_read, "read", self.prepare_read_op, self.cleanup_ragged_chunk_read)
         self.interpret_animdata()
 
     def write(self):
         self.reinterpret_animdata()
-        self.read_write(self.write_buffer, self.write_raw, self.write_ascii, self.maxval_write, "write", lambda: None, self.cleanup_ragged_chunk_write)
+        self.read_write(self.write_buffer, self.write_raw, self.write_schema, self.write_array, self.maxval_write, "write", lambda: None, self.cleanup_ragged_chunk_write)
 
-    def read_write(self, rw_operator, rw_operator_raw, rw_operator_ascii, maxval_op, rw_method_name, preparation_op, chunk_cleanup_operator):
-        self.rw_header(rw_operator, rw_operator_ascii)
+    def read_write(self, rw_operator, rw_operator_raw, rw_operator_schema, rw_operator_array, maxval_op, rw_method_name, preparation_op, chunk_cleanup_operator):
+        self.rw_header(rw_operator_schema)
         preparation_op()
         self.rw_bone_idx_lists(rw_operator, maxval_op, chunk_cleanup_operator)
         self.rw_initial_pose_bone_rotations(rw_operator_raw, chunk_cleanup_operator)
-        self.rw_initial_pose_bone_locations(rw_operator, chunk_cleanup_operator)
-        self.rw_initial_pose_bone_scales(rw_operator)
+        self.rw_initial_pose_bone_locations(rw_operator_array, chunk_cleanup_operator)
+        self.rw_initial_pose_bone_scales(rw_operator_array)
         self.rw_unknown_4(rw_operator, chunk_cleanup_operator)
         self.rw_keyframe_chunks_pointers(rw_operator)
         self.rw_keyframes_per_substructure(rw_operator, chunk_cleanup_operator)
         self.rw_blend_bones(rw_operator, chunk_cleanup_operator)
         self.rw_keyframe_chunks(rw_method_name)
 
-    def rw_header(self, rw_operator, rw_operator_ascii):
+    def rw_header(self, rw_operator_schema):
         self.assert_file_pointer_now_at(0)
-        rw_operator_ascii('filetype', 4)
-
-        rw_operator('animation_duration', 'f')
-        rw_operator('playback_rate', 'f')
-
-        rw_operator('setup_and_static_data_size', 'H')
-        rw_operator('num_bones', 'H')
-        rw_operator('total_frames', 'H')
-        rw_operator('num_keyframe_chunks', 'H')
-        rw_operator('always_16384', 'H')  # Maybe this is the precision of the quaternions?
-        self.assert_equal('always_16384', 16384)
-        assert self.always_16384 == 16384, self.always_16384
-
-        rw_operator('static_pose_bone_rotations_count', 'H')
-        rw_operator('static_pose_bone_locations_count', 'H')
-        rw_operator('static_pose_bone_scales_count', 'H')
-        rw_operator('unknown_0x1C', 'H')
-        rw_operator('animated_bone_rotations_count', 'H')
-        rw_operator('animated_bone_locations_count', 'H')
-        rw_operator('animated_bone_scales_count', 'H')
-        rw_operator('unknown_0x24', 'H')
-        rw_operator('padding_0x26', 'H')
-        self.assert_is_zero('padding_0x26')
-
-        rw_operator('bone_mask_bytes', 'I')
-        rw_operator('abs_ptr_bone_mask', 'I')
+        header_start = self.bytestream.tell()
+        rw_operator_schema(self.header_schema)
+
         if self.bone_mask_bytes != 0:
-            self.assert_equal('abs_ptr_bone_mask', self.setup_and_static_data_size)
-
-        pos = self.bytestream.tell()
-        rw_operator('rel_ptr_keyframe_chunks_ptrs', 'I')
-        self.abs_ptr_keyframe_chunks_ptrs = pos + self.rel_ptr_keyframe_chunks_ptrs
-        pos = self.bytestream.tell()
-        rw_operator('rel_ptr_keyframe_chunks_counts', 'I')
-        self.abs_ptr_keyframe_chunks_counts = pos + self.rel_ptr_keyframe_chunks_counts
-        pos = self.bytestream.tell()
-        rw_operator('rel_ptr_static_pose_bone_rotations', 'I')
-        self.abs_ptr_static_pose_bone_rotations = pos + self.rel_ptr_static_pose_bone_rotations
-        pos = self.bytestream.tell()
-        rw_operator('rel_ptr_static_pose_bone_locations', 'I')
-        self.abs_ptr_static_pose_bone_locations = pos + self.rel_ptr_static_pose_bone_locations
-        pos = self.bytestream.tell()
-        rw_operator('rel_ptr_static_pose_bone_scales', 'I')
-        self.abs_ptr_static_pose_bone_scales = pos + self.rel_ptr_static_pose_bone_scales
-        pos = self.bytestream.tell()
-        rw_operator('rel_ptr_static_unknown_4', 'I')
-        self.abs_ptr_static_unknown_4 = pos + self.rel_ptr_static_unknown_4
-
-        rw_operator('padding_0x48', 'I')
-        rw_operator('padding_0x4C', 'I')
-        rw_operator('padding_0x50', 'I')
-        rw_operator('padding_0x54', 'I')
-        rw_operator('padding_0x58', 'I')
-        rw_operator('padding_0x5C', 'I')
+            self.assert_equal('abs_ptr_bone_mask', self.setup_and_static_data_size,
+                              header_start + self.header_schema.offsets['abs_ptr_bone_mask'])
+
+        # The relative pointers are relative to their own position in the header
+        offsets = self.header_schema.offsets
+        self.abs_ptr_keyframe_chunks_ptrs = offsets['rel_ptr_keyframe_chunks_ptrs'] + self.rel_ptr_keyframe_chunks_ptrs
+        self.abs_ptr_keyframe_chunks_counts = offsets['rel_ptr_keyframe_chunks_counts'] + self.rel_ptr_keyframe_chunks_counts
+        self.abs_ptr_static_pose_bone_rotations = offsets['rel_ptr_static_pose_bone_rotations'] + self.rel_ptr_static_pose_bone_rotations
+        self.abs_ptr_static_pose_bone_locations = offsets['rel_ptr_static_pose_bone_locations'] + self.rel_ptr_static_pose_bone_locations
+        self.abs_ptr_static_pose_bone_scales = offsets['rel_ptr_static_pose_bone_scales'] + self.rel_ptr_static_pose_bone_scales
+        self.abs_ptr_static_unknown_4 = offsets['rel_ptr_static_unknown_4'] + self.rel_ptr_static_unknown_4
 
     def maxval_read(self, val, key):
         n2r = (8 - getattr(self, key)* 2 % 8) % 8
@@ -233,22 +232,22 @@ class AnimReader(BaseRW):
         rw_operator_raw('static_pose_bone_rotations', 6 * self.static_pose_bone_rotations_count)
         chunk_cleanup_operator(self.bytestream.tell(), 16)
 
-    def rw_initial_pose_bone_locations(self, rw_operator, chunk_cleanup_operator):
+    def rw_initial_pose_bone_locations(self, rw_operator_array, chunk_cleanup_operator):
         """
         # 12 bytes assigned to each bone in unknown_bone_idxs_2
         # this is a triplet of floats
         """
         self.assert_file_pointer_now_at(self.abs_ptr_static_pose_bone_locations)
-        rw_operator('static_pose_bone_locations', 'fff' * self.static_pose_bone_locations_count)
+        rw_operator_array('static_pose_bone_locations', 'f', 3 * self.static_pose_bone_locations_count, shape=(-1, 3))
         chunk_cleanup_operator(self.bytestream.tell(), 16)
 
-    def rw_initial_pose_bone_scales(self, rw_operator):
+    def rw_initial_pose_bone_scales(self, rw_operator_array):
         """
         # 12 bytes assigned to each bone in unknown_bone_idxs_3
         # this is a triplet of floats
         """
         self.assert_file_pointer_now_at(self.abs_ptr_static_pose_bone_scales)
-        rw_operator('static_pose_bone_scales', 'fff' * self.static_pose_bone_scales_count)
+        rw_operator_array('static_pose_bone_scales', 'f', 3 * self.static_pose_bone_scales_count, shape=(-1, 3))
 
     def rw_unknown_4(self, rw_operator, chunk_cleanup_operator):
         """
@@ -291,9 +290,6 @@ class AnimReader(BaseRW):
         #num_to_read = max([self.max_val_1, self.max_val_2])
         tell = self.bytestream.tell()
         if self.bone_mask_bytes != 0:
-            self.header = list(self.header)
-            self.header.insert(20, self.bytestream.tell())
-
             rw_operator('bone_masks', 'b'*(self.num_bones))
             chunk_cleanup_operator(self.bytestream.tell(), 4)
 
@@ -308,35 +304,45 @@ class AnimReader(BaseRW):
     def rw_keyframe_chunks(self, rw_method_name):
         for i, (kfchunkreader, d5, d6) in enumerate(zip(self.keyframe_chunks, self.chunk_list(self.keyframe_chunks_ptrs, 3),
                                                         self.chunk_list(self.keyframe_counts, 2))):
-            assert d5[0] == 0
+            if self.assertion_policy != 'fast' and d5[0] != 0:
+                # Each keyframe chunk pointer is 8 bytes long
+                self.report_violation(f"d5[0] == 0, value is {d5[0]}", 'keyframe_chunks_ptrs',
+                                      self.abs_ptr_keyframe_chunks_ptrs + 8*i)
             scale_factor = (self.animated_bone_rotations_count + self.animated_bone_locations_count + self.animated_bone_scales_count + self.unknown_0x24) / 8
             part5_size = int(np.ceil(scale_factor * d6[1]))
-            kfchunkreader.initialise_variables(d5[-1], part5_size, d6[1])
+            num_tracks = self.animated_bone_rotations_count + self.animated_bone_locations_count + self.animated_bone_scales_count + self.unknown_0x24
+            kfchunkreader.initialise_variables(d5[-1], part5_size, d6[1], num_tracks)
             getattr(kfchunkreader, rw_method_name)()
 
     def prepare_read_op(self):
         self.keyframe_chunks = [KeyframeChunk(self.bytestream) for _ in range(self.num_keyframe_chunks)]
 
     def interpret_animdata(self):
-        self.static_pose_bone_rotations = self.chunk_list(self.static_pose_bone_rotations, 6)
-        self.static_pose_bone_rotations = [deserialise_quaternion(elem) for elem in self.static_pose_bone_rotations]
-        self.static_pose_bone_locations = self.chunk_list(self.static_pose_bone_locations, 3)
-        self.static_pose_bone_scales = self.chunk_list(self.static_pose_bone_scales, 3)
+        self.static_pose_bone_rotations = deserialise_quaternions(np.frombuffer(self.static_pose_bone_rotations, dtype=np.uint8))
+        self.static_pose_bone_locations = self.static_pose_bone_locations.astype(np.float64)
+        self.static_pose_bone_scales = self.static_pose_bone_scales.astype(np.float64)
 
         self.keyframe_chunks_ptrs = self.chunk_list(self.keyframe_chunks_ptrs, 3)
         self.keyframe_counts = self.chunk_list(self.keyframe_counts, 2)
 
     def reinterpret_animdata(self):
-        self.static_pose_bone_rotations = [serialise_quaternion(elem) for elem in self.static_pose_bone_rotations]
-        self.static_pose_bone_rotations = b''.join(self.static_pose_bone_rotations)
-        self.static_pose_bone_locations = self.flatten_list(self.static_pose_bone_locations)
-        self.static_pose_bone_scales = self.flatten_list(self.static_pose_bone_scales)
+        self.static_pose_bone_rotations = serialise_quaternions(self.static_pose_bone_rotations).tobytes()
 
         self.keyframe_chunks_ptrs = self.flatten_list(self.keyframe_chunks_ptrs)
         self.keyframe_counts = self.flatten_list(self.keyframe_counts)
 
 
 class KeyframeChunk(BaseRW):
+    header_schema = StructSchema([('frame_0_rotations_bytecount', 'H'),
+                                  ('frame_0_locations_bytecount', 'H'),
+                                  ('frame_0_scales_bytecount', 'H'),
+                                  ('unknown_0x06', 'H'),
+
+                                  ('keyframed_rotations_bytecount', 'H'),
+                                  ('keyframed_locations_bytecount', 'H'),
+                                  ('keyframed_scales_bytecount', 'H'),
+                                  ('unknown_0x0E', 'H')])
+
     def __init__(self, bytestream):
         super().__init__(bytestream)
 
@@ -355,7 +361,7 @@ class KeyframeChunk(BaseRW):
         self.frame_0_locations = None  # Contains 12 bytes per entry, dtype fff. Count in parent header.
         self.frame_0_scales = None  # Contains 12 bytes per entry, dtype fff. Count in parent header.
         self.unknown_data_4 = None  # Contains 4 bytes per entry, dtype f(?). Count in parent header.
-        self.keyframes_in_use = None  # Bit-packed booleans stating which keyframes are in use
+        self.keyframes_in_use = None  # Bit-packed booleans stating which keyframes are in use; unpacked to a (num_tracks, nframes) bool array
         self.keyframed_rotations = None  # Contains 6 bytes per entry, dtype smallest-3 quaternion with uint15s. Count in parent header.
         self.keyframed_locations = None  # Contains 12 bytes per entry, dtype fff. Count unknown.
         self.keyframed_scales = None  # Contains 12 bytes per entry, dtype fff. Count unknown.
@@ -364,47 +370,40 @@ class KeyframeChunk(BaseRW):
         # Utility variables
         self.bytes_read = 0
 
-    def initialise_variables(self, start_pointer, part5_size, nframes):
+    def initialise_variables(self, start_pointer, part5_size, nframes, num_tracks):
         self.start_pointer = start_pointer
         # Temp variable
         self.part5_size = part5_size
         self.nframes = nframes
+        self.num_tracks = num_tracks
 
     def read(self):
-        self.read_write(self.read_buffer, self.read_raw, self.cleanup_ragged_chunk_read)
+        self.read_write(self.read_buffer, self.read_raw, self.read_array, self.read_schema, self.cleanup_ragged_chunk_read)
         self.interpret_keyframe_chunk()
 
     def write(self):
         self.reinterpret_keyframe_chunk()
-        self.read_write(self.write_buffer, self.write_raw, self.cleanup_ragged_chunk_write)
+        self.read_write(self.write_buffer, self.write_raw, self.write_array, self.write_schema, self.cleanup_ragged_chunk_write)
 
-    def read_write(self, rw_operator, rw_operator_raw, cleanup_chunk_operator):
-        self.rw_header(rw_operator)
+    def read_write(self, rw_operator, rw_operator_raw, rw_operator_array, rw_operator_schema, cleanup_chunk_operator):
+        self.rw_header(rw_operator_schema)
         self.rw_frame_0_rotations(rw_operator_raw)
-        self.rw_frame_0_locations(rw_operator)
-        self.rw_frame_0_scales(rw_operator, cleanup_chunk_operator)
+        self.rw_frame_0_locations(rw_operator_array)
+        self.rw_frame_0_scales(rw_operator_array, cleanup_chunk_operator)
         self.rw_part_4(rw_operator)
 
         self.rw_keyframes_in_use(rw_operator_raw)
 
         self.rw_keyframed_rotations(rw_operator_raw)
-        self.rw_keyframed_locations(rw_operator)
-        self.rw_keyframed_scales(rw_operator, cleanup_chunk_operator)
+        self.rw_keyframed_locations(rw_operator_array)
+        self.rw_keyframed_scales(rw_operator_array, cleanup_chunk_operator)
         self.rw_part_9(rw_operator)
 
         cleanup_chunk_operator(self.bytestream.tell(), 16)
 
-    def rw_header(self, rw_operator):
+    def rw_header(self, rw_operator_schema):
         self.assert_file_pointer_now_at(self.start_pointer)
-        rw_operator('frame_0_rotations_bytecount', 'H')
-        rw_operator('frame_0_locations_bytecount', 'H')
-        rw_operator('frame_0_scales_bytecount', 'H')
-        rw_operator('unknown_0x06', 'H')
-
-        rw_operator('keyframed_rotations_bytecount', 'H')
-        rw_operator('keyframed_locations_bytecount', 'H')
-        rw_operator('keyframed_scales_bytecount', 'H')
-        rw_operator('unknown_0x0E', 'H')
+        rw_operator_schema(self.header_schema)
 
         self.bytes_read += 16
 
@@ -413,13 +412,13 @@ class KeyframeChunk(BaseRW):
 
         self.bytes_read += self.frame_0_rotations_bytecount
 
-    def rw_frame_0_locations(self, rw_operator):
-        rw_operator('frame_0_locations', 'fff'*(self.frame_0_locations_bytecount // 12))
+    def rw_frame_0_locations(self, rw_operator_array):
+        rw_operator_array('frame_0_locations', 'f', 3 * (self.frame_0_locations_bytecount // 12), shape=(-1, 3))
 
         self.bytes_read += self.frame_0_locations_bytecount
 
-    def rw_frame_0_scales(self, rw_operator, cleanup_chunk_operator):
-        rw_operator('frame_0_scales', 'fff'*(self.frame_0_scales_bytecount // 12))
+    def rw_frame_0_scales(self, rw_operator_array, cleanup_chunk_operator):
+        rw_operator_array('frame_0_scales', 'f', 3 * (self.frame_0_scales_bytecount // 12), shape=(-1, 3))
         if self.frame_0_scales_bytecount != 0:
             cleanup_chunk_operator(self.bytes_read, 4)
 
@@ -443,13 +442,13 @@ class KeyframeChunk(BaseRW):
 
         self.bytes_read += self.keyframed_rotations_bytecount
 
-    def rw_keyframed_locations(self, rw_operator):
-        rw_operator('keyframed_locations', 'fff' * (self.keyframed_locations_bytecount // 12))
+    def rw_keyframed_locations(self, rw_operator_array):
+        rw_operator_array('keyframed_locations', 'f', 3 * (self.keyframed_locations_bytecount // 12), shape=(-1, 3))
 
         self.bytes_read += self.keyframed_locations_bytecount
 
-    def rw_keyframed_scales(self, rw_operator, cleanup_chunk_operator):
-        rw_operator('keyframed_scales', 'fff' * (self.keyframed_scales_bytecount // 12))
+    def rw_keyframed_scales(self, rw_operator_array, cleanup_chunk_operator):
+        rw_operator_array('keyframed_scales', 'f', 3 * (self.keyframed_scales_bytecount // 12), shape=(-1, 3))
         if self.keyframed_scales_bytecount != 0:
             cleanup_chunk_operator(self.bytes_read, 4)
 
@@ -463,113 +462,98 @@ class KeyframeChunk(BaseRW):
     def interpret_keyframe_chunk(self):
         self.keyframes_in_use: bytes
 
-        self.frame_0_rotations = self.chunk_list(self.frame_0_rotations, 6)
-        self.frame_0_rotations = [deserialise_quaternion(elem) for elem in self.frame_0_rotations]
-        self.frame_0_locations = self.chunk_list(self.frame_0_locations, 3)
-        self.frame_0_scales = self.chunk_list(self.frame_0_scales, 3)
+        self.frame_0_rotations = deserialise_quaternions(np.frombuffer(self.frame_0_rotations, dtype=np.uint8))
+        self.frame_0_locations = self.frame_0_locations.astype(np.float64)
+        self.frame_0_scales = self.frame_0_scales.astype(np.float64)
 
-        if len(self.keyframes_in_use):
-            self.keyframes_in_use = bytes_to_bits(self.keyframes_in_use)
-            # Chop off padding bits
-            self.keyframes_in_use = self.keyframes_in_use[:self.nframes * (len(self.keyframes_in_use) // self.nframes)]
-        else:
-            self.keyframes_in_use = ''
+        # One row of bits per animated track, in the order rotations->locations->scales->unknown_4
+        # Chop off padding bits
+        keyframes_in_use = np.unpackbits(np.frombuffer(self.keyframes_in_use, dtype=np.uint8))
+        keyframes_in_use = keyframes_in_use[:self.num_tracks * self.nframes].astype(bool)
+        self.keyframes_in_use = keyframes_in_use.reshape((self.num_tracks, self.nframes))
 
-        self.keyframed_rotations = self.chunk_list(self.keyframed_rotations, 6)
-        self.keyframed_rotations = [deserialise_quaternion(elem) for elem in self.keyframed_rotations]
-        self.keyframed_locations = self.chunk_list(self.keyframed_locations, 3)
-        self.keyframed_scales = self.chunk_list(self.keyframed_scales, 3)
+        self.keyframed_rotations = deserialise_quaternions(np.frombuffer(self.keyframed_rotations, dtype=np.uint8))
+        self.keyframed_locations = self.keyframed_locations.astype(np.float64)
+        self.keyframed_scales = self.keyframed_scales.astype(np.float64)
 
     def reinterpret_keyframe_chunk(self):
-        self.keyframes_in_use: str
-
-        self.frame_0_rotations = [serialise_quaternion(elem) for elem in self.frame_0_rotations]
-        self.frame_0_rotations = b''.join(self.frame_0_rotations)
-        self.frame_0_locations = self.flatten_list(self.frame_0_locations)
-        self.frame_0_scales = self.flatten_list(self.frame_0_scales)
-
-        if len(self.keyframes_in_use):
-            # Add back padding bits
-            self.keyframes_in_use += '0' * ((8 - len(self.keyframes_in_use) % 8) % 8)
-            self.keyframes_in_use = bits_to_bytes(self.keyframes_in_use)
-        else:
-            self.keyframes_in_use = b''
+        self.keyframes_in_use: np.ndarray
 
-        self.keyframed_rotations = [serialise_quaternion(elem) for elem in self.keyframed_rotations]
-        self.keyframed_rotations = b''.join(self.keyframed_rotations)
-        self.keyframed_locations = self.flatten_list(self.keyframed_locations)
-        self.keyframed_scales = self.flatten_list(self.keyframed_scales)
+        self.frame_0_rotations = serialise_quaternions(self.frame_0_rotations).tobytes()
 
+        # Padding bits are added back by packbits
+        self.keyframes_in_use = np.packbits(np.asarray(self.keyframes_in_use, dtype=bool).ravel()).tobytes()
 
-def chunks(lst, n):
-    """Yield successive n-sized chunks from lst."""
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
+        self.keyframed_rotations = serialise_quaternions(self.keyframed_rotations).tobytes()
 
 
-def bytes_to_bits(bytelist):
-    return ("{:0" + str(len(bytelist) * 8) + "b}").format(int(bytelist.hex(), 16))
+# For each largest index, the indices of the three components stored explicitly in XYZW ordering
+smallest_three_indices = np.array([[1, 2, 3],
+                                   [0, 2, 3],
+                                   [0, 1, 3],
+                                   [0, 1, 2]])
 
 
-def bits_to_bytes(bitstring):
-    return b''.join([struct.pack('B', (int(elem, 2))) for elem in chunks(bitstring, 8)])
+def deserialise_quaternions(dscs_rotations):
+    """
+    Decodes an (N, 6) array of bytes into an (N, 4) array of quaternions in WXYZ ordering.
 
+    Each rotation is a big-endian 48-bit integer: one unused bit, three uint15s holding the three smallest components
+    of the quaternion in XYZW ordering, and a uint2 giving the index of the largest component, which is rebuilt from
+    the unit-norm condition.
+    """
+    dscs_rotations = np.asarray(dscs_rotations, dtype=np.uint8).reshape((-1, 6))
+    packed_rotations = np.zeros(len(dscs_rotations), dtype=np.int64)
+    for byte_idx in range(6):
+        packed_rotations = (packed_rotations << 8) | dscs_rotations[:, byte_idx]
 
-def deserialise_quaternion(dscs_rotation):
-    bit_representation = bytes_to_bits(dscs_rotation)
-    largest_index = struct.unpack('B', bits_to_bytes('000000' + bit_representation[46:48]))
-    component_bits = bit_representation[1:46]
-    component_bits = ''.join(['0'+component_bits[15*i:15*(i+1)] for i in range(3)])
-    components = np.array(struct.unpack('>HHH', bits_to_bytes(component_bits)))
+    largest_indices = packed_rotations & 0b11
+    components = np.stack([(packed_rotations >> 32) & 0x7FFF,
+                           (packed_rotations >> 17) & 0x7FFF,
+                           (packed_rotations >> 2) & 0x7FFF], axis=1)
 
     components -= 16383
     components = components/16384
     components *= 1/np.sqrt(2)
 
-    square_vector_length = np.sum(components**2)
-    largest_component = np.sqrt(1 - square_vector_length)
+    square_vector_length = components[:, 0]**2 + components[:, 1]**2 + components[:, 2]**2
+    largest_components = np.sqrt(1 - square_vector_length)
 
     # This is in the XYZW ordering
-    components = np.insert(components, largest_index, largest_component)
+    rows = np.arange(len(components))
+    quaternions = np.zeros((len(components), 4))
+    quaternions[rows.reshape((-1, 1)), smallest_three_indices[largest_indices]] = components
+    quaternions[rows, largest_indices] = largest_components
 
     # Now it's in the WXYZ ordering
-    quaternion = np.roll(components, 1)
+    return np.roll(quaternions, 1, axis=1)
 
-    return quaternion
 
-
-def serialise_quaternion(quat):
+def serialise_quaternions(quats):
+    """
+    Encodes an (N, 4) array of quaternions in WXYZ ordering into an (N, 6) array of bytes; the inverse of
+    deserialise_quaternions.
+    """
     # Start from WXYZ ordering, put it into XYZW
-    components = np.roll(quat, -1)
-    largest_component = np.amax(components)
-    largest_index = np.where(components == largest_component)[0][0]
-    largest_component_sign = np.sign(largest_component)
+    components = np.roll(np.asarray(quats).reshape((-1, 4)), -1, axis=1)
+    rows = np.arange(len(components))
+    largest_indices = np.argmax(components, axis=1)
+    largest_component_signs = np.sign(components[rows, largest_indices])
 
     # Get rid of the largest component
     # No need to store the sign of the largest component, because
     # (W, X, Y, Z) = (-W, -X, -Y, -Z)
     # So just multiply through by the sign of the removed component to create an equivalent quaternion
     # In this way, the largest component is always +ve
-    components = largest_component_sign*np.delete(components, largest_index)
+    components = largest_component_signs.reshape((-1, 1)) * components[rows.reshape((-1, 1)), smallest_three_indices[largest_indices]]
     # Map the remaining components from the interval [-1/sqrt(2), 1/sqrt(2)] to [0, 32767]
     components *= np.sqrt(2)
     components *= 16384
-    components = np.around(components).astype(np.int)
+    components = np.around(components).astype(np.int64)
     components += 16383
-    for i, elem in enumerate(components):
-        if elem < 0:
-            components[i] = 0
-        elif elem > 32767:
-            components[i] = 32767
-
-    # Now convert to big-endian uint15s
-    component_bits = bytes_to_bits(struct.pack('>HHH', *components))
-    component_bits = ''.join([component_bits[16*i + 1:16*(i+1)] for i in range(3)])
-
-    # Store the largest index as a uint2
-    largest_index_bits = bytes_to_bits(struct.pack('B', largest_index))[6:]
-
-    # Put everything together
-    component_bits = '0' + component_bits + largest_index_bits
+    components = np.clip(components, 0, 32767)
 
-    return bits_to_bytes(component_bits)
+    # Pack the components as uint15s and the largest index as a uint2 into a big-endian 48-bit integer
+    packed_rotations = (components[:, 0] << 32) | (components[:, 1] << 17) | (components[:, 2] << 2) | largest_indices
+    byte_shifts = np.arange(40, -8, -8)
+    return ((packed_rotations.reshape((-1, 1)) >> byte_shifts) & 0xFF).astype(np.uint8)
@@ -1,15 +1,327 @@
-import struct
+import contextlib
 import io
+import mmap
+import operator
+import os
+import secrets
+import stat
+import struct
+import numpy as np
 
 
 class ViolatedAssumptionError(Exception):
-    pass
+    def __init__(self, message, varname=None, offset=None):
+        super().__init__(message)
+        self.varname = varname
+        self.offset = offset
+
+
+assertion_policies = ('strict', 'collect', 'fast')
+
+
+@contextlib.contextmanager
+def assertion_policy(policy):
+    """
+    Sets how every reader handles the checks on the values in a file for the duration of the with-block:
+
+    'strict' -- raise a ViolatedAssumptionError for the first check that fails. This is the default.
+    'collect' -- carry on after failed checks, and append a ViolatedAssumptionError for each of them to the yielded list.
+    'fast' -- skip the checks entirely.
+
+    Checks that the file pointer is where the file says a section starts are structural, since nothing after a mismatch
+    can be parsed correctly, so they raise under every policy.
+    """
+    assert policy in assertion_policies, f"Assertion policy must be one of {assertion_policies}, not '{policy}'."
+    previous_policy = BaseRW.assertion_policy, BaseRW.violations
+    BaseRW.assertion_policy = policy
+    BaseRW.violations = []
+    try:
+        yield BaseRW.violations
+    finally:
+        BaseRW.assertion_policy, BaseRW.violations = previous_policy
+
+
+class FieldTrace:
+    """
+    A record of where each field read or written by the readers lies in the bytestream, as a list of
+    (offset, length, field, dtype) tuples. The field is named '<reader class>.<variable>', and pad bytes are named
+    '<reader class>.padding'. Only the layout of the fields is kept, not their values.
+    """
+    def __init__(self):
+        self.fields = []
+
+    def record(self, offset, length, field, dtype):
+        self.fields.append((offset, length, field, dtype))
+
+    def byte_map(self, file_size=None):
+        """
+        Returns the traced fields in order of offset, with entries of (offset, length, None, None) for the bytes between
+        them that no field covers, up to 'file_size' if it is given.
+        """
+        byte_map = []
+        position = 0
+        for offset, length, field, dtype in sorted(self.fields):
+            if offset > position:
+                byte_map.append((position, offset - position, None, None))
+            byte_map.append((offset, length, field, dtype))
+            position = max(position, offset + length)
+        if file_size is not None and file_size > position:
+            byte_map.append((position, file_size - position, None, None))
+        return byte_map
+
+    def write_byte_map(self, path, file_size=None):
+        """
+        Writes the byte map as tab-separated lines of hexadecimal offset, length, field, and dtype.
+        """
+        with open(path, 'w') as F:
+            for offset, length, field, dtype in self.byte_map(file_size):
+                F.write(f"0x{offset:08X}\t{length}\t{'<unparsed>' if field is None else field}\t{dtype or ''}\n")
+
+
+@contextlib.contextmanager
+def trace_fields():
+    """
+    Records the layout of every field that any reader reads or writes during the with-block into the yielded
+    FieldTrace. Tracing is off otherwise. Offsets are positions in each reader's own bytestream, so trace one file per
+    with-block.
+    """
+    previous_trace = BaseRW.field_trace
+    BaseRW.field_trace = FieldTrace()
+    try:
+        yield BaseRW.field_trace
+    finally:
+        BaseRW.field_trace = previous_trace
+
+
+class BufferStream:
+    """
+    A bytestream over a bytes, bytearray, memoryview, or mmap object, with the same read/write/tell/seek interface as a
+    file. The position in the buffer is an integer cursor, and reads return memoryview slices of the buffer rather than
+    copies of it. Writing requires a writable buffer, such as one made by allocate(), and writes in place.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer).cast('B')
+        self.position = 0
+
+    def read(self, num_bytes=-1):
+        if num_bytes is None or num_bytes < 0:
+            val = self.buffer[self.position:]
+        else:
+            val = self.buffer[self.position:self.position + num_bytes]
+        self.position += len(val)
+        return val
+
+    def unpack(self, fmt, num_bytes):
+        """
+        Unpacks the next 'num_bytes' bytes of the buffer with struct, without slicing them out of the buffer first.
+        """
+        val = struct.unpack_from(fmt, self.buffer, self.position)
+        self.position += num_bytes
+        return val
+
+    def unpack_struct(self, compiled_struct):
+        """
+        Unpacks the next compiled_struct.size bytes of the buffer with a precompiled struct.Struct.
+        """
+        val = compiled_struct.unpack_from(self.buffer, self.position)
+        self.position += compiled_struct.size
+        return val
+
+    def allocate(self, num_bytes):
+        """
+        Replaces the buffer with a zero-filled, writable buffer of 'num_bytes' bytes and moves to its start.
+        """
+        self.buffer = memoryview(bytearray(num_bytes))
+        self.position = 0
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        end = self.position + len(data)
+        assert end <= len(self.buffer), \
+            f"Writing {len(data)} bytes at position {self.position} overruns the {len(self.buffer)}-byte buffer."
+        self.buffer[self.position:end] = data
+        self.position = end
+
+    def pack(self, fmt, values):
+        """
+        Packs 'values' with struct directly into the buffer at the current position.
+        """
+        struct.pack_into(fmt, self.buffer, self.position, *values)
+        self.position += struct.calcsize(fmt)
+
+    def pack_struct(self, compiled_struct, values):
+        """
+        Packs 'values' with a precompiled struct.Struct directly into the buffer at the current position.
+        """
+        compiled_struct.pack_into(self.buffer, self.position, *values)
+        self.position += compiled_struct.size
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        bases = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.buffer)}
+        self.position = bases[whence] + offset
+        assert self.position >= 0, f"Cannot seek to negative position {self.position}."
+        return self.position
+
+    def release(self):
+        """
+        Lets go of the underlying buffer. Slices returned by read() keep the buffer alive until they are deleted.
+        """
+        self.buffer.release()
+
+
+@contextlib.contextmanager
+def map_file(path):
+    """
+    Maps the whole of a file into memory and yields a BufferStream over it, so that a reader can parse the file without
+    a read() call through the file object for every field.
+
+    The stream is released at the end of the with-block, so anything read from it that is needed afterwards must be
+    copied or interpreted before then.
+    """
+    with open(path, 'rb') as F:
+        # Empty files cannot be mapped
+        mapped_file = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(F.fileno()).st_size else None
+    stream = BufferStream(b'' if mapped_file is None else mapped_file)
+    try:
+        yield stream
+    finally:
+        stream.release()
+        if mapped_file is not None:
+            try:
+                mapped_file.close()
+            except BufferError:
+                # A slice of the file is still in use; the mapping is closed when it is garbage collected instead
+                pass
+
+
+@contextlib.contextmanager
+def buffer_file_write(path, atomic=False):
+    """
+    Yields a BufferStream for readers to write a whole file into. Once the layout of the file is known, the caller must
+    allocate() its full size; the readers then fill that single buffer in place, and at the end of the with-block the
+    buffer is checked to be exactly full and written to 'path' in one call. Nothing is written if the block raises.
+
+    With atomic=True, the buffer is written to a temporary file next to 'path', which then replaces 'path', so that the
+    file at 'path' is never left partially written.
+    """
+    stream = BufferStream(b'')
+    yield stream
+
+    assert stream.tell() == len(stream.buffer), \
+        f"Only {stream.tell()} bytes of the {len(stream.buffer)}-byte buffer were written."
+    if atomic:
+        directory, filename = os.path.split(os.path.abspath(path))
+        # Unlike mkstemp, which creates the file as owner-only, os.open lets the OS apply the umask to a new file
+        temp_path = os.path.join(directory, f".{filename}.{secrets.token_hex(8)}.tmp")
+        handle = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            with os.fdopen(handle, 'wb') as F:
+                F.write(stream.buffer)
+            if os.path.exists(path):
+                os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    else:
+        with open(path, 'wb') as F:
+            F.write(stream.buffer)
+
+
+class StructSchema:
+    """
+    Declares a fixed-layout section of a bytestream once, so that the whole section can be read or written with a single
+    precompiled struct.Struct rather than one unpack call per field.
+
+    Each field is a tuple of (variable, dtype) or (variable, dtype, expected value). The dtype is a string of the
+    characters in BaseRW.type_buffers; as with read_buffer, a field of one character is read as a single value and a
+    field of several characters as a tuple. A dtype such as '4s' is read as an ascii string. Fields with an expected
+    value are checked with assert_equal once the whole section has been read or written.
+    """
+
+    def __init__(self, fields):
+        # Each field is unpacked from values[value_index], which is a slice for fields read as tuples
+        self.fields = []
+        self.ascii_variables = []
+        self.expected_values = []
+        self.offsets = {}
+        self.dtypes = {}
+
+        offset = 0
+        num_values = 0
+        for variable, dtype, *expected_value in fields:
+            is_ascii = dtype.endswith('s')
+            field_num_values = 1 if is_ascii else len(dtype)
+            is_scalar = field_num_values == 1
+            value_index = num_values if is_scalar else slice(num_values, num_values + field_num_values)
+            self.fields.append((variable, value_index, is_scalar))
+            if is_ascii:
+                self.ascii_variables.append(variable)
+            if len(expected_value):
+                self.expected_values.append((variable, expected_value[0]))
+            self.offsets[variable] = offset
+            self.dtypes[variable] = dtype
+
+            offset += struct.calcsize('<' + dtype)
+            num_values += field_num_values
+
+        self.size = offset
+        self.format = ''.join(dtype for _, dtype, *_ in fields)
+        self.compiled_structs = {}
+
+        # Fetches all of the variables with expected values in one call, for checking them together
+        expected_variables = [variable for variable, _ in self.expected_values]
+        self.get_expected_variables = operator.attrgetter(*expected_variables) if len(expected_variables) else None
+        expected_variables_values = tuple(value for _, value in self.expected_values)
+        self.expected_variables_value = expected_variables_values[0] if len(expected_variables) == 1 else \
+            expected_variables_values
+
+    def get_struct(self, endianness):
+        if endianness not in self.compiled_structs:
+            self.compiled_structs[endianness] = struct.Struct(endianness + self.format)
+        return self.compiled_structs[endianness]
+
+    def values_to_fields(self, values):
+        """
+        Groups the flat tuple of values unpacked by the struct into a {variable: value} dictionary.
+        """
+        fields = {variable: values[value_index] for variable, value_index, _ in self.fields}
+        for variable in self.ascii_variables:
+            fields[variable] = fields[variable].decode('ascii')
+        return fields
+
+    def fields_to_values(self, rw_object):
+        """
+        Flattens the variables of rw_object into the list of values packed by the struct.
+        """
+        values = []
+        for variable, _, is_scalar in self.fields:
+            val = getattr(rw_object, variable)
+            if variable in self.ascii_variables:
+                values.append(val.encode('ascii'))
+            elif is_scalar:
+                values.append(val)
+            else:
+                values.extend(val)
+        return values
+
+    def has_expected_values(self, rw_object):
+        return self.get_expected_variables is None or \
+            self.get_expected_variables(rw_object) == self.expected_variables_value
 
 
 class BaseRW:
     """
     This is a base class for bytestream parsing, intended to be able to read/write (RW) these bytestreams to/from files.
     """
+    # Shared by every reader; see assertion_policy() and trace_fields()
+    assertion_policy = 'strict'
+    violations = []
+    field_trace = None
 
     def __init__(self, io_object=None):
         """
@@ -20,7 +332,6 @@ class BaseRW:
         self.bytestream = None
         self.subreaders = []
         self.set_file_rw(io_object)
-        self.header = []
         self.endianness = '<'
 
         self.pad_byte = b'\x00'
@@ -45,9 +356,12 @@ class BaseRW:
         }
 
     def set_file_rw(self, io_object):
-        assert (type(io_object) == io.BufferedReader) or (type(io_object) == io.BufferedWriter), \
-            f"Read-write object was instantiated with a {type(io_object)}, not a {io.BufferedReader} or " \
-            f"{io.BufferedWriter}. Ensure you are instantiating this object with a file opened in 'rb' or 'wb' mode."
+        if isinstance(io_object, (bytes, bytearray, memoryview, mmap.mmap)):
+            io_object = BufferStream(io_object)
+        assert type(io_object) in (io.BufferedReader, io.BufferedWriter, BufferStream), \
+            f"Read-write object was instantiated with a {type(io_object)}, not a {io.BufferedReader}, " \
+            f"{io.BufferedWriter}, or an in-memory buffer. Ensure you are instantiating this object with a file " \
+            f"opened in 'rb' or 'wb' mode, or with the bytes to read."
         self.bytestream = io_object
         for lst in self.subreaders:
             for subreader in lst:
@@ -65,8 +379,7 @@ class BaseRW:
         required to store them, then reads this number of bytes from the bytestream and interprets them as those
         data.
 
-        Returns a single value if a single-element dtype is specified, else returns a tuple. Also appends the result to
-        the BaseRW 'header' for easy printing of all unpacked variables.
+        Returns a single value if a single-element dtype is specified, else returns a tuple.
 
         Arguments
         ------
@@ -82,27 +395,73 @@ class BaseRW:
             endianness = self.endianness
 
         buf = sum([self.type_buffers[dt] for dt in dtype])
-        result = struct.unpack(endianness + dtype, self.bytestream.read(buf))
+        if type(self.bytestream) is BufferStream:
+            result = self.bytestream.unpack(endianness + dtype, buf)
+        else:
+            result = struct.unpack(endianness + dtype, self.bytestream.read(buf))
 
         if len(result) == 1 and not force_1d:
             result = result[0]
 
-        self.header.append(result)
         return result
 
     def read_buffer(self, variable, dtype, endianness=None, force_1d=False):
         val = self.unpack(dtype, endianness, force_1d)
         setattr(self, variable, val)
+        if self.field_trace is not None:
+            self.trace_field(variable, (self.endianness if endianness is None else endianness) + dtype)
+
+    def read_schema(self, schema):
+        """
+        Reads the whole section described by the StructSchema 'schema' in a single unpack call, sets each of its fields
+        as a variable, and then checks the fields that have an expected value.
+        """
+        compiled_struct = schema.get_struct(self.endianness)
+        if type(self.bytestream) is BufferStream:
+            values = self.bytestream.unpack_struct(compiled_struct)
+        else:
+            values = compiled_struct.unpack(self.bytestream.read(compiled_struct.size))
+
+        vars(self).update(schema.values_to_fields(values))
+        self.trace_schema(schema)
+        self.assert_schema_values(schema, self.bytestream.tell() - schema.size)
 
     def read_ascii(self, variable, num_bytes=None):
         bytes_to_read = [] if num_bytes is None else [num_bytes]
-        val = self.bytestream.read(*bytes_to_read).decode('ascii')
+        val = bytes(self.bytestream.read(*bytes_to_read)).decode('ascii')
         setattr(self, variable, val)
+        self.trace_field(variable, 'ascii', len(val))
 
     def read_raw(self, variable, num_bytes=None):
         bytes_to_read = [] if num_bytes is None else [num_bytes]
         val = self.bytestream.read(*bytes_to_read)
         setattr(self, variable, val)
+        self.trace_field(variable, 'raw', len(val))
+
+    def read_array(self, variable, dtype, count, shape=None, endianness=None):
+        """
+        Reads 'count' elements of the NumPy data type 'dtype' from the bytestream directly into an array, without
+        building a format string or a tuple of Python objects. The array is converted to native endianness.
+
+        Arguments
+        ------
+        variable -- the name of the attribute to store the array in.
+        dtype -- anything accepted by numpy.dtype, e.g. 'H', 'f', or np.float32.
+        count -- the number of elements of 'dtype' to read.
+        shape -- if given, the array is reshaped to this shape (default: a 1D array).
+        endianness -- the data type endianness (default: self.endianness).
+        """
+        if endianness is None:
+            endianness = self.endianness
+        dtype = np.dtype(dtype).newbyteorder(endianness)
+
+        data = self.bytestream.read(count * dtype.itemsize)
+        val = np.frombuffer(data, dtype=dtype, count=count).astype(dtype.newbyteorder('='))
+        if shape is not None:
+            val = val.reshape(shape)
+
+        setattr(self, variable, val)
+        self.trace_field(variable, dtype.str, len(data))
 
     def pack(self, value, dtype, endianness=None):
         if endianness is None:
@@ -114,20 +473,76 @@ class BaseRW:
         # If it's not a tuple/list/, turn it into a tuple
         if not (hasattr(val, '__len__') and not isinstance(val, str)):
             val = (val,)
-        to_write = self.pack(val, dtype, endianness)
-        self.bytestream.write(to_write)
+        if type(self.bytestream) is BufferStream:
+            self.bytestream.pack((self.endianness if endianness is None else endianness) + dtype, val)
+        else:
+            to_write = self.pack(val, dtype, endianness)
+            self.bytestream.write(to_write)
+        if self.field_trace is not None:
+            self.trace_field(variable, (self.endianness if endianness is None else endianness) + dtype)
+
+    def write_array(self, variable, dtype, count, shape=None, endianness=None):
+        """
+        Writes the array-like attribute 'variable' to the bytestream as 'count' elements of the NumPy data type 'dtype'.
+        The array is flattened, so 'shape' is only accepted for symmetry with read_array.
+        """
+        if endianness is None:
+            endianness = self.endianness
+        dtype = np.dtype(dtype).newbyteorder(endianness)
+
+        val = np.asarray(getattr(self, variable)).reshape(-1)
+        assert len(val) == count, f"Array to write has {len(val)} elements, not {count}."
+        if np.issubdtype(dtype, np.integer) and len(val):
+            dtype_info = np.iinfo(dtype)
+            assert np.all((val >= dtype_info.min) & (val <= dtype_info.max)), \
+                f"{variable} data does not fit in {dtype}."
+        self.bytestream.write(val.astype(dtype))
+        self.trace_field(variable, dtype.str, count * dtype.itemsize)
+
+    def write_schema(self, schema):
+        self.assert_schema_values(schema, self.bytestream.tell())
+        compiled_struct = schema.get_struct(self.endianness)
+        if type(self.bytestream) is BufferStream:
+            self.bytestream.pack_struct(compiled_struct, schema.fields_to_values(self))
+        else:
+            self.bytestream.write(compiled_struct.pack(*schema.fields_to_values(self)))
+        self.trace_schema(schema)
 
     def write_ascii(self, variable, num_bytes=None):
         val = getattr(self, variable)
         if num_bytes is not None:
             assert len(val) == num_bytes, f"String to write [{val}] is not equal to the number of bytes [{num_bytes}]."
         self.bytestream.write(val.encode('ascii'))
+        self.trace_field(variable, 'ascii', len(val))
 
     def write_raw(self, variable, num_bytes=None):
         val = getattr(self, variable)
         if num_bytes is not None:
             assert len(val) == num_bytes, "String to write is not equal to the number of bytes."
         self.bytestream.write(val)
+        self.trace_field(variable, 'raw', len(val))
+
+    def trace_field(self, variable, dtype, num_bytes=None):
+        """
+        Records the 'num_bytes' bytes just read or written for 'variable' in the field trace, if tracing is on.
+        'num_bytes' defaults to the size of 'dtype' as a struct format.
+        """
+        if self.field_trace is not None:
+            if num_bytes is None:
+                num_bytes = struct.calcsize(dtype)
+            self.field_trace.record(self.bytestream.tell() - num_bytes, num_bytes, f"{type(self).__name__}.{variable}",
+                                    dtype)
+
+    def trace_schema(self, schema):
+        """
+        Records each field of the StructSchema 'schema' just read or written in the field trace, if tracing is on.
+        """
+        if self.field_trace is not None:
+            schema_start = self.bytestream.tell() - schema.size
+            for variable, offset in schema.offsets.items():
+                dtype = schema.dtypes[variable]
+                self.field_trace.record(schema_start + offset, struct.calcsize(self.endianness + dtype),
+                                        f"{type(self).__name__}.{variable}", self.endianness + dtype)
 
     def decode_data_as(self, buf, data, endianness=None):
         """
@@ -176,9 +591,12 @@ class BaseRW:
         bytes_read_from_final_chunk = position % chunksize
         # The modulo maps {bytes_read_from_final_chunk == 0} to {0} rather than {chunksize}
         num_bytes_left_to_read = (chunksize - bytes_read_from_final_chunk) % chunksize
+        padding_start = self.bytestream.tell()
         should_be_value_bytes = self.bytestream.read(num_bytes_left_to_read)
-        assert should_be_value_bytes == bytevalue * (num_bytes_left_to_read // stepsize),\
-            f"Assumed padding data was not {bytevalue * (num_bytes_left_to_read // stepsize)}: {should_be_value_bytes}"
+        self.trace_field('padding', 'pad', len(should_be_value_bytes))
+        if self.assertion_policy != 'fast' and should_be_value_bytes != bytevalue * (num_bytes_left_to_read // stepsize):
+            self.report_violation(f"Assumed padding data was not {bytevalue * (num_bytes_left_to_read // stepsize)}: "
+                                  f"{bytes(should_be_value_bytes)}", offset=padding_start)
 
     def cleanup_ragged_chunk_write(self, position, chunksize, stepsize=1, bytevalue=b'\x00'):
         """
@@ -188,6 +606,7 @@ class BaseRW:
         # The modulo maps {bytes_read_from_final_chunk == 0} to {0} rather than {chunksize}
         num_bytes_left_to_read = (chunksize - bytes_read_from_final_chunk) % chunksize
         self.bytestream.write(bytevalue * (num_bytes_left_to_read // stepsize))
+        self.trace_field('padding', 'pad', len(bytevalue) * (num_bytes_left_to_read // stepsize))
 
     def chunk_list(self, lst, chunksize):
         """
@@ -222,16 +641,18 @@ class BaseRW:
         raise NotImplementedError
 
     # Stream validation functions
-    # Should add a context arg to these
     def assert_file_pointer_now_at(self, location):
-        self.check_assertion_now(lambda location: self.bytestream.tell() == location,
-                                 lambda location: f"File pointer at {self.bytestream.tell()}, not at {location}.",
-                                 location)
-
-    def assert_equal(self, varname, value):
-        self.make_assertion(lambda varname, value: getattr(self, varname) == value,
-                            lambda varname, value: f"{varname} == {value}, value is {getattr(self, varname)}",
-                            varname, value)
+        position = self.bytestream.tell()
+        if position != location:
+            raise ViolatedAssumptionError(f"Violation of data structure assumption "
+                                          f"'File pointer at {position}, not at {location}.'", offset=position)
+
+    def assert_equal(self, varname, value, offset=None):
+        if self.assertion_policy == 'fast':
+            return
+        actual_value = getattr(self, varname)
+        if not actual_value == value:
+            self.report_violation(f"{varname} == {value}, value is {actual_value}", varname, offset)
 
     def assert_is_zero(self, varname):
         self.assert_equal(varname, 0)
@@ -240,10 +661,22 @@ class BaseRW:
         for value in values:
             self.assert_equal(varname, value)
 
-    def make_assertion(self, check, message, *args):
-        # self.assumptions_CT.append((check, message, args))
-        self.check_assertion_now(check, message, *args)
+    def assert_schema_values(self, schema, schema_start):
+        # Check all of the expected values at once, and only go through them one by one to report a violation
+        if self.assertion_policy == 'fast' or schema.has_expected_values(self):
+            return
+        for varname, value in schema.expected_values:
+            self.assert_equal(varname, value, schema_start + schema.offsets[varname])
 
-    def check_assertion_now(self, check, message, *args):
-        if not check(*args):
-            raise ViolatedAssumptionError(f"Violation of data structure assumption '{message(*args)}'.")
+    def report_violation(self, message, varname=None, offset=None):
+        """
+        Raises or collects a ViolatedAssumptionError for a failed check, depending on the assertion policy. 'offset' is
+        the position of the checked data in the bytestream, and defaults to the current position.
+        """
+        if offset is None and self.bytestream is not None:
+            offset = self.bytestream.tell()
+        error = ViolatedAssumptionError(f"Violation of data structure assumption '{message}'.", varname, offset)
+        if self.assertion_policy == 'collect':
+            self.violations.append(error)
+        else:
+            raise error
@@ -70,6 +70,7 @@ class MaterialReader(BaseRW):
                         142: 'UnknownTextureSlot3',  # 0   # Texture ID # eff_bts_chr032_c_revolution.geom
                       }
     shader_uniform_from_names = dict([reversed(i) for i in shader_uniform_from_ids.items()])
+    header_size = 24  # HH, 16 bytes of shader hex, BBH
 
     def __init__(self, io_stream):
         super().__init__(io_stream)
@@ -86,9 +87,13 @@ class MaterialReader(BaseRW):
         self.shader_uniforms = []
         self.unknown_data = []
 
+        # Utility data
+        self.material_start_ptr = None
+
         self.subreaders = [self.unknown_data]
 
     def read(self):
+        self.material_start_ptr = self.bytestream.tell()
         self.read_write(self.read_buffer, self.read_raw)
         self.interpret_material()
         self.interpret_unknown_material_components()
@@ -128,7 +133,9 @@ class MaterialReader(BaseRW):
 
         self.shader_hex = '_'.join((shader_hex_pt_1, shader_hex_pt_2, shader_hex_pt_3, shader_hex_pt_4))
 
-        self.shader_uniforms = [self.shader_uniform_factory(data) for data in self.chunk_list(self.shader_uniforms, 24)]
+        uniforms_start_ptr = self.material_start_ptr + self.header_size
+        self.shader_uniforms = [self.shader_uniform_factory(data, uniforms_start_ptr + 24*i)
+                                for i, data in enumerate(self.chunk_list(self.shader_uniforms, 24))]
         self.shader_uniforms = {elem[0]: elem[1] for elem in self.shader_uniforms}
 
     def reinterpret_material(self):
@@ -142,25 +149,33 @@ class MaterialReader(BaseRW):
         self.shader_hex = b''.join((shader_hex_pt_1, shader_hex_pt_2, shader_hex_pt_3, shader_hex_pt_4))
         self.shader_uniforms = b''.join([self.shader_uniform_data_factory(uniform_name, uniform) for uniform_name, uniform in self.shader_uniforms.items()])
 
-    def shader_uniform_factory(self, data):
+    def shader_uniform_factory(self, data, offset):
         payload = data[:16]
         uniform_type = MaterialReader.shader_uniform_from_ids[data[16]]
         num_floats = data[17]
-        always_65280 = struct.unpack('H', data[18:20])[0]
-        padding_0x14 = struct.unpack('I', data[20:])[0]
-
-        assert always_65280 == 65280, f"Shader uniform variable always_65280 was {always_65280}, not 65280."
-        assert padding_0x14 == 0, f"Shader padding_0x14 was {padding_0x14}, not 0."
+        is_checked = self.assertion_policy != 'fast'
+        if is_checked:
+            always_65280 = struct.unpack('H', data[18:20])[0]
+            padding_0x14 = struct.unpack('I', data[20:])[0]
+            if always_65280 != 65280:
+                self.report_violation(f"Shader uniform variable always_65280 was {always_65280}, not 65280.",
+                                      'shader_uniforms', offset)
+            if padding_0x14 != 0:
+                self.report_violation(f"Shader padding_0x14 was {padding_0x14}, not 0.", 'shader_uniforms', offset)
 
         if num_floats == 0:
             payload = struct.unpack('H'*8, payload)
-            for i, datum in enumerate(payload[1:6]):
-                assert datum == 0, f"Element {i + num_floats} is not pad bytes!"
+            if is_checked:
+                for i, datum in enumerate(payload[1:6]):
+                    if datum != 0:
+                        self.report_violation(f"Element {i + num_floats} is not pad bytes!", 'shader_uniforms', offset)
             payload = [payload[0], *payload[6:]]
         else:
             payload = struct.unpack('f'*num_floats, payload[:num_floats*4])
-            for i, datum in enumerate(payload[num_floats:]):
-                assert datum == 0, f"Element {i+num_floats} is not pad bytes!"
+            if is_checked:
+                for i, datum in enumerate(payload[num_floats:]):
+                    if datum != 0:
+                        self.report_violation(f"Element {i+num_floats} is not pad bytes!", 'shader_uniforms', offset)
             payload = payload[:num_floats]
 
         return uniform_type, shader_uniforms_from_defn[(uniform_type, num_floats)](payload)
@@ -181,7 +196,9 @@ class MaterialReader(BaseRW):
 
     def interpret_unknown_material_components(self):
         self.unknown_data : bytes
-        self.unknown_data = [self.umc_factory(data) for data in self.chunk_list(self.unknown_data, 24)]
+        unknown_data_start_ptr = self.material_start_ptr + self.header_size + 24 * self.num_shader_uniforms
+        self.unknown_data = [self.umc_factory(data, unknown_data_start_ptr + 24*i)
+                             for i, data in enumerate(self.chunk_list(self.unknown_data, 24))]
         self.unknown_data = {elem[0]: elem[1] for elem in self.unknown_data}
 
     def reinterpret_unknown_material_components(self):
@@ -189,24 +206,27 @@ class MaterialReader(BaseRW):
         self.unknown_data = [self.umc_data_factory(key, value) for key, value in self.unknown_data.items()]
         self.unknown_data = b''.join(self.unknown_data)
 
-    def umc_factory(self, data):
-        padding_0x08 = struct.unpack('H', data[8:10])[0]  # Always 0
-        padding_0x0A = struct.unpack('H', data[10:12])[0]   # Always 0
-        padding_0x0C = struct.unpack('H', data[12:14])[0]   # Always 0
-        padding_0x0E = struct.unpack('H', data[14:16])[0]   # Always 0
-        assert padding_0x08 == 0, f"padding_0x08 is {padding_0x08}, not 0"
-        assert padding_0x0A == 0, f"padding_0x0A is {padding_0x0A}, not 0"
-        assert padding_0x0C == 0, f"padding_0x0C is {padding_0x0C}, not 0"
-        assert padding_0x0E == 0, f"padding_0x0E is {padding_0x0E}, not 0"
-
+    def umc_factory(self, data, offset):
         # If you index a single byte from a bytestring, Python automatically turns it into an integer...
         maybe_component_type = data[16]   # Few values, 160 - 169 + 172 # Presumably the component type?
-        always_100 = data[17]
-        always_65280 = struct.unpack('H', data[18:20])[0]
-        padding_0x14 = struct.unpack('I', data[20:24])[0]
-        assert always_100 == 100, f"always_100 is {always_100}, not 100"
-        assert always_65280 == 65280, f"always_65280 is {always_65280}, not 65280"
-        assert padding_0x14 == 0, f"padding_0x14 is {padding_0x14}, not 0"
+
+        if self.assertion_policy != 'fast':
+            padding_0x08 = struct.unpack('H', data[8:10])[0]  # Always 0
+            padding_0x0A = struct.unpack('H', data[10:12])[0]   # Always 0
+            padding_0x0C = struct.unpack('H', data[12:14])[0]   # Always 0
+            padding_0x0E = struct.unpack('H', data[14:16])[0]   # Always 0
+            always_100 = data[17]
+            always_65280 = struct.unpack('H', data[18:20])[0]
+            padding_0x14 = struct.unpack('I', data[20:24])[0]
+            for varname, value, expected_value in (('padding_0x08', padding_0x08, 0),
+                                                   ('padding_0x0A', padding_0x0A, 0),
+                                                   ('padding_0x0C', padding_0x0C, 0),
+                                                   ('padding_0x0E', padding_0x0E, 0),
+                                                   ('always_100', always_100, 100),
+                                                   ('always_65280', always_65280, 65280),
+                                                   ('padding_0x14', padding_0x14, 0)):
+                if value != expected_value:
+                    self.report_violation(f"{varname} is {value}, not {expected_value}", 'unknown_data', offset)
 
         return maybe_component_type, struct.unpack(possibly_umc_types[maybe_component_type], data[0:8])
 
@@ -1,7 +1,7 @@
-from ..BaseRW import BaseRW
+from ..BaseRW import BaseRW, StructSchema
 from .VertexComponents import vertex_components_from_defn
+from ...Utilities.VertexArrays import VertexArrays
 import numpy as np
-import struct
 
 
 class MeshReaderBase(BaseRW):
@@ -28,6 +28,43 @@ class MeshReaderBase(BaseRW):
        No visual changes have been seen, except in the case of unknown_0x31, which may affect bone weights.
        Setting all the floats to 0 (unknowns 0x48 - 0x68) has no observable effect.
     """
+    header_schema = StructSchema([('vertex_data_start_ptr', 'Q'),
+                                  ('polygon_data_start_ptr', 'Q'),
+                                  ('weighted_bone_data_start_ptr', 'Q'),
+                                  ('padding_0x18', 'Q', 0),  # Always 0
+
+                                  ('vertex_components_start_ptr', 'Q'),
+                                  ('num_weighted_bone_idxs', 'H'),  # Lists a set of bones near the mesh
+                                  ('num_vertex_components', 'H'),
+                                  ('bytes_per_vertex', 'H'),
+                                  ('always_5123', 'H'),  # Always 5123?! Checked against header_breaker in rw_header
+
+                                  # pc002:
+                                  # Unknown0x34, Unknown0x36 the same for meshes 0-6: these are individual body parts with a single material each
+                                  # They are also the same for meshes 7-8: these seem to be 'outline' meshes.
+                                  # 0x30, 0x31 look like switches of some variety...
+                                  # Same with unknown_0x34
+                                  # Setting unknown_0x31 to 4 makes pc002 mesh disappear, setting to 5 seems to remap the bone weights.
+                                  # Might describe how to build the polygons?
+                                  ('max_vertex_groups_per_vertex', 'B'),  # takes values 0, 1, 2, 3, 4: 0 means map everything to idx 0, 1 means the idxs are in the position vector
+                                  ('unknown_0x31', 'B'),  # values 1, 4, 5: 4 means pos and normal only, diff between 1 nad 5 is what?? 1 doesn't have unk vt 2... 5 can have 0 weights, 1 cannot
+                                  ('polygon_numeric_data_type', 'H'),  # 4 or 5
+                                  # Definitely not a float... could be B, H, or e.
+                                  ('unknown_0x34', 'H'),  # All over the place - I have no idea.
+                                  #('unknown_0x35', 'B'),  # All over the place - I have no idea.
+                                  ('unknown_0x36', 'H'),  # All over the place - I have no idea.
+                                  #('unknown_0x37', 'B'),  # All over the place - I have no idea.
+
+                                  ('material_id', 'I'),
+                                  ('num_vertices', 'I'),
+
+                                  ('num_polygon_idxs', 'I'),
+                                  ('padding_0x44', 'I', 0),
+                                  ('padding_0x48', 'I', 0),
+                                  ('unknown_0x4C', 'f'),  # May be related to the two below?!
+                                  ('mesh_centre', 'fff'),
+                                  ('bounding_box_lengths', 'fff')])
+
     def __init__(self, io_stream):
         super().__init__(io_stream)
 
@@ -70,69 +107,32 @@ class MeshReaderBase(BaseRW):
         self.polygon_data_type = None
 
     def read_header(self):
-        self.rw_header(self.read_buffer)
+        self.rw_header(self.read_schema)
 
     def write_header(self):
-        self.rw_header(self.write_buffer)
-
-    def rw_header(self, rw_operator):
-        rw_operator('vertex_data_start_ptr', 'Q')
-        rw_operator('polygon_data_start_ptr', 'Q')
-        rw_operator('weighted_bone_data_start_ptr', 'Q')
-        rw_operator('padding_0x18', 'Q')  # Always 0
-        self.assert_is_zero('padding_0x18')
-
-        rw_operator('vertex_components_start_ptr', 'Q')
-        rw_operator('num_weighted_bone_idxs', 'H')  # Lists a set of bones near the mesh
-        rw_operator('num_vertex_components', 'H')
-        rw_operator('bytes_per_vertex', 'H')
-        rw_operator('always_5123', 'H')  # Always 5123?!
-        self.assert_equal('always_5123', self.header_breaker)
-        # PS4: self.assert_equal('always_5123', 0)
+        self.rw_header(self.write_schema)
 
-        # pc002:
-        # Unknown0x34, Unknown0x36 the same for meshes 0-6: these are individual body parts with a single material each
-        # They are also the same for meshes 7-8: these seem to be 'outline' meshes.
-        # 0x30, 0x31 look like switches of some variety...
-        # Same with unknown_0x34
-        # Setting unknown_0x31 to 4 makes pc002 mesh disappear, setting to 5 seems to remap the bone weights.
-        # Might describe how to build the polygons?
-        rw_operator('max_vertex_groups_per_vertex', 'B')  # takes values 0, 1, 2, 3, 4: 0 means map everything to idx 0, 1 means the idxs are in the position vector
-        rw_operator('unknown_0x31', 'B')  # values 1, 4, 5: 4 means pos and normal only, diff between 1 nad 5 is what?? 1 doesn't have unk vt 2... 5 can have 0 weights, 1 cannot
-        rw_operator('polygon_numeric_data_type', 'H')  # 4 or 5
-        # Definitely not a float... could be B, H, or e.
-        rw_operator('unknown_0x34', 'H')  # All over the place - I have no idea.
-        #rw_operator('unknown_0x35', 'B')  # All over the place - I have no idea.
-        rw_operator('unknown_0x36', 'H')  # All over the place - I have no idea.
-        #rw_operator('unknown_0x37', 'B')  # All over the place - I have no idea.
-
-        rw_operator('material_id', 'I')
-        rw_operator('num_vertices', 'I')
-
-        rw_operator('num_polygon_idxs', 'I')
-        rw_operator('padding_0x44', 'I')
-        self.assert_is_zero('padding_0x44')
-        rw_operator('padding_0x48', 'I')
-        self.assert_is_zero('padding_0x48')
-        rw_operator('unknown_0x4C', 'f')  # May be related to the two below?!
-        rw_operator('mesh_centre', 'fff')
-        rw_operator('bounding_box_lengths', 'fff')
+    def rw_header(self, rw_operator_schema):
+        header_start = self.bytestream.tell()
+        rw_operator_schema(self.header_schema)
+        self.assert_equal('always_5123', self.header_breaker, header_start + self.header_schema.offsets['always_5123'])
+        # PS4: self.assert_equal('always_5123', 0)
 
         self.polygon_data_type = self.get_polygon_type_defs()[self.polygon_numeric_data_type]
 
     def read(self):
-        self.read_write(self.read_buffer, self.read_raw, self.cleanup_ragged_chunk_read)
+        self.read_write(self.read_buffer, self.read_raw, self.read_array, self.cleanup_ragged_chunk_read)
         self.interpret_mesh_data()
 
     def write(self):
         self.reinterpret_mesh_data()
-        self.read_write(self.write_buffer, self.write_raw, self.cleanup_ragged_chunk_write)
+        self.read_write(self.write_buffer, self.write_raw, self.write_array, self.cleanup_ragged_chunk_write)
 
-    def read_write(self, rw_operator, rw_operator_raw, chunk_cleanup_operator):
+    def read_write(self, rw_operator, rw_operator_raw, rw_operator_array, chunk_cleanup_operator):
         self.assert_file_pointer_now_at(self.vertex_data_start_ptr)
         self.rw_vertices(rw_operator_raw)
         self.rw_weighted_bone_indices(rw_operator)
-        self.rw_polygons(rw_operator, chunk_cleanup_operator)
+        self.rw_polygons(rw_operator_array, chunk_cleanup_operator)
         self.rw_vertex_components(rw_operator)
 
     def rw_vertices(self, rw_operator_raw):
@@ -143,9 +143,9 @@ class MeshReaderBase(BaseRW):
         self.assert_file_pointer_now_at(self.weighted_bone_data_start_ptr)
         rw_operator('weighted_bone_idxs', 'I'*self.num_weighted_bone_idxs, force_1d=True)
 
-    def rw_polygons(self, rw_operator, chunk_cleanup_operator):
+    def rw_polygons(self, rw_operator_array, chunk_cleanup_operator):
         self.assert_file_pointer_now_at(self.polygon_data_start_ptr)
-        rw_operator('polygon_data', 'H'*self.num_polygon_idxs, force_1d=True)
+        rw_operator_array('polygon_data', 'H', self.num_polygon_idxs)
 
         chunk_cleanup_operator(self.bytestream.tell(), 4)
 
@@ -153,51 +153,73 @@ class MeshReaderBase(BaseRW):
         rw_operator('vertex_components', 'HHBBH'*self.num_vertex_components)
 
     def interpret_vertices(self):
-        for i, raw_vertex_data in enumerate(self.vertex_data):
-            interpreted_vertex = {}
-            bounds = [vertex_component.data_start_ptr for vertex_component in self.vertex_components]
-            bounds.append(len(raw_vertex_data))
-            for j, vertex_component in enumerate(self.vertex_components):
-                lo_bnd = bounds[j]
-                hi_bnd = bounds[j + 1]
-                raw_vertex_subdata = raw_vertex_data[lo_bnd:hi_bnd]
-                used_data = vertex_component.num_elements * self.type_buffers[vertex_component.vertex_dtype]
-
-                dtype = f'{vertex_component.num_elements}{vertex_component.vertex_dtype}'
-
-                interpreted_data = np.array(struct.unpack(dtype, raw_vertex_subdata[:used_data]))
-                #if vertex_component.validate is not None:
-                #    interpreted_data = vertex_component.validate(interpreted_data)
-                interpreted_vertex[vertex_component.vertex_type] = interpreted_data
-
-                unused_data = raw_vertex_subdata[used_data:]
-                if len(unused_data) > 0:
-                    assert unused_data == self.pad_byte * len(unused_data), f"Presumed junk data is non-zero: {unused_data}"
-
-            self.vertex_data[i] = interpreted_vertex
+        """
+        Decodes the raw vertex bytes in a single pass by viewing them through the structured dtype built from the
+        vertex components, and splits the result into one native-endian column per vertex component.
+        """
+        vertex_layout = self.get_vertex_layout_dtype()
+        vertices = np.frombuffer(self.vertex_data, dtype=vertex_layout, count=self.num_vertices)
+
+        if self.assertion_policy != 'fast':
+            raw_vertices = np.frombuffer(self.vertex_data, dtype=np.uint8, count=self.num_vertices * self.bytes_per_vertex)
+            raw_vertices = raw_vertices.reshape((self.num_vertices, self.bytes_per_vertex))
+            unused_data = raw_vertices[:, ~self.get_vertex_layout_mask()]
+            if np.any(unused_data):
+                first_bad_vertex = int(np.flatnonzero(np.any(unused_data, axis=1))[0])
+                self.report_violation(f"Presumed junk data is non-zero: {unused_data[first_bad_vertex]}", 'vertex_data',
+                                      self.vertex_data_start_ptr + first_bad_vertex * self.bytes_per_vertex)
+
+        self.vertex_data = VertexArrays(self.num_vertices)
+        for vertex_component in self.vertex_components:
+            component_data = vertices[vertex_component.vertex_type]
+            self.vertex_data.set_attribute(vertex_component.vertex_type,
+                                           component_data.astype(component_data.dtype.newbyteorder('=')))
+
+    def get_vertex_layout_dtype(self):
+        """
+        Returns a structured dtype describing a single vertex, with one field per vertex component placed at the
+        component's offset into the vertex.
+        """
+        return np.dtype({'names': [vc.vertex_type for vc in self.vertex_components],
+                         'formats': [(self.endianness + vc.vertex_dtype, (vc.num_elements,))
+                                     for vc in self.vertex_components],
+                         'offsets': [vc.data_start_ptr for vc in self.vertex_components],
+                         'itemsize': self.bytes_per_vertex})
+
+    def get_vertex_layout_mask(self):
+        """
+        Returns a boolean array over the bytes of a single vertex, which is True for bytes that belong to a vertex
+        component and False for padding bytes.
+        """
+        mask = np.zeros(self.bytes_per_vertex, dtype=bool)
+        for vertex_component in self.vertex_components:
+            used_data = vertex_component.num_elements * self.type_buffers[vertex_component.vertex_dtype]
+            mask[vertex_component.data_start_ptr:vertex_component.data_start_ptr + used_data] = True
+        return mask
 
     def reinterpret_vertices(self):
-        reinterpreted_vertices = []
-        for i, vertex_data in enumerate(self.vertex_data):
-            reinterpreted_vertex = b''
-            bounds = [vertex_component.data_start_ptr for vertex_component in self.vertex_components]
-            bounds.append(self.bytes_per_vertex)
-
-            for j, vertex_component in enumerate(self.vertex_components):
-                #if vertex_component.validate is not None:
-                #    vertex_component.validate(vertex_data[vertex_component.vertex_type])
-                reinterpreted_vertex += struct.pack(f'{vertex_component.num_elements}{vertex_component.vertex_dtype}',
-                                                   *vertex_data[vertex_component.vertex_type])
-                reinterpreted_vertex += self.pad_byte * (bounds[j+1] - len(reinterpreted_vertex))
-            
-            reinterpreted_vertices.append(reinterpreted_vertex)
-        self.vertex_data = b''.join(reinterpreted_vertices)
-
-    @classmethod
-    def vertex_component_factory(cls, vtype, num_elements, dtype, always_20, data_start_ptr):
-        assert always_20 == 20, f"Vertex always_20 was {always_20}, not 20."
-        vtype_name = cls.vertex_types[vtype]
-        vertex_dtype = cls.get_vertex_dtypes()[dtype]
+        """
+        Encodes one column per vertex component into the raw vertex bytes by filling a zero-initialised structured
+        array column by column, so that any padding between components is left as pad bytes.
+        """
+        vertex_layout = self.get_vertex_layout_dtype()
+        vertices = np.zeros(self.num_vertices, dtype=vertex_layout)
+        for vertex_component in self.vertex_components:
+            component_data = self.vertex_data.attributes[vertex_component.vertex_type]
+            component_data = component_data.reshape((self.num_vertices, vertex_component.num_elements))
+            component_dtype = vertex_layout[vertex_component.vertex_type].base
+            if np.issubdtype(component_dtype, np.integer):
+                dtype_info = np.iinfo(component_dtype)
+                assert np.all((component_data >= dtype_info.min) & (component_data <= dtype_info.max)), \
+                    f"{vertex_component.vertex_type} data does not fit in {component_dtype}."
+            vertices[vertex_component.vertex_type] = component_data
+        self.vertex_data = vertices.tobytes()
+
+    def vertex_component_factory(self, offset, vtype, num_elements, dtype, always_20, data_start_ptr):
+        if self.assertion_policy != 'fast' and always_20 != 20:
+            self.report_violation(f"Vertex always_20 was {always_20}, not 20.", 'always_20', offset)
+        vtype_name = self.vertex_types[vtype]
+        vertex_dtype = self.get_vertex_dtypes()[dtype]
         vcomp = vertex_components_from_defn[(vtype_name, num_elements, vertex_dtype)](data_start_ptr)
 
         return vcomp
@@ -208,8 +230,9 @@ class MeshReaderBase(BaseRW):
                 cls.get_reverse_vertex_dtypes()[vertex_component.vertex_dtype], 20, vertex_component.data_start_ptr)
 
     def interpret_mesh_data(self):
-        self.vertex_components = [self.vertex_component_factory(*data) for data in self.chunk_list(self.vertex_components, 5)]
-        self.vertex_data = self.chunk_list(self.vertex_data, self.bytes_per_vertex)
+        # Each vertex component is 8 bytes long
+        self.vertex_components = [self.vertex_component_factory(self.vertex_components_start_ptr + 8*i, *data)
+                                  for i, data in enumerate(self.chunk_list(self.vertex_components, 5))]
         self.interpret_vertices()
 
     def reinterpret_mesh_data(self):
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class BaseVertexComponent:
     vertex_type = None
     num_elements = None
@@ -7,9 +10,10 @@ class BaseVertexComponent:
         self.data_start_ptr = data_start_ptr
 
     @classmethod
-    def generator(cls, vtx):
-        assert len(vtx[cls.vertex_type]) == cls.num_elements, "Vertex has an invalid number of elements."
-        return {cls.vertex_type: vtx[cls.vertex_type]}
+    def generator(cls, vertices):
+        component_data = vertices.attributes[cls.vertex_type]
+        assert component_data.shape[1] == cls.num_elements, "Vertices have an invalid number of elements."
+        return {cls.vertex_type: component_data}
 
 
 class Position(BaseVertexComponent):
@@ -23,8 +27,11 @@ class PosWeight(BaseVertexComponent):
     num_elements = 4
     vertex_dtype = 'f'
 
-    def generator(self, vtx):
-        return {'Position': [*vtx['Position'], float(3 * vtx['WeightedBoneID'][0])]}
+    @classmethod
+    def generator(cls, vertices):
+        positions = vertices.attributes['Position'][:, :3]
+        weighted_bone_ids = 3 * vertices.bone_indices[:, :1]
+        return {'Position': np.hstack([positions, weighted_bone_ids.astype(positions.dtype)])}
 
 
 class Normal(BaseVertexComponent):
@@ -69,24 +76,24 @@ class Colour(BaseVertexComponent):
     vertex_dtype = 'e'
 
 
+def pad_skinning_matrix(matrix, num_elements):
+    num_missing_items = num_elements - matrix.shape[1]
+    assert num_missing_items >= 0, "Vertices have more vertex groups than the vertex component can hold."
+    return np.pad(matrix, ((0, 0), (0, num_missing_items)))
+
+
 class BaseIndexComponent(BaseVertexComponent):
     @classmethod
-    def generator(cls, vtx):
-        num_missing_items = cls.num_elements - len(vtx[cls.vertex_type])
-        current_items = [item*3 for item in vtx[cls.vertex_type]]
-        current_items.extend([0] * num_missing_items)
-        assert len(current_items) == cls.num_elements, "Something went wrong extending vertex indices."
-        return {cls.vertex_type: current_items}
+    def generator(cls, vertices):
+        used_groups = vertices.max_groups_per_vertex
+        return {cls.vertex_type: pad_skinning_matrix(3 * vertices.bone_indices[:, :used_groups], cls.num_elements)}
 
 
 class BaseWeightComponent(BaseVertexComponent):
     @classmethod
-    def generator(cls, vtx):
-        num_missing_items = cls.num_elements - len(vtx[cls.vertex_type])
-        current_items = [item for item in vtx[cls.vertex_type]]
-        current_items.extend([0.] * num_missing_items)
-        assert len(current_items) == cls.num_elements, "Something went wrong extending vertex indices."
-        return {cls.vertex_type: current_items}
+    def generator(cls, vertices):
+        used_groups = vertices.max_groups_per_vertex
+        return {cls.vertex_type: pad_skinning_matrix(vertices.bone_weights[:, :used_groups], cls.num_elements)}
 
 
 class Indices2(BaseIndexComponent):
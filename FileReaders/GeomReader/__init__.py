@@ -1,4 +1,4 @@
-from ..BaseRW import BaseRW
+from ..BaseRW import BaseRW, StructSchema
 from .MeshReader import MeshReaderPC, MeshReaderPS4
 from .MaterialReader import MaterialReader
 
@@ -30,6 +30,27 @@ class GeomReader(BaseRW):
     1. unknown_footer_data generally seems to contain every byte value repeated four times with some preceding padding
         bytes plus some (potentially information-carrying) bytes.
     """
+    header_schema = StructSchema([('filetype', 'I', 100),  # Always 100.
+                                  ('num_meshes', 'H'),
+                                  ('num_materials', 'H'),
+                                  ('num_unknown_cam_data_1', 'H'),  # 0, 1, 2, 3, 4 ,5
+                                  ('num_unknown_cam_data_2', 'H'),  # 0, 1, 2, 3, 4, 9
+                                  ('num_bones', 'I'),
+
+                                  ('num_bytes_in_texture_names_section', 'I'),
+                                  ('geom_centre', 'fff'),
+                                  ('geom_bounding_box_lengths', 'fff'),
+                                  ('padding_0x2C', 'I', 0),  # Always 0
+
+                                  ('meshes_start_ptr', 'Q'),
+                                  ('materials_start_ptr', 'Q'),
+                                  ('unknown_cam_data_1_start_ptr', 'Q'),
+                                  ('unknown_cam_data_2_start_ptr', 'Q'),
+
+                                  ('bone_matrices_start_ptr', 'Q'),
+                                  ('padding_0x58', 'Q', 0),
+                                  ('texture_names_start_ptr', 'Q'),
+                                  ('footer_data_start_offset', 'Q')])
 
     def __init__(self, io_stream):
         super().__init__(io_stream)
@@ -75,15 +96,16 @@ class GeomReader(BaseRW):
         return platform_table[platform](bytestream)
 
     def read(self):
-        self.read_write(self.read_buffer, 'read', self.read_raw, self.prepare_read_op, self.cleanup_ragged_chunk_read)
+        self.read_write(self.read_buffer, 'read', self.read_raw, self.read_array, self.read_schema, self.prepare_read_op, self.cleanup_ragged_chunk_read)
         self.interpret_geom_data()
 
     def write(self):
         self.reinterpret_geom_data()
-        self.read_write(self.write_buffer, 'write', self.write_raw, lambda: None, self.cleanup_ragged_chunk_write)
+        self.read_write(self.write_buffer, 'write', self.write_raw, self.write_array, self.write_schema, lambda: None, self.cleanup_ragged_chunk_write)
 
-    def read_write(self, rw_operator, rw_method_name, rw_operator_raw, preparation_op, chunk_cleanup_operator):
-        self.rw_header(rw_operator)
+    def read_write(self, rw_operator, rw_method_name, rw_operator_raw, rw_operator_array, rw_operator_schema, preparation_op,
+                   chunk_cleanup_operator):
+        self.rw_header(rw_operator_schema)
         preparation_op()
         self.rw_meshes(rw_operator, rw_method_name)
         self.rw_material_data(rw_method_name)
@@ -91,10 +113,10 @@ class GeomReader(BaseRW):
         self.rw_unknown_cam_data_1(rw_method_name, rw_operator)
         self.rw_unknown_cam_data_2(rw_method_name, rw_operator)
         chunk_cleanup_operator(self.bytestream.tell(), 16)
-        self.rw_bone_data(rw_operator)
+        self.rw_bone_data(rw_operator_array)
         self.rw_footer_data(rw_operator_raw)
 
-    def rw_header(self, rw_operator):
+    def rw_header(self, rw_operator_schema):
         """
         -> Only unknown values bytes 0x14-0x2B, assumed to be 6 floats.
         
@@ -105,31 +127,7 @@ class GeomReader(BaseRW):
         """
         # Header
         self.assert_file_pointer_now_at(0)
-
-        rw_operator('filetype', 'I')  # Always 100.
-        self.assert_equal('filetype', 100)
-        rw_operator('num_meshes', 'H')
-        rw_operator('num_materials', 'H')
-        rw_operator('num_unknown_cam_data_1', 'H')  # 0, 1, 2, 3, 4 ,5
-        rw_operator('num_unknown_cam_data_2', 'H')  # 0, 1, 2, 3, 4, 9
-        rw_operator('num_bones', 'I')
-
-        rw_operator('num_bytes_in_texture_names_section', 'I')
-        rw_operator('geom_centre', 'fff')
-        rw_operator('geom_bounding_box_lengths', 'fff')
-        rw_operator('padding_0x2C', 'I')  # Always 0
-        self.assert_is_zero('padding_0x2C')
-
-        rw_operator('meshes_start_ptr', 'Q')
-        rw_operator('materials_start_ptr', 'Q')
-        rw_operator('unknown_cam_data_1_start_ptr', 'Q')
-        rw_operator('unknown_cam_data_2_start_ptr', 'Q')
-
-        rw_operator('bone_matrices_start_ptr', 'Q')
-        rw_operator('padding_0x58', 'Q')
-        self.assert_is_zero("padding_0x58")
-        rw_operator('texture_names_start_ptr', 'Q')
-        rw_operator('footer_data_start_offset', 'Q')
+        rw_operator_schema(self.header_schema)
 
     def is_ndef(self, offset, numValues):
         """
@@ -204,12 +202,13 @@ class GeomReader(BaseRW):
         #for unk_cam_data_2_reader in self.unknown_cam_data_2:
         #    getattr(unk_cam_data_2_reader, rw_method_name)()
 
-    def rw_bone_data(self, rw_operator):
+    def rw_bone_data(self, rw_operator_array):
         if self.is_ndef(self.bone_matrices_start_ptr, 'num_bones'):
             return
         self.assert_file_pointer_now_at(self.bone_matrices_start_ptr)
 
-        rw_operator('inverse_bind_pose_matrices', 'f'*12*self.num_bones)
+        # 12 floats per bone
+        rw_operator_array('inverse_bind_pose_matrices', 'f', 12*self.num_bones, shape=(-1, 3, 4))
 
     def rw_footer_data(self, rw_operator_raw):
         if self.footer_data_start_offset == 0:
@@ -231,20 +230,19 @@ class GeomReader(BaseRW):
         #self.unknown_cam_data_2 = [UnknownCamData2Reader(self.bytestream) for _ in range(self.num_unknown_cam_data_2)]
 
     def interpret_geom_data(self):
-        texture_data = self.chunk_list(self.texture_data, 32)
+        texture_data = self.chunk_list(bytes(self.texture_data), 32)
         self.texture_data = [datum.rstrip(self.pad_byte).decode('ascii') for datum in texture_data]
         self.unknown_cam_data_1 = self.chunk_list(self.unknown_cam_data_1, 21)
         self.unknown_cam_data_2 = self.chunk_list(self.unknown_cam_data_2, 17)
 
-        self.inverse_bind_pose_matrices = self.chunk_list(self.inverse_bind_pose_matrices, 12)
-        # Can probably vectorise this loop away, but is it worth it?
-        for i, data in enumerate(self.inverse_bind_pose_matrices):
-            data = np.array(data).reshape((3, 4))
+        # Each matrix is stored without its final [0, 0, 0, 1] row
+        bone_matrices = np.reshape(self.inverse_bind_pose_matrices, (-1, 3, 4))
+        self.inverse_bind_pose_matrices = np.zeros((self.num_bones, 4, 4))
+        self.inverse_bind_pose_matrices[:, :3, :] = bone_matrices
+        self.inverse_bind_pose_matrices[:, 3, 3] = 1
 
-            bone_matrix = np.zeros((4, 4))
-            bone_matrix[:3, :4] = data
-            bone_matrix[3, 3] = 1
-            self.inverse_bind_pose_matrices[i] = bone_matrix
+        # Copied so that the footer outlives the buffer it was read from
+        self.unknown_footer_data = bytes(self.unknown_footer_data)
 
     def reinterpret_geom_data(self):
         self.texture_data: typing.List[str]
@@ -257,17 +255,10 @@ class GeomReader(BaseRW):
         self.unknown_cam_data_1 = self.flatten_list(self.unknown_cam_data_1)
         self.unknown_cam_data_2 = self.flatten_list(self.unknown_cam_data_2)
 
-        for i, data in enumerate(self.inverse_bind_pose_matrices):
-
-            data = data[:3, :4]  # Cut out the [0, 0, 0, 1] row
-
-            self.inverse_bind_pose_matrices[i] = data.reshape(12).tolist()
-
-        self.inverse_bind_pose_matrices = self.flatten_list(self.inverse_bind_pose_matrices)
-        self.inverse_bind_pose_matrices = np.array(self.inverse_bind_pose_matrices)
-        self.inverse_bind_pose_matrices[np.where(self.inverse_bind_pose_matrices == -0.)] = 0.
-
-        self.inverse_bind_pose_matrices = self.inverse_bind_pose_matrices.tolist()
+        bone_matrices = np.array(self.inverse_bind_pose_matrices, dtype=np.float64).reshape((-1, 4, 4))
+        bone_matrices = bone_matrices[:, :3, :]  # Cut out the [0, 0, 0, 1] row
+        bone_matrices[np.where(bone_matrices == -0.)] = 0.
+        self.inverse_bind_pose_matrices = bone_matrices
 
     def new_meshreader(self):
         raise NotImplementedError
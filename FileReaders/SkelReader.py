@@ -1,4 +1,4 @@
-from .BaseRW import BaseRW
+from .BaseRW import BaseRW, StructSchema
 import numpy as np
 
 
@@ -27,6 +27,25 @@ class SkelReader(BaseRW):
     2. There may be a section containing bone constraints.
     3. The above two may instead be in the anim file, if they exist at all
     """
+    header_schema = StructSchema([('filetype', '4s', '20SE'),
+                                  ('total_bytes', 'Q'),
+                                  ('remaining_bytes_after_parent_bones_chunk', 'I'),
+                                  ('num_bones', 'H'),
+                                  ('unknown_0x0C', 'H'),
+                                  ('num_bone_hierarchy_data_lines', 'I'),
+
+                                  ('rel_ptr_to_end_of_bone_hierarchy_data', 'I'),
+                                  ('rel_ptr_to_end_of_bone_defs', 'I'),
+                                  ('rel_ptr_to_end_of_parent_bones_chunk', 'I'),
+                                  ('unknown_rel_ptr_2', 'I'),
+                                  ('unknown_rel_ptr_3', 'I'),
+                                  ('rel_ptr_to_end_of_parent_bones', 'I'),
+
+                                  ('padding_0x26', 'I', 0),
+                                  ('padding_0x2A', 'I', 0),
+                                  ('padding_0x2E', 'I', 0),
+                                  ('padding_0x32', 'I', 0)])
+
     def __init__(self, io_stream):
         super().__init__(io_stream)
 
@@ -71,17 +90,17 @@ class SkelReader(BaseRW):
         self.abs_ptr_unknown_4 = None
 
     def read(self):
-        self.read_write(self.read_buffer, self.read_ascii, self.read_raw, self.cleanup_ragged_chunk_read)
+        self.read_write(self.read_buffer, self.read_schema, self.read_raw, self.read_array, self.cleanup_ragged_chunk_read)
         self.interpret_skel_data()
 
     def write(self):
         self.reinterpret_skel_data()
-        self.read_write(self.write_buffer, self.write_ascii, self.write_raw, self.cleanup_ragged_chunk_write)
+        self.read_write(self.write_buffer, self.write_schema, self.write_raw, self.write_array, self.cleanup_ragged_chunk_write)
 
-    def read_write(self, rw_operator, rw_operator_ascii, rw_operator_raw, chunk_cleanup):
-        self.rw_header(rw_operator, rw_operator_ascii)
+    def read_write(self, rw_operator, rw_operator_schema, rw_operator_raw, rw_operator_array, chunk_cleanup):
+        self.rw_header(rw_operator_schema)
         self.rw_bone_hierarchy(rw_operator)
-        self.rw_bone_data(rw_operator)
+        self.rw_bone_data(rw_operator_array)
         self.rw_parent_bones(rw_operator)
         self.rw_unknown_data_1(rw_operator)
         chunk_cleanup(self.bytestream.tell(), 16)
@@ -90,38 +109,18 @@ class SkelReader(BaseRW):
         self.rw_unknown_data_4(rw_operator)
         chunk_cleanup(self.bytestream.tell() - self.remaining_bytes_after_parent_bones_chunk, 16)
 
-    def rw_header(self, rw_operator, rw_operator_ascii):
+    def rw_header(self, rw_operator_schema):
         self.assert_file_pointer_now_at(0)
+        header_start = self.bytestream.tell()
+        rw_operator_schema(self.header_schema)
 
-        rw_operator_ascii('filetype', 4)
-        self.assert_equal("filetype", "20SE")
-        rw_operator('total_bytes', 'Q')
-        rw_operator('remaining_bytes_after_parent_bones_chunk', 'I')
-        rw_operator('num_bones',  'H')
-        rw_operator('unknown_0x0C', 'H')
-        rw_operator('num_bone_hierarchy_data_lines', 'I')
-
-        upcd_pos = self.bytestream.tell()  # 24
-        rw_operator('rel_ptr_to_end_of_bone_hierarchy_data', 'I')
-        bonedefs_pos = self.bytestream.tell()  # 28
-        rw_operator('rel_ptr_to_end_of_bone_defs', 'I')
-        pb_chunk_ptr_pos = self.bytestream.tell()  # 32
-        rw_operator('rel_ptr_to_end_of_parent_bones_chunk', 'I')
-        unk2_pos = self.bytestream.tell()  # 36
-        rw_operator('unknown_rel_ptr_2', 'I')
-        unk3_pos = self.bytestream.tell()  # 40
-        rw_operator('unknown_rel_ptr_3', 'I')
-        pcp_pos = self.bytestream.tell()  # 44
-        rw_operator('rel_ptr_to_end_of_parent_bones', 'I')
-
-        rw_operator('padding_0x26', 'I')
-        self.assert_is_zero("padding_0x26")
-        rw_operator('padding_0x2A', 'I')
-        self.assert_is_zero("padding_0x2A")
-        rw_operator('padding_0x2E', 'I')
-        self.assert_is_zero("padding_0x2E")
-        rw_operator('padding_0x32', 'I')
-        self.assert_is_zero("padding_0x32")
+        # The relative pointers are relative to their own position in the header
+        upcd_pos = self.header_schema.offsets['rel_ptr_to_end_of_bone_hierarchy_data']  # 24
+        bonedefs_pos = self.header_schema.offsets['rel_ptr_to_end_of_bone_defs']  # 28
+        pb_chunk_ptr_pos = self.header_schema.offsets['rel_ptr_to_end_of_parent_bones_chunk']  # 32
+        unk2_pos = self.header_schema.offsets['unknown_rel_ptr_2']  # 36
+        unk3_pos = self.header_schema.offsets['unknown_rel_ptr_3']  # 40
+        pcp_pos = self.header_schema.offsets['rel_ptr_to_end_of_parent_bones']  # 44
 
         self.abs_ptr_bone_hierarchy_data = upcd_pos + self.rel_ptr_to_end_of_bone_hierarchy_data - (self.num_bone_hierarchy_data_lines * 16)
         self.abs_ptr_bone_defs = bonedefs_pos + self.rel_ptr_to_end_of_bone_defs - (self.num_bones * 12 * 4)
@@ -130,7 +129,8 @@ class SkelReader(BaseRW):
         self.abs_ptr_unknown_2 = unk2_pos + self.unknown_rel_ptr_2 - self.num_bones * 4
         self.abs_ptr_unknown_3 = unk3_pos + self.unknown_rel_ptr_3 - self.unknown_0x0C * 4
 
-        self.assert_equal("total_bytes", self.abs_ptr_unknown_2 + self.remaining_bytes_after_parent_bones_chunk)
+        self.assert_equal("total_bytes", self.abs_ptr_unknown_2 + self.remaining_bytes_after_parent_bones_chunk,
+                          header_start + self.header_schema.offsets['total_bytes'])
 
     def rw_bone_hierarchy(self, rw_operator):
         # Seems to contain the same info as the parent_bones with repeats and bugs..?
@@ -138,11 +138,11 @@ class SkelReader(BaseRW):
         int16s_to_read = self.num_bone_hierarchy_data_lines * 8
         rw_operator('bone_hierarchy_data', 'h'*int16s_to_read)
 
-    def rw_bone_data(self, rw_operator):
+    def rw_bone_data(self, rw_operator_array):
         # Rotation, position, scale as quaternions and affine vectors
         self.assert_file_pointer_now_at(self.abs_ptr_bone_defs)
         floats_to_read = self.num_bones * 12  # * 4
-        rw_operator('bone_data', 'f'*floats_to_read)
+        rw_operator_array('bone_data', 'f', floats_to_read, shape=(-1, 3, 4))
 
     def rw_parent_bones(self, rw_operator):
         self.assert_file_pointer_now_at(self.abs_ptr_parent_bones)
@@ -174,22 +174,28 @@ class SkelReader(BaseRW):
 
     def interpret_skel_data(self):
         self.bone_hierarchy_data = self.chunk_list(self.bone_hierarchy_data, 8)
-        self.bone_data = self.chunk_list(self.chunk_list(self.bone_data, 4), 3)
+        self.bone_data = self.bone_data.astype(np.float64)
         self.parent_bones = [(i, idx) for i, idx in enumerate(self.parent_bones)]
         # Basic error checking - make sure no bone idx exceeds the known number of bones
         if len(self.parent_bones) != 0:
             max_idx = max([subitem for item in self.parent_bones for subitem in item])
         else:
             max_idx = -1
-        assert max_idx == self.num_bones - 1, f'{max_idx}, {self.num_bones - 1}'
+        if self.assertion_policy != 'fast' and max_idx != self.num_bones - 1:
+            # Every child idx is in range, so the max idx must have come from a parent bone
+            bad_parent_bone = next((i for i, parent in self.parent_bones if parent == max_idx), 0)
+            self.report_violation(f"max_idx == {self.num_bones - 1}, value is {max_idx}", 'max_idx',
+                                  self.abs_ptr_parent_bones + bad_parent_bone * 2)
         
         # final elem of 'pos' and 'scale' always 1 - these are nominally 4-vectors,
         # so the final elem is presumably either unused or part of an affine transform
-        for i, bone_set in enumerate(self.bone_data):
-            assert bone_set[1][-1] == 1., bone_set
-            assert bone_set[2][-1] == 1., bone_set
+        if self.assertion_policy != 'fast':
+            not_affine = np.any(self.bone_data[:, 1:, -1] != 1., axis=1)
+            if np.any(not_affine):
+                first_bad_bone = int(np.flatnonzero(not_affine)[0])
+                self.report_violation(f"Bone {first_bad_bone} is not affine: {self.bone_data[first_bad_bone]}",
+                                      'bone_data', self.abs_ptr_bone_defs + first_bad_bone * 12 * 4)
 
     def reinterpret_skel_data(self):
         self.bone_hierarchy_data = self.flatten_list(self.bone_hierarchy_data)
-        self.bone_data = self.flatten_list(self.flatten_list(self.bone_data))
         self.parent_bones = [parent for child, parent in self.parent_bones]
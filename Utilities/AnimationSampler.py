@@ -0,0 +1,123 @@
+from .BoneHierarchy import BoneHierarchy
+from .Interpolation import interpolate_between
+from .Rotation import bone_matrix_from_rotation_location, rotation_location_scale_from_bone_matrix, \
+    wxyz_to_xyzw, xyzw_to_wxyz
+import numpy as np
+
+
+class AnimationSampler:
+    """
+    Evaluates the pose of every bone of a skeleton at batches of frames, which need not be whole numbers.
+
+    Rotations, locations, and scales are interpolated in the same way as interpolate_keyframes, and are taken to be
+    relative to the parent bone. Bones without keyframes for a transform keep the transform of their rest pose relative
+    to their parent, as described by the inverse bind pose matrices of the skeleton.
+    """
+    def __init__(self, animation, skeleton):
+        self.hierarchy = BoneHierarchy.from_bone_relations(skeleton.bone_relations)
+        num_bones = self.num_bones
+
+        if len(skeleton.inverse_bind_pose_matrices):
+            inverse_bind_pose_matrices = np.reshape(skeleton.inverse_bind_pose_matrices, (num_bones, 4, 4))
+            rest_pose_matrices = self.hierarchy.inverse_bind_pose_to_local(inverse_bind_pose_matrices)
+        else:
+            rest_pose_matrices = np.broadcast_to(np.eye(4), (num_bones, 4, 4))
+        rest_pose_quats, self.rest_pose_locations, self.rest_pose_scales = \
+            rotation_location_scale_from_bone_matrix(rest_pose_matrices)
+        self.rest_pose_quats = xyzw_to_wxyz(rest_pose_quats)
+
+        self.rotations = ChannelSampler(animation.rotations, 4, is_quaternion=True)
+        self.locations = ChannelSampler(animation.locations, 3)
+        self.scales = ChannelSampler(animation.scales, 3)
+        for channel in (self.rotations, self.locations, self.scales):
+            assert np.all(channel.bone_idxs < num_bones), \
+                f"Animation has keyframes for bone {np.max(channel.bone_idxs)}, but the skeleton only has {num_bones} bones."
+
+    @property
+    def num_bones(self):
+        return self.hierarchy.num_bones
+
+    def sample(self, frames):
+        """
+        Returns
+        ------
+        The matrices of every bone relative to its parent, and relative to the model, at each of the given frames.
+        Both are (num_frames, num_bones, 4, 4) arrays.
+        """
+        frames = np.asarray(frames, dtype=np.float64).reshape(-1)
+        num_frames = len(frames)
+
+        quats = np.repeat(self.rest_pose_quats[np.newaxis], num_frames, axis=0)
+        quats[:, self.rotations.bone_idxs] = self.rotations.sample(frames)
+        locations = np.repeat(self.rest_pose_locations[np.newaxis], num_frames, axis=0)
+        locations[:, self.locations.bone_idxs] = self.locations.sample(frames)
+        scales = np.repeat(self.rest_pose_scales[np.newaxis], num_frames, axis=0)
+        scales[:, self.scales.bone_idxs] = self.scales.sample(frames)
+
+        local_matrices = bone_matrix_from_rotation_location(wxyz_to_xyzw(quats), locations, scales)
+        return local_matrices, self.hierarchy.local_to_global(local_matrices)
+
+
+class ChannelSampler:
+    """
+    Holds the keyframes of one transform type for every bone in flat arrays, so that all bones can be interpolated at
+    once.
+
+    The keyframes are ordered by bone and then by frame, and each keyframe is given a search key of
+    (track index * frame_stride + frame), so that a single binary search finds the keyframes either side of a frame in
+    every track.
+    """
+    def __init__(self, fcurves, num_components, is_quaternion=False):
+        self.num_components = num_components
+        self.is_quaternion = is_quaternion
+
+        self.bone_idxs = np.array(sorted([bone_idx for bone_idx, fcurve in fcurves.items() if len(fcurve.frames)]),
+                                 dtype=np.int64)
+        track_frames = []
+        track_values = []
+        for bone_idx in self.bone_idxs:
+            fcurve = fcurves[bone_idx]
+            frame_order = np.argsort(fcurve.frames, kind='stable')
+            track_frames.append(np.asarray(fcurve.frames, dtype=np.float64)[frame_order])
+            track_values.append(np.reshape(fcurve.values, (-1, num_components))[frame_order])
+        track_lengths = np.array([len(frames) for frames in track_frames], dtype=np.int64)
+        self.track_ends = np.cumsum(track_lengths)
+        self.track_starts = self.track_ends - track_lengths
+        self.frames = np.concatenate([np.zeros(0), *track_frames])
+        self.values = np.concatenate([np.zeros((0, num_components)), *track_values]).astype(np.float64)
+
+        if len(self.frames):
+            self.first_frame = np.min(self.frames)
+            self.frame_stride = np.max(self.frames) - self.first_frame + 1
+        else:
+            self.first_frame = 0.
+            self.frame_stride = 1.
+        self.search_keys = np.repeat(np.arange(len(self.bone_idxs)), track_lengths) * self.frame_stride + \
+                           (self.frames - self.first_frame)
+
+    def sample(self, frames):
+        """
+        Returns the value of every track at the given frames, as a (num_frames, num_tracks, num_components) array.
+        """
+        frames = np.asarray(frames, dtype=np.float64).reshape((-1, 1))
+        num_tracks = len(self.bone_idxs)
+        if not num_tracks:
+            return np.zeros((len(frames), 0, self.num_components))
+
+        clipped_frames = np.clip(frames - self.first_frame, 0, self.frame_stride - 1)
+        next_idxs = np.searchsorted(self.search_keys, np.arange(num_tracks) * self.frame_stride + clipped_frames,
+                                    side='right')
+        next_idxs = np.clip(next_idxs, self.track_starts + 1, self.track_ends - 1)
+        prev_idxs = next_idxs - 1
+        is_single_keyframe = self.track_ends - self.track_starts == 1
+        next_idxs = np.where(is_single_keyframe, self.track_starts, next_idxs)
+        prev_idxs = np.where(is_single_keyframe, self.track_starts, prev_idxs)
+
+        frame_gaps = self.frames[next_idxs] - self.frames[prev_idxs]
+        weights = np.divide(frames - self.frames[prev_idxs], frame_gaps, out=np.zeros(frame_gaps.shape),
+                            where=frame_gaps != 0)
+        weights = np.clip(weights, 0, 1)
+
+        values = interpolate_between(self.values[prev_idxs.ravel()], self.values[next_idxs.ravel()], weights.ravel(),
+                                     self.is_quaternion)
+        return values.reshape((len(frames), num_tracks, self.num_components))
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class BoneHierarchy:
+    """
+    Sorts the bones of a skeleton into levels by their number of ancestors, so that transforms can be passed from
+    parents to children for a whole level of bones at once.
+
+    Matrix arguments are (..., num_bones, 4, 4) arrays, so that any number of poses can be processed together.
+    """
+    def __init__(self, parent_bones):
+        self.parent_bones = np.asarray(parent_bones, dtype=np.int64).reshape(-1)
+        self.is_root = self.parent_bones == -1
+        self.bone_levels = calculate_bone_levels(self.parent_bones)
+
+    @classmethod
+    def from_bone_relations(cls, bone_relations):
+        """
+        Builds the hierarchy from a list of (child, parent) pairs, as stored in the skel files.
+        """
+        parent_bones = np.full(len(bone_relations), -1, dtype=np.int64)
+        for child, parent in bone_relations:
+            parent_bones[child] = parent
+        return cls(parent_bones)
+
+    @property
+    def num_bones(self):
+        return len(self.parent_bones)
+
+    def parent_matrices(self, matrices):
+        """
+        Returns the matrix of the parent of every bone, or the identity for bones without a parent.
+        """
+        matrices = np.asarray(matrices, dtype=np.float64)
+        return np.where(self.is_root[:, np.newaxis, np.newaxis], np.eye(4), matrices[..., self.parent_bones, :, :])
+
+    def local_to_global(self, local_matrices):
+        """
+        Converts matrices relative to the parent bone into matrices relative to the model.
+        """
+        local_matrices = np.asarray(local_matrices, dtype=np.float64)
+        global_matrices = np.empty_like(local_matrices)
+        for depth, level_bones in enumerate(self.bone_levels):
+            if depth == 0:
+                global_matrices[..., level_bones, :, :] = local_matrices[..., level_bones, :, :]
+            else:
+                global_matrices[..., level_bones, :, :] = \
+                    global_matrices[..., self.parent_bones[level_bones], :, :] @ local_matrices[..., level_bones, :, :]
+        return global_matrices
+
+    def global_to_local(self, global_matrices):
+        """
+        Converts matrices relative to the model into matrices relative to the parent bone.
+        """
+        return np.linalg.inv(self.parent_matrices(global_matrices)) @ global_matrices
+
+    def inverse_bind_pose_to_local(self, inverse_bind_pose_matrices):
+        """
+        Converts inverse bind pose matrices into bind pose matrices relative to the parent bone. Multiplying the inverse
+        bind pose matrix of the parent onto the bind pose matrix of the child takes off the parent's contribution to the
+        child's transform, leaving the transform of the child relative to the parent.
+        """
+        inverse_bind_pose_matrices = np.asarray(inverse_bind_pose_matrices, dtype=np.float64)
+        return self.parent_matrices(inverse_bind_pose_matrices) @ np.linalg.inv(inverse_bind_pose_matrices)
+
+
+def calculate_bone_levels(parent_bones):
+    """
+    Groups the bones by their number of ancestors, so that the bones of each group only have parents in the groups
+    before it.
+    """
+    bone_depths = np.full(len(parent_bones), -1, dtype=np.int64)
+    bone_depths[parent_bones == -1] = 0
+    for depth in range(len(parent_bones)):
+        is_unassigned = bone_depths == -1
+        if not np.any(is_unassigned):
+            break
+        has_parent_at_depth = np.zeros(len(parent_bones), dtype=bool)
+        has_parent_at_depth[is_unassigned] = bone_depths[parent_bones[is_unassigned]] == depth
+        bone_depths[has_parent_at_depth] = depth + 1
+    assert np.all(bone_depths != -1), "The skeleton contains a cycle of parent bones."
+    return [np.flatnonzero(bone_depths == depth) for depth in range(np.max(bone_depths, initial=-1) + 1)]
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def interpolate_keyframes(frames, values, times, is_quaternion=False):
+    """
+    Evaluates a single track of keyframes at the given times, returning one row of values per time.
+
+    Values are linearly interpolated between the two keyframes either side of each time, and held constant before the
+    first and after the last keyframe. Quaternions (in any fixed component ordering) are interpolated with a normalised
+    lerp along the shorter arc.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape((len(frames), -1))
+    times = np.asarray(times, dtype=np.float64)
+    assert len(frames), "Cannot interpolate a track with no keyframes."
+
+    next_idxs = np.clip(np.searchsorted(frames, times, side='right'), 1, len(frames) - 1)
+    prev_idxs = next_idxs - 1
+    if len(frames) == 1:
+        next_idxs = prev_idxs
+
+    frame_gaps = frames[next_idxs] - frames[prev_idxs]
+    weights = np.divide(times - frames[prev_idxs], frame_gaps, out=np.zeros(len(times)), where=frame_gaps != 0)
+    weights = np.clip(weights, 0, 1)
+
+    return interpolate_between(values[prev_idxs], values[next_idxs], weights, is_quaternion)
+
+
+def interpolate_between(prev_values, next_values, weights, is_quaternion=False):
+    """
+    Blends each row of prev_values into the matching row of next_values by the matching weight, which should lie
+    between 0 and 1, in the same way as interpolate_keyframes.
+    """
+    weights = np.reshape(weights, (-1, 1))
+    if is_quaternion:
+        is_long_arc = np.sum(prev_values * next_values, axis=1, keepdims=True) < 0
+        next_values = np.where(is_long_arc & (weights < 1), -next_values, next_values)
+    # Written this way round so that times on a keyframe reproduce its value exactly
+    result = (1 - weights) * prev_values + weights * next_values
+    if is_quaternion:
+        is_between_keyframes = (weights > 0) & (weights < 1)
+        result = np.where(is_between_keyframes, result / np.linalg.norm(result, axis=1, keepdims=True), result)
+    return result
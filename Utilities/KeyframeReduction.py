@@ -0,0 +1,123 @@
+from .Interpolation import interpolate_keyframes, interpolate_between
+import numpy as np
+
+
+def remove_redundant_keyframes(frames, values, tolerance, is_quaternion=False, split_frames=()):
+    """
+    Removes the keyframes of a track that interpolating between the remaining keyframes reproduces to within
+    'tolerance' in every component. Tracks that stay within 'tolerance' of their first keyframe are reduced to that
+    keyframe.
+
+    Interpolation never spans any of the split_frames: the track keeps a keyframe on each of them that lies inside the
+    track, which is interpolated from the original keyframes if there was no keyframe on that frame to begin with.
+
+    Returns
+    ------
+    The frames and values of the reduced track, and the largest difference between a removed keyframe and its
+    interpolated value.
+    """
+    frames = np.asarray(frames)
+    values = np.asarray(values, dtype=np.float64).reshape((len(frames), -1))
+    if len(frames) < 2:
+        return frames, values, 0.
+
+    constant_errors = keyframe_errors(np.broadcast_to(values[0], values.shape), values, is_quaternion)
+    if np.max(constant_errors) <= tolerance:
+        return frames[:1], values[:1], float(np.max(constant_errors))
+
+    split_frames = np.asarray(split_frames, dtype=frames.dtype)
+    split_frames = split_frames[(split_frames > frames[0]) & (split_frames < frames[-1])]
+    missing_frames = np.setdiff1d(split_frames, frames)
+    if len(missing_frames):
+        missing_values = interpolate_keyframes(frames, values, missing_frames, is_quaternion)
+        frames = np.concatenate([frames, missing_frames])
+        values = np.concatenate([values, missing_values])
+        frame_order = np.argsort(frames, kind='stable')
+        frames = frames[frame_order]
+        values = values[frame_order]
+
+    # Keyframes that can't even be removed on their own have to stay, which splits the track into independent segments
+    is_kept = np.zeros(len(frames), dtype=bool)
+    is_kept[[0, -1]] = True
+    is_kept[np.searchsorted(frames, split_frames)] = True
+    weights = (frames[1:-1] - frames[:-2]) / (frames[2:] - frames[:-2])
+    removal_errors = keyframe_errors(interpolate_between(values[:-2], values[2:], weights, is_quaternion),
+                                     values[1:-1], is_quaternion)
+    is_kept[1:-1] |= removal_errors > tolerance
+
+    max_error = 0.
+    kept_idxs = np.flatnonzero(is_kept)
+    for start_idx, end_idx in zip(kept_idxs[:-1], kept_idxs[1:]):
+        if end_idx - start_idx > 1:
+            segment_idxs, segment_error = reduce_segment(frames, values, start_idx, end_idx, tolerance, is_quaternion)
+            is_kept[segment_idxs] = True
+            max_error = max(max_error, segment_error)
+
+    return frames[is_kept], values[is_kept], max_error
+
+
+def reduce_segment(frames, values, start_idx, end_idx, tolerance, is_quaternion):
+    """
+    Walks along the keyframes from start_idx to end_idx, and from each kept keyframe skips as far ahead as
+    interpolation allows: first by doubling the jump until it fails, then by bisecting between the longest jump that
+    passed and the one that failed.
+
+    Returns
+    ------
+    The indices of the keyframes kept strictly between start_idx and end_idx, and the largest difference between a
+    removed keyframe and its interpolated value.
+    """
+    kept_idxs = []
+    max_error = 0.
+    anchor_idx = start_idx
+    while True:
+        good_idx, good_error = anchor_idx + 1, 0.
+        bad_idx = None
+        step = 2
+        while bad_idx is None and good_idx < end_idx:
+            test_idx = min(anchor_idx + step, end_idx)
+            error = interpolation_error(frames, values, anchor_idx, test_idx, is_quaternion)
+            if error <= tolerance:
+                good_idx, good_error = test_idx, error
+                step *= 2
+            else:
+                bad_idx = test_idx
+        while bad_idx is not None and bad_idx - good_idx > 1:
+            test_idx = (good_idx + bad_idx) // 2
+            error = interpolation_error(frames, values, anchor_idx, test_idx, is_quaternion)
+            if error <= tolerance:
+                good_idx, good_error = test_idx, error
+            else:
+                bad_idx = test_idx
+        max_error = max(max_error, good_error)
+        if good_idx == end_idx:
+            break
+        kept_idxs.append(good_idx)
+        anchor_idx = good_idx
+    return kept_idxs, max_error
+
+
+def interpolation_error(frames, values, start_idx, end_idx, is_quaternion):
+    """
+    Returns the largest difference between the keyframes strictly between start_idx and end_idx and the values
+    interpolated between the keyframes at start_idx and end_idx.
+    """
+    if end_idx - start_idx < 2:
+        return 0.
+    weights = (frames[start_idx + 1:end_idx] - frames[start_idx]) / (frames[end_idx] - frames[start_idx])
+    num_values = len(weights)
+    interpolated_values = interpolate_between(np.broadcast_to(values[start_idx], (num_values, values.shape[1])),
+                                              np.broadcast_to(values[end_idx], (num_values, values.shape[1])),
+                                              weights, is_quaternion)
+    return float(np.max(keyframe_errors(interpolated_values, values[start_idx + 1:end_idx], is_quaternion)))
+
+
+def keyframe_errors(values_1, values_2, is_quaternion):
+    """
+    Returns the largest difference between any component of each pair of rows. Quaternions q and -q represent the same
+    rotation, so they are compared against whichever sign of the other quaternion is closer.
+    """
+    errors = np.max(np.abs(values_1 - values_2), axis=1)
+    if is_quaternion:
+        errors = np.minimum(errors, np.max(np.abs(values_1 + values_2), axis=1))
+    return errors
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+def average_cache_miss_ratio(triangles, cache_size=16):
+    """
+    Simulates a FIFO post-transform vertex cache over a triangle list and returns the average number of cache misses
+    per triangle (ACMR). This lies between 0.5 for an ideal ordering of a large regular mesh and 3 for an ordering
+    that never reuses a cached vertex.
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+    if not len(triangles):
+        return 0.
+
+    cache_times = [-cache_size - 1] * (int(np.max(triangles)) + 1)
+    timestamp = 0
+    for idx in triangles.ravel().tolist():
+        if timestamp - cache_times[idx] > cache_size:
+            cache_times[idx] = timestamp
+            timestamp += 1
+    return timestamp / len(triangles)
+
+
+def tipsify(triangles, num_vertices, cache_size=16):
+    """
+    Returns an order for the triangles that improves post-transform vertex cache reuse, using the linear-time
+    'Tipsify' algorithm of Sander, Nehab and Barczak (2007).
+
+    Triangles are emitted by fanning around one vertex at a time. The next fanning vertex is picked from the vertices
+    of the triangles just emitted, preferring the one that has been in the cache longest while still being expected
+    to be in the cache once its remaining triangles are emitted. When no such vertex exists, the most recently
+    emitted vertex with triangles remaining is used instead, falling back to the next vertex in index order.
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+    flat_idxs = triangles.ravel()
+
+    # Adjacency in compressed sparse row form: the triangles using vertex v are
+    # adjacent_triangles[adjacency_offsets[v]:adjacency_offsets[v + 1]]
+    vertex_valences = np.bincount(flat_idxs, minlength=num_vertices)
+    adjacency_offsets = np.concatenate([[0], np.cumsum(vertex_valences)]).tolist()
+    adjacent_triangles = (np.argsort(flat_idxs, kind='stable') // 3).tolist()
+
+    triangle_list = triangles.tolist()
+    live_triangle_counts = vertex_valences.tolist()
+    cache_times = [0] * num_vertices
+    is_emitted = [False] * len(triangle_list)
+    dead_end_stack = []
+    triangle_order = []
+
+    timestamp = cache_size + 1
+    cursor = 0
+    fanning_vertex = 0 if len(triangle_list) else -1
+    while fanning_vertex >= 0:
+        candidates = []
+        for tri_idx in adjacent_triangles[adjacency_offsets[fanning_vertex]:adjacency_offsets[fanning_vertex + 1]]:
+            if is_emitted[tri_idx]:
+                continue
+            for idx in triangle_list[tri_idx]:
+                dead_end_stack.append(idx)
+                candidates.append(idx)
+                live_triangle_counts[idx] -= 1
+                if timestamp - cache_times[idx] > cache_size:
+                    cache_times[idx] = timestamp
+                    timestamp += 1
+            is_emitted[tri_idx] = True
+            triangle_order.append(tri_idx)
+
+        # Pick the next fanning vertex from the one-ring of the current one
+        fanning_vertex = -1
+        best_priority = -1
+        for idx in candidates:
+            if live_triangle_counts[idx] > 0:
+                priority = 0
+                if timestamp - cache_times[idx] + 2 * live_triangle_counts[idx] <= cache_size:
+                    priority = timestamp - cache_times[idx]
+                if priority > best_priority:
+                    best_priority = priority
+                    fanning_vertex = idx
+
+        # Otherwise skip the dead end
+        if fanning_vertex == -1:
+            while len(dead_end_stack):
+                idx = dead_end_stack.pop()
+                if live_triangle_counts[idx] > 0:
+                    fanning_vertex = idx
+                    break
+        if fanning_vertex == -1:
+            while cursor < num_vertices:
+                cursor += 1
+                if live_triangle_counts[cursor - 1] > 0:
+                    fanning_vertex = cursor - 1
+                    break
+
+    return np.array(triangle_order, dtype=np.int64)
+
+
+def order_vertices_by_first_use(triangles, num_vertices):
+    """
+    Returns an order for the vertices that places them in the order they are first used by the triangles, with any
+    unused vertices kept at the end in their original order, and the triangles re-indexed to match that order.
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape((-1, 3))
+    first_uses = np.full(num_vertices, triangles.size, dtype=np.int64)
+    used_idxs, first_use_positions = np.unique(triangles.ravel(), return_index=True)
+    first_uses[used_idxs] = first_use_positions
+
+    vertex_order = np.argsort(first_uses, kind='stable')
+    new_idxs = np.empty(num_vertices, dtype=np.int64)
+    new_idxs[vertex_order] = np.arange(num_vertices)
+    return vertex_order, new_idxs[triangles]
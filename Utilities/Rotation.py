@@ -3,49 +3,104 @@ import numpy as np
 
 def rotation_matrix_to_quat(matrix):
     """
+    Converts rotation matrices to XYZW quaternions. Accepts a single (3, 3) matrix or an (..., 3, 3) array of them, and
+    returns a (4,) or (..., 4) array to match.
+
     Ref: http://www.euclideanspace.com/maths/geometry/rotations/conversions/matrixToQuaternion/
     """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    batch_shape = matrix.shape[:-2]
+    matrix = matrix.reshape((-1, 3, 3))
+
     # Will probably be more numerically stable to just pick the largest out of each diag element + trace than checking
     # if Tr > 0
-    tr = np.trace(matrix)
-    test_array = np.array([*matrix.diagonal(), tr])
-    largest_result_idx = test_array.argmax()
-
-    quat = np.zeros(4)
-    if largest_result_idx == 3:
-        S = np.sqrt(1. + tr) * 2
-        quat[3] = 0.25*S  # W
-        quat[0] = (matrix[2, 1] - matrix[1, 2]) / S  # X
-        quat[1] = (matrix[0, 2] - matrix[2, 0]) / S  # Y
-        quat[2] = (matrix[1, 0] - matrix[0, 1]) / S  # Z
-    else:
-        i = largest_result_idx
+    tr = np.trace(matrix, axis1=1, axis2=2)
+    test_array = np.concatenate([np.diagonal(matrix, axis1=1, axis2=2), tr[:, np.newaxis]], axis=1)
+    largest_result_idxs = test_array.argmax(axis=1)
+
+    quat = np.zeros((len(matrix), 4))
+    is_largest = largest_result_idxs == 3
+    m = matrix[is_largest]
+    S = np.sqrt(1. + tr[is_largest]) * 2
+    quat[is_largest, 3] = 0.25*S  # W
+    quat[is_largest, 0] = (m[:, 2, 1] - m[:, 1, 2]) / S  # X
+    quat[is_largest, 1] = (m[:, 0, 2] - m[:, 2, 0]) / S  # Y
+    quat[is_largest, 2] = (m[:, 1, 0] - m[:, 0, 1]) / S  # Z
+    for i in range(3):
         j = (i + 1) % 3
         k = (j + 1) % 3
 
-        S = np.sqrt(1. - tr + 2*matrix[i, i]) * 2
-        quat[3] = (matrix[k, j] - matrix[j, k]) / S
-        quat[i] = 0.25*S
-        quat[j] = (matrix[j, i] + matrix[i, j]) / S
-        quat[k] = (matrix[k, i] + matrix[i, k]) / S
+        is_largest = largest_result_idxs == i
+        m = matrix[is_largest]
+        S = np.sqrt(1. - tr[is_largest] + 2*m[:, i, i]) * 2
+        quat[is_largest, 3] = (m[:, k, j] - m[:, j, k]) / S
+        quat[is_largest, i] = 0.25*S
+        quat[is_largest, j] = (m[:, j, i] + m[:, i, j]) / S
+        quat[is_largest, k] = (m[:, k, i] + m[:, i, k]) / S
 
-    return quat
+    return quat.reshape((*batch_shape, 4))
 
 
 def quat_to_matrix(quat):
-    quat = np.array(quat)
-    x, y, z, w = quat
-    x2, y2, z2, w2 = quat**2
+    """
+    Converts XYZW quaternions to rotation matrices. Accepts a single quaternion or an (..., 4) array of them, and
+    returns a (3, 3) or (..., 3, 3) array to match.
+    """
+    quat = np.asarray(quat, dtype=np.float64)
+    x, y, z, w = np.moveaxis(quat, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(quat**2, -1, 0)
 
-    return 2*np.array([[.5 - y2 - z2,   x*y - z*w,   x*z + y*w],
-                       [   x*y + z*w, .5 - x2 - z2,   y*z - x*w],
-                       [   x*z - y*w,   y*z + x*w, .5 - x2 - y2]])
+    matrix = np.empty((*quat.shape[:-1], 3, 3))
+    matrix[..., 0, 0] = .5 - y2 - z2
+    matrix[..., 0, 1] = x*y - z*w
+    matrix[..., 0, 2] = x*z + y*w
+    matrix[..., 1, 0] = x*y + z*w
+    matrix[..., 1, 1] = .5 - x2 - z2
+    matrix[..., 1, 2] = y*z - x*w
+    matrix[..., 2, 0] = x*z - y*w
+    matrix[..., 2, 1] = y*z + x*w
+    matrix[..., 2, 2] = .5 - x2 - y2
+    return 2*matrix
 
 
-def bone_matrix_from_rotation_location(quaternion, position):
-    bone_matrix = np.zeros((4, 4))
-    bone_matrix[:3, :3] = quat_to_matrix(quaternion)
-    bone_matrix[:3, 3] = position
-    bone_matrix[3, 3] = 1
+def bone_matrix_from_rotation_location(quaternion, position, scale=None):
+    """
+    Builds 4x4 transformation matrices that scale, then rotate by an XYZW quaternion, then translate. Accepts single
+    transforms or (..., 4), (..., 3), and (..., 3) arrays of them, and returns a (4, 4) or (..., 4, 4) array to match.
+    """
+    rotation = quat_to_matrix(quaternion)
+    if scale is not None:
+        rotation *= np.asarray(scale)[..., np.newaxis, :]
+
+    bone_matrix = np.zeros((*rotation.shape[:-2], 4, 4))
+    bone_matrix[..., :3, :3] = rotation
+    bone_matrix[..., :3, 3] = position
+    bone_matrix[..., 3, 3] = 1
 
     return bone_matrix
+
+
+def rotation_location_scale_from_bone_matrix(bone_matrix):
+    """
+    Splits 4x4 transformation matrices without shear or mirroring into XYZW quaternions, positions, and scales; the
+    inverse of bone_matrix_from_rotation_location. Accepts a single matrix or an (..., 4, 4) array of them.
+    """
+    bone_matrix = np.asarray(bone_matrix, dtype=np.float64)
+    scale = np.linalg.norm(bone_matrix[..., :3, :3], axis=-2)
+    rotation = bone_matrix[..., :3, :3] / scale[..., np.newaxis, :]
+
+    return rotation_matrix_to_quat(rotation), bone_matrix[..., :3, 3], scale
+
+
+def xyzw_to_wxyz(quat):
+    """
+    Converts quaternions from the XYZW ordering of the skel files to the WXYZ ordering of the anim files and Blender.
+    """
+    return np.roll(quat, 1, axis=-1)
+
+
+def wxyz_to_xyzw(quat):
+    """
+    Converts quaternions from the WXYZ ordering of the anim files and Blender to the XYZW ordering of the skel files.
+    """
+    return np.roll(quat, -1, axis=-1)
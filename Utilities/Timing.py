@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+import time
+
+
+class StageTimer:
+    """
+    Accumulates the wall-clock time spent in named stages of a longer operation, so that the cost of each stage can
+    be reported once the operation is finished.
+    """
+    def __init__(self):
+        self.stage_times = {}
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_times[name] = self.stage_times.get(name, 0.) + time.perf_counter() - start_time
+
+    def report(self, title):
+        print(f"{title}: {sum(self.stage_times.values()):.3f}s")
+        for name, stage_time in self.stage_times.items():
+            print(f"    {name}: {stage_time:.3f}s")
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class VertexArrays:
+    """
+    A columnar container for mesh vertices.
+
+    Every vertex attribute (Position, Normal, UV, ...) is held as a single contiguous array with one row per vertex.
+    Skinning data is held as a pair of (num_vertices, max_groups) matrices: 'bone_indices' holds vertex group indices
+    and 'bone_weights' the matching weights. Within each row the non-zero weights are packed to the front, and unused
+    slots have an index and weight of 0.
+
+    Indexing or iterating over the container produces the older one-dictionary-per-vertex representation on demand,
+    for code that still works one vertex at a time.
+    """
+    skinning_keys = ('WeightedBoneID', 'BoneWeight')
+
+    def __init__(self, num_vertices=0):
+        self.num_vertices = num_vertices
+        self.attributes = {}
+        self.bone_indices = None
+        self.bone_weights = None
+
+    @classmethod
+    def from_dicts(cls, vertices):
+        """
+        Builds the columnar representation from a list of per-vertex dictionaries.
+        """
+        vertex_arrays = cls(len(vertices))
+        if not len(vertices):
+            return vertex_arrays
+
+        for key in vertices[0]:
+            if key not in cls.skinning_keys:
+                vertex_arrays.set_attribute(key, [vertex[key] for vertex in vertices])
+
+        if 'WeightedBoneID' in vertices[0]:
+            bone_indices = [vertex['WeightedBoneID'] or [] for vertex in vertices]
+            bone_weights = [vertex['BoneWeight'] or [] for vertex in vertices]
+            max_groups = max([len(vertex_bone_indices) for vertex_bone_indices in bone_indices])
+            index_matrix = np.zeros((len(vertices), max_groups), dtype=np.int64)
+            weight_matrix = np.zeros((len(vertices), max_groups), dtype=np.float32)
+            for i, (vertex_bone_indices, vertex_bone_weights) in enumerate(zip(bone_indices, bone_weights)):
+                index_matrix[i, :len(vertex_bone_indices)] = vertex_bone_indices
+                weight_matrix[i, :len(vertex_bone_weights)] = vertex_bone_weights
+            vertex_arrays.set_skinning(index_matrix, weight_matrix)
+
+        return vertex_arrays
+
+    def set_attribute(self, key, data):
+        data = np.ascontiguousarray(data)
+        assert len(data) == self.num_vertices, \
+            f"Attribute '{key}' has {len(data)} entries, but there are {self.num_vertices} vertices."
+        if data.ndim == 1:
+            data = data.reshape((-1, 1))
+        self.attributes[key] = data
+
+    def set_skinning(self, bone_indices, bone_weights):
+        """
+        Stores the skinning matrices, moving non-zero weights to the front of each row and zeroing unused slots.
+        """
+        bone_indices = np.asarray(bone_indices)
+        bone_weights = np.asarray(bone_weights)
+        if bone_indices.ndim == 1:
+            bone_indices = bone_indices.reshape((-1, 1))
+        if bone_weights.ndim == 1:
+            bone_weights = bone_weights.reshape((-1, 1))
+        assert bone_indices.shape == bone_weights.shape, \
+            f"Bone index matrix has shape {bone_indices.shape}, but bone weight matrix has shape {bone_weights.shape}."
+
+        unused_slots = bone_weights == 0
+        packing_order = np.argsort(unused_slots, axis=1, kind='stable')
+        bone_indices = np.take_along_axis(bone_indices, packing_order, axis=1)
+        bone_weights = np.take_along_axis(bone_weights, packing_order, axis=1)
+        unused_slots = np.take_along_axis(unused_slots, packing_order, axis=1)
+
+        self.bone_indices = np.where(unused_slots, 0, bone_indices)
+        self.bone_weights = np.where(unused_slots, 0, bone_weights)
+
+    @property
+    def groups_per_vertex(self):
+        if self.bone_weights is None:
+            return np.zeros(self.num_vertices, dtype=np.int64)
+        return np.count_nonzero(self.bone_weights, axis=1)
+
+    @property
+    def max_groups_per_vertex(self):
+        if self.num_vertices == 0:
+            return 0
+        return int(np.max(self.groups_per_vertex))
+
+    def copy(self):
+        """
+        Returns a new container sharing the same arrays, so that attributes can be replaced without affecting this one.
+        """
+        vertex_arrays = VertexArrays(self.num_vertices)
+        vertex_arrays.attributes = dict(self.attributes)
+        vertex_arrays.bone_indices = self.bone_indices
+        vertex_arrays.bone_weights = self.bone_weights
+        return vertex_arrays
+
+    def take(self, vertex_idxs):
+        """
+        Returns a new container holding the vertices at the given indices, in the given order.
+        """
+        vertex_idxs = np.asarray(vertex_idxs, dtype=np.int64)
+        vertex_arrays = VertexArrays(len(vertex_idxs))
+        vertex_arrays.attributes = {key: value[vertex_idxs] for key, value in self.attributes.items()}
+        if self.bone_indices is not None:
+            vertex_arrays.bone_indices = self.bone_indices[vertex_idxs]
+            vertex_arrays.bone_weights = self.bone_weights[vertex_idxs]
+        return vertex_arrays
+
+    def to_dicts(self):
+        return [self[i] for i in range(self.num_vertices)]
+
+    def __len__(self):
+        return self.num_vertices
+
+    def __contains__(self, key):
+        if key in self.skinning_keys:
+            return self.bone_indices is not None
+        return key in self.attributes
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.num_vertices
+        if not 0 <= idx < self.num_vertices:
+            raise IndexError(f"Vertex index {idx} is out of range for {self.num_vertices} vertices.")
+
+        vertex = {key: value[idx] for key, value in self.attributes.items()}
+        if self.bone_indices is not None:
+            num_groups = np.count_nonzero(self.bone_weights[idx])
+            vertex['WeightedBoneID'] = self.bone_indices[idx, :num_groups].tolist()
+            vertex['BoneWeight'] = self.bone_weights[idx, :num_groups].tolist()
+        return vertex
+
+    def __iter__(self):
+        for i in range(self.num_vertices):
+            yield self[i]
+
+    @property
+    def nbytes(self):
+        arrays = [*self.attributes.values(), self.bone_indices, self.bone_weights]
+        return sum([array.nbytes for array in arrays if array is not None])